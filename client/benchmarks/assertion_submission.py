@@ -0,0 +1,187 @@
+"""Benchmark submitting identity assertions to a stand-in authentication
+server.
+
+Submissions per second are measured with a shared AssertionSubmitter, which
+reuses keep-alive connections, and with a new connection per submission,
+along with the number of connections the server accepted. The connection
+attempts of a submission after the server has closed all the pooled
+connections (as servers do with idle connections) are also counted; the
+stale connections should be dropped without sending over them, so that only
+a new connection is tried. Finally, the requests the server received for a
+submission whose response timed out are counted; it must not be retried, as
+the server may have processed it.
+
+Usage: python -m benchmarks.assertion_submission [submissions]
+
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import socket
+from SocketServer import ThreadingMixIn
+import sys
+import threading
+import time
+
+from keypairauthclient import authengine
+
+HANG_SECONDS = 1
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Accepts any submission, keeping connections alive."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+            self.server.accepted += 1
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+        BaseHTTPRequestHandler.finish(self)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.posts[self.path] = \
+                self.server.posts.get(self.path, 0) + 1
+        if self.path == "/hang":
+            # Respond after the submitter has timed out
+            time.sleep(HANG_SECONDS)
+        elif self.path == "/slow":
+            # Keep the connection busy so that concurrent submissions each
+            # open their own
+            time.sleep(0.2)
+        body = json.dumps({'success': True})
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StandInServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _StandInHandler)
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.accepted = 0
+        # path -> number of POST requests received
+        self.posts = {}
+
+    def handle_error(self, request, client_address):
+        # Responses to timed out submissions fail to be written
+        pass
+
+    def close_connections(self):
+        """Close all the open connections, like an idle timeout would."""
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class _CountingSubmitter(authengine.AssertionSubmitter):
+    """An AssertionSubmitter counting the connections it tries."""
+
+    def __init__(self, *args, **kwargs):
+        authengine.AssertionSubmitter.__init__(self, *args, **kwargs)
+        self.attempts = 0
+
+    def _get_connection(self, origin):
+        self.attempts += 1
+        return authengine.AssertionSubmitter._get_connection(self, origin)
+
+
+def measure(server, auth_url, submissions, reuse):
+    """Return the submissions per second and the connections the server
+    accepted, submitting with a shared submitter if reuse is True."""
+    accepted = server.accepted
+    submitter = authengine.AssertionSubmitter()
+    start_time = time.time()
+    for i in xrange(submissions):
+        if not reuse:
+            submitter = authengine.AssertionSubmitter()
+        submitter.submit(auth_url, "assertion{0}".format(i),
+                         authengine.MODE_AUTH, "c2lnbmF0dXJl")
+        if not reuse:
+            submitter.close()
+    elapsed = time.time() - start_time
+    submitter.close()
+    return {'submissions_per_second': submissions / elapsed,
+            'connections': server.accepted - accepted}
+
+
+def measure_stale_pool(server, auth_url):
+    """Return the connections tried by a submission after the server closed
+    all the pooled connections."""
+    submitter = _CountingSubmitter()
+    slow_url = auth_url.rsplit("/", 1)[0] + "/slow"
+    threads = [threading.Thread(target=submitter.submit,
+                                args=(slow_url, "assertion",
+                                      authengine.MODE_AUTH, "c2lnbmF0dXJl"))
+               for i in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    server.close_connections()
+    time.sleep(0.1)
+    submitter.attempts = 0
+    submitter.submit(auth_url, "assertion", authengine.MODE_AUTH,
+                     "c2lnbmF0dXJl")
+    attempts = submitter.attempts
+    submitter.close()
+    return attempts
+
+
+def measure_timed_out(server, auth_url):
+    """Return the requests the server received for a submission whose
+    response timed out."""
+    submitter = authengine.AssertionSubmitter(timeout=HANG_SECONDS / 4.0)
+    hang_url = auth_url.rsplit("/", 1)[0] + "/hang"
+    try:
+        submitter.submit(hang_url, "assertion", authengine.MODE_AUTH,
+                         "c2lnbmF0dXJl")
+    except authengine.SubmissionError:
+        pass
+    submitter.close()
+    # Let any retried request arrive
+    time.sleep(HANG_SECONDS)
+    return server.posts.get("/hang", 0)
+
+
+def run(submissions=500):
+    server = _StandInServer()
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    auth_url = "http://127.0.0.1:{0}/login".format(server.server_address[1])
+    try:
+        return {'reused': measure(server, auth_url, submissions, True),
+                'new_connections': measure(server, auth_url, submissions,
+                                           False),
+                'stale_pool_attempts': measure_stale_pool(server, auth_url),
+                'timed_out_requests': measure_timed_out(server, auth_url)}
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    submissions = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print json.dumps(run(submissions), indent=2, sort_keys=True)
@@ -0,0 +1,96 @@
+"""Benchmark batch signing of identity assertions.
+
+Signatures per second are measured for batches signed with one keypair (all
+the requests are for one site) and with many keypairs (each site has been used
+with a different keypair), both in one thread and across threads.
+
+Usage: python -m benchmarks.batch_signing [requests] [keypairs]
+
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from keypairauthclient import authengine
+from keypairauthclient import keypairengine
+from keypairauthclient import signing
+from keypairauthclient.keypairdb import KeypairRecord, KeypairSnapshot
+
+
+class _StandInKeypairDB():
+    """Just enough of a KeypairDB for a BatchSigner: a fixed snapshot."""
+
+    def __init__(self, records):
+        self._snapshot = KeypairSnapshot(0, records)
+
+    def snapshot(self):
+        return self._snapshot
+
+
+def make_keypairdb(dirname, keypairs):
+    """Generate keypair files and return a stand-in keypair database of them,
+    each keypair having been used with its own site."""
+    records = []
+    for i in xrange(keypairs):
+        keypair = keypairengine.generate()
+        filename = os.path.join(dirname, "keypair{0}.key".format(i))
+        with open(filename, 'w') as f:
+            f.write(keypair.exportKey())
+        records.append(KeypairRecord(
+            filename=filename, name="keypair{0}".format(i),
+            fingerprint=keypairengine.fingerprint(keypair), added=i,
+            last_used=i, use_count=1,
+            used_origins=("https://site{0}.example.com".format(i),),
+            on_interchangeable_storage=0, passphrased=0, available=True))
+    return _StandInKeypairDB(records)
+
+
+def measure(keypairdb, requests, threads):
+    """Return the signatures per second of signing a batch of requests."""
+    original_threshold = signing.SIGN_POOL_THRESHOLD
+    if threads == 1:
+        signing.SIGN_POOL_THRESHOLD = len(requests) + 1
+    try:
+        start_time = time.time()
+        results = list(signing.sign_batch(keypairdb, requests,
+                                          threads=threads))
+        elapsed = time.time() - start_time
+    finally:
+        signing.SIGN_POOL_THRESHOLD = original_threshold
+    if any(result.error is not None for result in results):
+        raise RuntimeError("signing failed")
+    return len(results) / elapsed
+
+
+def run(requests=2000, keypairs=20):
+    dirname = tempfile.mkdtemp()
+    try:
+        keypairdb = make_keypairdb(dirname, keypairs)
+        one_key_requests = [("https://site0.example.com/login", str(i),
+                             authengine.MODE_AUTH)
+                            for i in xrange(requests)]
+        many_key_requests = [("https://site{0}.example.com/login"
+                              .format(i % keypairs), str(i),
+                              authengine.MODE_AUTH)
+                             for i in xrange(requests)]
+        report = {}
+        for name, batch in (('one_key', one_key_requests),
+                            ('many_keys', many_key_requests)):
+            report[name] = {
+                'one_thread_signatures_per_second':
+                    measure(keypairdb, batch, 1),
+                'threaded_signatures_per_second':
+                    measure(keypairdb, batch, None)}
+        return report
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    keypairs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print json.dumps(run(requests, keypairs), indent=2, sort_keys=True)
@@ -0,0 +1,100 @@
+"""Benchmark loading large configuration files.
+
+A configuration file with a keypair database section per keypair (like the
+client's own configuration) is loaded by filename, which memory-maps it, and
+as a file object, which reads it into one string and splits it. Each load
+runs in its own process so that its peak memory can be measured.
+
+Usage: python -m benchmarks.config_load [keypairs] [repeats]
+
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from external.configobj import ConfigObj
+
+
+def make_config(filename, keypairs):
+    """Write a configuration file with a keypair database of keypairs."""
+    with open(filename, 'w') as f:
+        f.write("[keypairdb]\n")
+        for i in xrange(keypairs):
+            f.write("[[/home/user/Documents/My Keypairs/keypair{0}.key]]\n"
+                    .format(i))
+            f.write("name = keypair{0}\n".format(i))
+            f.write("fingerprint = {0:032x}\n".format(i))
+            f.write("added = {0}\n".format(1300000000 + i))
+            f.write("last_used = -1\n")
+            f.write("use_count = 0\n")
+            f.write("used_origins = ,\n")
+            f.write("on_interchangeable_storage = 0\n")
+            f.write("passphrased = 0\n")
+            f.write("available = True\n")
+
+
+def load(loader, filename):
+    """Load a configuration file in this process and return the seconds it
+    took and the peak memory of the process in kilobytes."""
+    start_time = time.time()
+    if loader == 'mapped':
+        ConfigObj(filename)
+    else:
+        with open(filename, 'rb') as f:
+            ConfigObj(f)
+    elapsed = time.time() - start_time
+
+    if resource is None:
+        peak_memory = None
+    else:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak_memory
+
+
+def measure(loader, filename, repeats):
+    """Return a dictionary of the best time and peak memory of loading a
+    configuration file in separate processes."""
+    times = []
+    peak_memories = []
+    for i in xrange(repeats):
+        output = subprocess.check_output([sys.executable, "-m",
+                                          "benchmarks.config_load",
+                                          "--load", loader, filename])
+        elapsed, peak_memory = json.loads(output)
+        times.append(elapsed)
+        peak_memories.append(peak_memory)
+    return {'seconds': min(times),
+            'peak_memory_kilobytes': max(peak_memories)}
+
+
+def run(keypairs=10000, repeats=3):
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirname, "config.ini")
+        make_config(filename, keypairs)
+        report = {'file_bytes': os.path.getsize(filename)}
+        for loader in ('mapped', 'read'):
+            report[loader] = measure(loader, filename, repeats)
+        return report
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--load"]:
+        print json.dumps(load(sys.argv[2], sys.argv[3]))
+    else:
+        keypairs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+        repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+        print json.dumps(run(keypairs, repeats), indent=2, sort_keys=True)
@@ -0,0 +1,146 @@
+"""Benchmark bulk updates of the keypair list control.
+
+A list control of many keypairs is loaded, then keypairs are updated in place
+(their row stays where it is), renamed (their row moves), added and removed
+one at a time, as the keypair manager does when the results of checking
+keypair files arrive. The time per update is reported in microseconds.
+
+Usage: python -m benchmarks.keypair_list_updates [keypairs] [updates]
+
+"""
+
+import json
+import random
+import sys
+import time
+
+from external.configobj import ConfigObj
+from keypairauthclient.keypairdb import KeypairRecord
+from keypairauthgui import keypairmanager
+from pkg_resources import resource_stream
+import wx
+
+
+class _StandInSnapshot():
+    """Just enough of a KeypairSnapshot: records looked up by filename."""
+
+    def __init__(self, records):
+        self._records = records
+
+    def __iter__(self):
+        return self._records.itervalues()
+
+    def __getitem__(self, filename):
+        return self._records[filename]
+
+    def __contains__(self, filename):
+        return filename in self._records
+
+    @property
+    def filenames(self):
+        return tuple(self._records)
+
+
+class _StandInKeypairDB():
+    """Just enough of a KeypairDB for a KeypairListCtrl, so that only the list
+    control's own work is measured."""
+
+    def __init__(self, records):
+        self.records = dict((record.filename, record) for record in records)
+
+    def snapshot(self, sync=False):
+        return _StandInSnapshot(self.records)
+
+    def get_keypair_files_state(self, filenames=None):
+        if filenames is None:
+            filenames = self.records
+        return dict((filename, 1.0) for filename in filenames)
+
+    def get_keypair_file_state(self, filename):
+        return 1.0
+
+    def refresh_stale(self, filenames=None):
+        pass
+
+    def __getitem__(self, filename):
+        return {}
+
+    def __contains__(self, filename):
+        return filename in self.records
+
+    def add_refresh_listener(self, listener):
+        pass
+
+    def remove_refresh_listener(self, listener):
+        pass
+
+
+def make_record(i):
+    return KeypairRecord(
+        filename="/keypairs/keypair{0}.key".format(i),
+        name="keypair{0}".format(i), fingerprint="", added=i,
+        last_used=-1, use_count=0, used_origins=(),
+        on_interchangeable_storage=i % 2, passphrased=0, available=True)
+
+
+def measure(keypairdb, update, updates):
+    """Return the microseconds per call of update() with a batch of random
+    keypair filenames."""
+    filenames = random.sample(keypairdb.records, updates)
+    start_time = time.time()
+    for filename in filenames:
+        update(filename)
+    return (time.time() - start_time) / len(filenames) * 1e6
+
+
+def run(keypairs=10000, updates=1000):
+    app = wx.App(False)
+    frame = wx.Frame(None)
+    locale = ConfigObj(infile=resource_stream('keypairauthgui.res.locales',
+                                              "en-int.ini"))
+    keypairdb = _StandInKeypairDB(make_record(i) for i in xrange(keypairs))
+
+    start_time = time.time()
+    listctrl = keypairmanager.KeypairListCtrl(None, locale, keypairdb, frame,
+                                              style=wx.LC_REPORT)
+    report = {'load_seconds': time.time() - start_time}
+
+    def touch(filename):
+        record = keypairdb.records[filename]
+        record = record._replace(last_used=time.time())
+        keypairdb.records[filename] = record
+        listctrl._load_record(record, 1.0)
+
+    def rename(filename):
+        record = keypairdb.records[filename]
+        record = record._replace(
+            name="keypair{0}".format(random.randrange(keypairs)))
+        keypairdb.records[filename] = record
+        listctrl._load_record(record, 1.0)
+
+    new_keypairs = iter(xrange(keypairs, keypairs + updates))
+
+    def add(filename):
+        record = make_record(next(new_keypairs))
+        keypairdb.records[record.filename] = record
+        listctrl._load_record(record, 1.0)
+
+    def remove(filename):
+        del keypairdb.records[filename]
+        listctrl.remove(filename)
+
+    listctrl.select_filename(random.choice(list(keypairdb.records)))
+    for name, update in (('update_in_place', touch), ('rename', rename),
+                         ('add', add), ('remove', remove)):
+        report[name + '_microseconds'] = measure(keypairdb, update,
+                                                  updates)
+
+    frame.Destroy()
+    app.Destroy()
+    return report
+
+
+if __name__ == '__main__':
+    keypairs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print json.dumps(run(keypairs, updates), indent=2, sort_keys=True)
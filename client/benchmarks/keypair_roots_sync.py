@@ -0,0 +1,90 @@
+"""Benchmark reconciling the keypair database with a large My Keypairs
+directory.
+
+The keypair database holds a keypair for each of many files in the My
+Keypairs directory, which also holds as many files again that are tagged as
+removed. The time of the first synchronisation (a full reconciliation), of a
+synchronisation with nothing changed, and of one after some files were added
+and deleted is reported in seconds.
+
+Usage: python -m benchmarks.keypair_roots_sync [keypairs] [changes]
+
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from keypairauthclient.config import Config
+from keypairauthclient.keypairdb import KeypairDB
+
+
+def make_keypairdb(dirname, keypairs):
+    """Return a keypair database of keypairs in a new My Keypairs directory,
+    with as many removed keypair files alongside them."""
+    my_keypairs_dir = os.path.join(dirname, "My Keypairs")
+    os.mkdir(my_keypairs_dir)
+    config = Config(os.path.join(dirname, "config.ini"))
+
+    removed = []
+    for i in xrange(keypairs * 2):
+        filename = os.path.join(my_keypairs_dir, "keypair{0}.key".format(i))
+        open(filename, 'w').close()
+        if i % 2:
+            removed.append(filename)
+        else:
+            config['keypairdb'][filename] = {'added': time.time(),
+                                             'fingerprint': "{0:032x}"
+                                                            .format(i)}
+    config['keypairdb_meta']['removed'] = removed
+    config.validate()
+    config.save()
+
+    keypairdb = KeypairDB(config, my_keypairs_dir=my_keypairs_dir,
+                          sync_my_keypairs_dir=True)
+    # Don't reuse file states between the synchronisations measured
+    keypairdb.file_state_lifetime = 0
+    return keypairdb
+
+
+def measure(keypairdb):
+    """Return the seconds a synchronisation with the keypair roots takes."""
+    start_time = time.time()
+    keypairdb.snapshot(sync=True)
+    return time.time() - start_time
+
+
+def run(keypairs=10000, changes=100):
+    dirname = tempfile.mkdtemp()
+    try:
+        keypairdb = make_keypairdb(dirname, keypairs)
+        report = {'first_sync_seconds': measure(keypairdb),
+                  'unchanged_sync_seconds': measure(keypairdb)}
+
+        # Delete keypair files and add files that aren't keypairs (which
+        # fail to import)
+        my_keypairs_dir = keypairdb.my_keypairs_dir
+        for i in xrange(changes):
+            os.unlink(os.path.join(my_keypairs_dir,
+                                   "keypair{0}.key".format(i * 2)))
+            open(os.path.join(my_keypairs_dir, "new{0}.key".format(i)),
+                 'w').close()
+        # Let the directory's modification time settle (see
+        # KeypairDB._stat_dir())
+        time.sleep(1)
+        report['changed_sync_seconds'] = measure(keypairdb)
+
+        if len(keypairdb.snapshot()) != keypairs - changes:
+            raise RuntimeError("synchronisation failed")
+        return report
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    keypairs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    changes = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print json.dumps(run(keypairs, changes), indent=2, sort_keys=True)
@@ -0,0 +1,347 @@
+"""Load test the invocation verifier's /verify_invocation endpoint.
+
+Concurrent keep-alive clients send a configurable mix of requests:
+
+    verify: Verifying POST requests for pending verifications.
+    preflight: CORS preflight OPTIONS requests.
+    malformed: POST requests with malformed JSON bodies.
+    oversized: POST requests with bodies over authengine.MAX_BODY_SIZE.
+    notfound: Requests for other paths.
+
+Throughput, latency percentiles per request kind, error classes (HTTP status
+codes, connection errors and timeouts) and the server's memory usage over
+time are reported as JSON.
+
+By default a verifier is started in a child process (with the server
+implementation chosen by --server), so that verifying requests succeed and
+its memory usage can be sampled apart from the clients, which run in this
+process. Samples are taken where /proc is available, and the verifier's peak
+memory usage is reported where the resource module is. With --port, an
+already running verifier is tested instead, and --pid can be given to sample
+its memory usage.
+
+Usage: python -m benchmarks.loadtest [options]
+
+"""
+
+import httplib
+import itertools
+import json
+import optparse
+import os
+import random
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from keypairauthclient import authengine
+from benchmarks.verify_invocation_latency import percentile
+
+REQUEST_KINDS = ('verify', 'preflight', 'malformed', 'oversized', 'notfound')
+DEFAULT_MIX = "verify=60,preflight=20,malformed=10,oversized=5,notfound=5"
+
+AUTH_URL = "https://example.com/login"
+ORIGIN = "https://example.com"
+
+
+def parse_mix(mix):
+    """Parse a 'kind=weight,...' request mix string into a list of (kind,
+    weight) tuples."""
+    weights = []
+    for entry in mix.split(","):
+        kind, weight = entry.split("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError("unknown request kind: " + kind)
+        weights.append((kind, float(weight)))
+    return weights
+
+
+def choose_kind(weights, rng):
+    """Choose a request kind at random according to a request mix."""
+    point = rng.uniform(0, sum(weight for kind, weight in weights))
+    for kind, weight in weights:
+        point -= weight
+        if point <= 0:
+            return kind
+    return weights[-1][0]
+
+
+def get_rss(pid):
+    """Return the resident set size of a process in kilobytes, or None if it
+    can't be determined."""
+    try:
+        with open("/proc/" + str(pid) + "/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def serve(server, identity_assertions, timeout):
+    """Start a verifier with pending verifications in this process and serve
+    until standard input is closed.
+
+    A line is written to standard output once the verifier accepts
+    connections, and another with its peak memory usage (or null) when it
+    stops.
+
+    Arguments:
+        server: Server implementation of the verifier.
+        identity_assertions: Identity assertions of the pending verifications.
+        timeout: Seconds before the pending verifications expire.
+
+    """
+    authengine.set_verifier_server(server)
+    for identity_assertion in identity_assertions:
+        authengine.verify_invocation_async(AUTH_URL, identity_assertion,
+                                           authengine.MODE_AUTH,
+                                           timeout=timeout)
+    # Wait for the server to accept connections
+    time.sleep(0.5)
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+
+    sys.stdin.read()
+    if resource is None:
+        peak_memory = None
+    else:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout.write(json.dumps(peak_memory) + "\n")
+    sys.stdout.flush()
+    # Don't wait for the pending verifications
+    os._exit(0)
+
+
+class LoadTest():
+    """A load test run against a verifier.
+
+    Arguments:
+        port: Port of the verifier on 127.0.0.1.
+        weights: Request mix as a list of (kind, weight) tuples.
+        concurrency: Number of concurrent clients.
+        duration: Seconds to run for.
+        identity_assertions: Identity assertions of the pending verifications
+                             to send verifying requests for.
+        timeout: Seconds to wait for a response before counting a timeout.
+        pid: Process ID of the verifier, to sample the memory usage of.
+        sample_interval: Seconds in between memory usage samples.
+
+    """
+
+    def __init__(self, port, weights, concurrency, duration,
+                 identity_assertions, timeout=5, pid=None,
+                 sample_interval=0.5):
+        self._port = port
+        self._weights = weights
+        self._concurrency = concurrency
+        self._duration = duration
+        self._identity_assertions = identity_assertions
+        self._timeout = timeout
+        self._pid = pid
+        self._sample_interval = sample_interval
+
+        self._lock = threading.Lock()
+        self._latencies = dict((kind, []) for kind in REQUEST_KINDS)
+        self._outcomes = dict((kind, {}) for kind in REQUEST_KINDS)
+        self._memory_samples = []
+        self._next_assertion = itertools.cycle(identity_assertions).next
+        self._stop_time = None
+
+    def _build_request(self, kind):
+        """Return a (method, path, body, headers) tuple of a request."""
+        headers = {'Host': "localhost:" + str(self._port),
+                   'Origin': ORIGIN,
+                   'Content-Type': "application/json",
+                   'Accept': "application/json"}
+        path = "/verify_invocation"
+        if kind == 'verify':
+            with self._lock:
+                identity_assertion = self._next_assertion()
+            body = json.dumps({'auth_url': AUTH_URL,
+                               'identity_assertion': identity_assertion,
+                               'mode': authengine.MODE_AUTH})
+            return 'POST', path, body, headers
+        elif kind == 'preflight':
+            return 'OPTIONS', path, "", headers
+        elif kind == 'malformed':
+            return 'POST', path, '{"auth_url": ', headers
+        elif kind == 'oversized':
+            return 'POST', path, "x" * (authengine.MAX_BODY_SIZE + 1), headers
+        else:
+            return 'GET', "/", "", headers
+
+    def _record(self, kind, outcome, latency):
+        with self._lock:
+            outcomes = self._outcomes[kind]
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if latency is not None:
+                self._latencies[kind].append(latency)
+
+    def _client(self, seed):
+        """Send requests over a keep-alive connection until the test ends,
+        reconnecting whenever the connection is closed."""
+        rng = random.Random(seed)
+        connection = None
+        while time.time() < self._stop_time:
+            kind = choose_kind(self._weights, rng)
+            method, path, body, headers = self._build_request(kind)
+            if connection is None:
+                connection = httplib.HTTPConnection('127.0.0.1', self._port,
+                                                    timeout=self._timeout)
+            start_time = time.time()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except socket.timeout:
+                self._record(kind, 'timeout', None)
+                connection.close()
+                connection = None
+                continue
+            except (socket.error, httplib.HTTPException), e:
+                self._record(kind, 'connection_error:' + type(e).__name__,
+                             None)
+                connection.close()
+                connection = None
+                continue
+            self._record(kind, str(response.status),
+                         (time.time() - start_time) * 1000)
+            if response.will_close:
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+
+    def _sample_memory(self, start_time):
+        while time.time() < self._stop_time:
+            rss = get_rss(self._pid)
+            if rss is not None:
+                self._memory_samples.append(
+                    {'time': round(time.time() - start_time, 3),
+                     'rss_kb': rss})
+            time.sleep(self._sample_interval)
+
+    def run(self):
+        """Run the load test, returning its report as a dictionary."""
+        start_time = time.time()
+        self._stop_time = start_time + self._duration
+
+        threads = [threading.Thread(target=self._client, args=(i,))
+                   for i in xrange(self._concurrency)]
+        if self._pid is not None:
+            threads.append(threading.Thread(target=self._sample_memory,
+                                            args=(start_time,)))
+        for load_thread in threads:
+            load_thread.daemon = True
+            load_thread.start()
+        for load_thread in threads:
+            load_thread.join()
+        elapsed = time.time() - start_time
+
+        kinds = {}
+        total_requests = 0
+        for kind in REQUEST_KINDS:
+            requests = sum(self._outcomes[kind].values())
+            if not requests:
+                continue
+            total_requests += requests
+            latencies = sorted(self._latencies[kind])
+            kind_report = {'requests': requests,
+                           'outcomes': self._outcomes[kind]}
+            if latencies:
+                kind_report['latency_ms'] = {
+                    'p50': percentile(latencies, 0.5),
+                    'p90': percentile(latencies, 0.9),
+                    'p99': percentile(latencies, 0.99),
+                    'max': latencies[-1]}
+            kinds[kind] = kind_report
+
+        return {'duration': elapsed,
+                'concurrency': self._concurrency,
+                'requests': total_requests,
+                'requests_per_second': total_requests / elapsed,
+                'kinds': kinds,
+                'memory': self._memory_samples}
+
+
+def main():
+    parser = optparse.OptionParser(usage="python -m benchmarks.loadtest "
+                                         "[options]")
+    parser.add_option('-c', '--concurrency', type='int', default=16,
+                      help="number of concurrent clients [%default]")
+    parser.add_option('-d', '--duration', type='float', default=10,
+                      help="seconds to run for [%default]")
+    parser.add_option('-m', '--mix', default=DEFAULT_MIX,
+                      help="request mix as kind=weight pairs [%default]")
+    parser.add_option('-s', '--server', default=authengine.verifier_server,
+                      choices=[authengine.SERVER_CHERRYPY,
+                               authengine.SERVER_ASYNCORE],
+                      help="server implementation of the in-process "
+                           "verifier [%default]")
+    parser.add_option('-n', '--pending', type='int', default=10000,
+                      help="number of pending verifications of the "
+                           "in-process verifier [%default]")
+    parser.add_option('-p', '--port', type='int',
+                      help="test an already running verifier on this port")
+    parser.add_option('--pid', type='int',
+                      help="process ID of the running verifier, to sample "
+                           "its memory usage")
+    parser.add_option('-t', '--timeout', type='float', default=5,
+                      help="seconds to wait for each response [%default]")
+    parser.add_option('-o', '--output',
+                      help="file to write the JSON report to [stdout]")
+    parser.add_option('--serve', action='store_true',
+                      help=optparse.SUPPRESS_HELP)
+    options = parser.parse_args()[0]
+
+    identity_assertions = [str(i) for i in xrange(options.pending)]
+    if options.serve:
+        serve(options.server, identity_assertions, options.duration + 60)
+    if options.port is None:
+        port = authengine.VERIFIER_ADDRESS[1]
+        verifier = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.loadtest", "--serve",
+             "--server", options.server,
+             "--pending", str(options.pending),
+             "--duration", str(options.duration)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        verifier.stdout.readline()
+        pid = verifier.pid
+    else:
+        port = options.port
+        pid = options.pid
+
+    load_test = LoadTest(port, parse_mix(options.mix), options.concurrency,
+                         options.duration, identity_assertions,
+                         timeout=options.timeout, pid=pid)
+    try:
+        report = load_test.run()
+    finally:
+        if options.port is None:
+            verifier.stdin.close()
+            peak_memory = json.loads(verifier.stdout.readline() or "null")
+            verifier.wait()
+    if options.port is None:
+        report['server'] = options.server
+        report['server_peak_memory'] = peak_memory
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report_json + "\n")
+    else:
+        print report_json
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the throughput and latency of the invocation verifier's HTTP
+server implementations.
+
+Concurrent keep-alive clients send verifying POST requests for pending
+verifications to each server implementation in turn, and the requests per
+second and latency percentiles are reported.
+
+Usage: python -m benchmarks.verifier_throughput [clients] [requests]
+
+"""
+
+import httplib
+import json
+import sys
+import threading
+import time
+
+from keypairauthclient import authengine
+from benchmarks.verify_invocation_latency import percentile
+
+BASE_PORT = 24480
+
+
+def client(port, params_list, latencies):
+    """Send a verifying request for each (auth_url, identity_assertion, mode)
+    tuple over one connection, appending the latencies in milliseconds."""
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+    headers = {'Host': "localhost:" + str(port),
+               'Origin': "https://example.com",
+               'Content-Type': "application/json",
+               'Accept': "application/json"}
+    for auth_url, identity_assertion, mode in params_list:
+        body = json.dumps({'auth_url': auth_url,
+                           'identity_assertion': identity_assertion,
+                           'mode': mode})
+        start_time = time.time()
+        connection.request('POST', "/verify_invocation", body, headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append((time.time() - start_time) * 1000)
+    connection.close()
+
+
+def run(server, port, clients=16, requests=4000):
+    """Benchmark a server implementation, returning a dictionary of
+    statistics."""
+    verifier = authengine._InvocationVerifier(address=('127.0.0.1', port),
+                                              server=server)
+    params_list = [("https://example.com/login", str(i), authengine.MODE_AUTH)
+                   for i in xrange(requests)]
+    futures = [verifier.register(auth_url, identity_assertion, mode, 60)
+               for auth_url, identity_assertion, mode in params_list]
+    # Wait for the server to accept connections
+    time.sleep(0.5)
+
+    latencies = []
+    threads = [threading.Thread(target=client,
+                                args=(port, params_list[i::clients],
+                                      latencies))
+               for i in xrange(clients)]
+    start_time = time.time()
+    for client_thread in threads:
+        client_thread.start()
+    for client_thread in threads:
+        client_thread.join()
+    elapsed = time.time() - start_time
+
+    latencies.sort()
+    return {'requests_per_second': requests / elapsed,
+            'verified': sum(1 for future in futures if future.result(0)),
+            'p50_ms': percentile(latencies, 0.5),
+            'p99_ms': percentile(latencies, 0.99)}
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    servers = [authengine.SERVER_ASYNCORE]
+    if authengine.imported_cherrypy:
+        servers.append(authengine.SERVER_CHERRYPY)
+    report = {}
+    for i, server in enumerate(servers):
+        report[server] = run(server, BASE_PORT + i, clients, requests)
+    print json.dumps(report, indent=2, sort_keys=True)
@@ -0,0 +1,86 @@
+"""Benchmark the latency of authengine invocation verification.
+
+A stand-in browser client sends the verifying POST request to the local
+verifier (retrying until the verifier's server accepts connections), and the
+time from its response to the completion of the verification is measured, as
+well as the time of the whole verification.
+
+Usage: python -m benchmarks.verify_invocation_latency [runs]
+
+"""
+
+import httplib
+import json
+import socket
+import sys
+import time
+
+from keypairauthclient import authengine
+
+AUTH_URL = "https://example.com/login"
+IDENTITY_ASSERTION = "benchmark"
+
+
+def browser_verify(auth_url, identity_assertion, mode, timeout=2.5):
+    """Send the verifying request like a browser would, returning the time its
+    response was received."""
+    body = json.dumps({'auth_url': auth_url,
+                       'identity_assertion': identity_assertion,
+                       'mode': mode})
+    headers = {'Host': "localhost:2448",
+               'Origin': "https://example.com",
+               'Content-Type': "application/json",
+               'Accept': "application/json"}
+    give_up_time = time.time() + timeout
+    while True:
+        connection = httplib.HTTPConnection('127.0.0.1', 2448, timeout=timeout)
+        try:
+            connection.request('POST', "/verify_invocation", body, headers)
+            response = connection.getresponse()
+            response.read()
+            return time.time()
+        except socket.error:
+            if time.time() > give_up_time:
+                raise
+            time.sleep(0.001)
+        finally:
+            connection.close()
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def run(runs=50):
+    """Run the benchmark, returning a dictionary of latency statistics in
+    milliseconds."""
+    completion_latencies = []
+    total_latencies = []
+    for i in xrange(runs):
+        start_time = time.time()
+        future = authengine.verify_invocation_async(AUTH_URL,
+                                                    IDENTITY_ASSERTION,
+                                                    authengine.MODE_AUTH)
+        response_time = browser_verify(AUTH_URL, IDENTITY_ASSERTION,
+                                       authengine.MODE_AUTH)
+        if not future.result(timeout=5):
+            raise RuntimeError("invocation wasn't verified")
+        end_time = time.time()
+        completion_latencies.append(max(0, end_time - response_time) * 1000)
+        total_latencies.append((end_time - start_time) * 1000)
+
+    report = {}
+    for name, latencies in (('completion', completion_latencies),
+                            ('total', total_latencies)):
+        latencies.sort()
+        report[name] = {'mean': sum(latencies) / len(latencies),
+                        'p50': percentile(latencies, 0.5),
+                        'p99': percentile(latencies, 0.99),
+                        'max': latencies[-1]}
+    return report
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print json.dumps(run(runs), indent=2, sort_keys=True)
@@ -0,0 +1,387 @@
+"""Cross-platform abstraction for watching directories for file changes.
+
+Changes are reported to a callback in coalesced batches, as a dictionary
+mapping paths to one of CREATED, DELETED, MODIFIED or RESCAN. RESCAN is
+reported for a watched directory itself when its individual changes are
+unknown (e.g. it was unmounted, deleted, or events were lost) and it should be
+rescanned as a whole.
+
+Linux inotify is used through ctypes where available; elsewhere directories
+are polled.
+
+"""
+
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+CREATED = 'created'
+DELETED = 'deleted'
+MODIFIED = 'modified'
+RESCAN = 'rescan'
+
+imported_libc_inotify = False
+
+try:
+    # Linux
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+    _libc.inotify_add_watch
+    _libc.inotify_rm_watch
+    imported_libc_inotify = True
+except (ImportError, OSError, AttributeError):
+    pass
+
+# inotify constants (see inotify(7))
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_UNMOUNT = 0x00002000
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = 0x00000800
+_IN_CLOEXEC = 0x00080000
+
+_INOTIFY_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+                 | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+                 | _IN_MOVE_SELF | _IN_ONLYDIR)
+
+_INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _ChangeBatcher(object):
+    """Coalesce changes into batches, reporting a batch once changes have
+    stopped arriving for a while, so that e.g. a bulk copy of many files is
+    reported as one batch.
+
+    Arguments:
+        callback: Called with a dictionary mapping changed paths to their
+                  change.
+        coalesce_delay: Seconds without any further changes to wait before
+                        reporting a batch of changes.
+        max_delay: Maximum seconds to delay reporting a change while changes
+                   keep arriving.
+
+    """
+
+    def __init__(self, callback, coalesce_delay, max_delay):
+        self._callback = callback
+        self._coalesce_delay = coalesce_delay
+        self._max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._first_pending_time = None
+        self._last_pending_time = None
+
+    def add(self, path, change):
+        """Add a change to the pending batch."""
+        with self._lock:
+            if not (change == MODIFIED
+                    and self._pending.get(path) in (CREATED, RESCAN)):
+                self._pending[path] = change
+            self._last_pending_time = time.time()
+            if self._first_pending_time is None:
+                self._first_pending_time = self._last_pending_time
+
+    def timeout(self):
+        """Return the seconds until the pending batch is due to be reported,
+        or None if there is no pending batch."""
+        with self._lock:
+            if self._first_pending_time is None:
+                return None
+            now = time.time()
+            return max(0, min(self._last_pending_time + self._coalesce_delay,
+                              self._first_pending_time + self._max_delay)
+                       - now)
+
+    def flush(self):
+        """Report the pending batch if it is due."""
+        if self.timeout() != 0:
+            return
+        with self._lock:
+            changes = self._pending
+            self._pending = {}
+            self._first_pending_time = None
+            self._last_pending_time = None
+        self._callback(changes)
+
+
+class _InotifyDirWatcher(object):
+    """Directory watcher based on Linux inotify.
+
+    Directories that can't currently be watched (e.g. they don't exist because
+    their removable media isn't mounted) are retried every poll interval and
+    reported with RESCAN once they can be watched.
+
+    Arguments:
+        callback: Called from the watcher thread with a dictionary mapping
+                  changed paths to their change.
+        coalesce_delay, max_delay: See _ChangeBatcher.
+        poll_interval: Seconds in between retries of directories that can't
+                       currently be watched.
+
+    """
+
+    def __init__(self, callback, coalesce_delay=0.5, max_delay=30,
+                 poll_interval=1):
+        self._batcher = _ChangeBatcher(callback, coalesce_delay, max_delay)
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd == -1:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+
+        self._wd_to_dirname = {}
+        self._dirname_to_wd = {}
+        self._unwatched = set()
+        self._last_retry_time = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching all directories."""
+        self._stopped = True
+
+    def _add_watch(self, dirname):
+        """Try to add an inotify watch for a directory, returning True on
+        success."""
+        path = dirname
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        wd = _libc.inotify_add_watch(self._fd, path, _INOTIFY_MASK)
+        if wd == -1:
+            return False
+        with self._lock:
+            self._wd_to_dirname[wd] = dirname
+            self._dirname_to_wd[dirname] = wd
+        return True
+
+    def watch(self, dirname):
+        """Start watching a directory."""
+        if dirname in self._dirname_to_wd or dirname in self._unwatched:
+            return
+        if not self._add_watch(dirname):
+            self._unwatched.add(dirname)
+
+    def unwatch(self, dirname):
+        """Stop watching a directory."""
+        self._unwatched.discard(dirname)
+        with self._lock:
+            wd = self._dirname_to_wd.pop(dirname, None)
+            if wd is None:
+                return
+            del self._wd_to_dirname[wd]
+        _libc.inotify_rm_watch(self._fd, wd)
+
+    def _retry_unwatched(self):
+        """Retry watching the directories that couldn't be watched."""
+        self._last_retry_time = time.time()
+        for dirname in list(self._unwatched):
+            if self._add_watch(dirname):
+                self._unwatched.discard(dirname)
+                self._batcher.add(dirname, RESCAN)
+
+    def _read_events(self):
+        """Read and handle all the available inotify events."""
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        offset = 0
+        while offset + _INOTIFY_EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_length = (_INOTIFY_EVENT_HEADER
+                                             .unpack_from(data, offset))
+            offset += _INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip('\0')
+            offset += name_length
+
+            if mask & _IN_Q_OVERFLOW:
+                # Events were lost; every watched directory must be rescanned
+                for dirname in self._dirname_to_wd.keys():
+                    self._batcher.add(dirname, RESCAN)
+                continue
+
+            dirname = self._wd_to_dirname.get(wd)
+            if dirname is None:
+                continue
+
+            if mask & (_IN_IGNORED | _IN_UNMOUNT | _IN_DELETE_SELF
+                       | _IN_MOVE_SELF):
+                # The directory itself has gone; rescan it and try to watch
+                # it again later
+                if mask & _IN_IGNORED:
+                    with self._lock:
+                        del self._wd_to_dirname[wd]
+                        del self._dirname_to_wd[dirname]
+                    self._unwatched.add(dirname)
+                self._batcher.add(dirname, RESCAN)
+            elif name:
+                path = os.path.join(dirname, name)
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._batcher.add(path, CREATED)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._batcher.add(path, DELETED)
+                else:
+                    self._batcher.add(path, MODIFIED)
+
+    def _run(self):
+        while not self._stopped:
+            timeout = self._batcher.timeout()
+            if self._unwatched:
+                retry_timeout = max(0, self._last_retry_time
+                                    + self._poll_interval - time.time())
+                if timeout is None or retry_timeout < timeout:
+                    timeout = retry_timeout
+            if timeout is None or timeout > self._poll_interval:
+                # Wake up regularly to notice stop()
+                timeout = self._poll_interval
+
+            try:
+                readable = select.select([self._fd], [], [], timeout)[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            if readable:
+                self._read_events()
+
+            if (self._unwatched and time.time() >= self._last_retry_time
+                                                   + self._poll_interval):
+                self._retry_unwatched()
+
+            self._batcher.flush()
+
+        os.close(self._fd)
+
+
+class _PollingDirWatcher(object):
+    """Directory watcher that polls directory listings and file states.
+
+    A batch is reported once a poll finds no further changes (or max_delay
+    has passed), so changes are reported up to a poll interval later than
+    they are found.
+
+    Arguments:
+        callback: Called from the watcher thread with a dictionary mapping
+                  changed paths to their change.
+        coalesce_delay, max_delay: See _ChangeBatcher.
+        poll_interval: Seconds in between polls of the directories.
+
+    """
+
+    def __init__(self, callback, coalesce_delay=0.5, max_delay=30,
+                 poll_interval=1):
+        self._batcher = _ChangeBatcher(callback, coalesce_delay, max_delay)
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._snapshots = {}
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching all directories."""
+        self._stopped = True
+
+    def _snapshot(self, dirname):
+        """Return a dictionary mapping the entries of a directory to their
+        modification time and size, or None if the directory isn't currently
+        accessible."""
+        try:
+            names = os.listdir(dirname)
+        except OSError:
+            return None
+
+        snapshot = {}
+        for name in names:
+            try:
+                file_stat = os.stat(os.path.join(dirname, name))
+            except OSError:
+                continue
+            snapshot[name] = (file_stat.st_mtime, file_stat.st_size)
+        return snapshot
+
+    def watch(self, dirname):
+        """Start watching a directory."""
+        with self._lock:
+            if dirname in self._snapshots:
+                return
+        snapshot = self._snapshot(dirname)
+        with self._lock:
+            self._snapshots.setdefault(dirname, snapshot)
+
+    def unwatch(self, dirname):
+        """Stop watching a directory."""
+        with self._lock:
+            self._snapshots.pop(dirname, None)
+
+    def _poll(self):
+        """Compare every watched directory against its last snapshot."""
+        with self._lock:
+            dirnames = self._snapshots.keys()
+
+        for dirname in dirnames:
+            new_snapshot = self._snapshot(dirname)
+            with self._lock:
+                if dirname not in self._snapshots:
+                    # Unwatched in the meantime
+                    continue
+                old_snapshot = self._snapshots[dirname]
+                self._snapshots[dirname] = new_snapshot
+
+            if old_snapshot is None or new_snapshot is None:
+                if old_snapshot != new_snapshot:
+                    self._batcher.add(dirname, RESCAN)
+                continue
+
+            for name, state in new_snapshot.iteritems():
+                if name not in old_snapshot:
+                    self._batcher.add(os.path.join(dirname, name), CREATED)
+                elif state != old_snapshot[name]:
+                    self._batcher.add(os.path.join(dirname, name), MODIFIED)
+            for name in old_snapshot:
+                if name not in new_snapshot:
+                    self._batcher.add(os.path.join(dirname, name), DELETED)
+
+    def _run(self):
+        while not self._stopped:
+            time.sleep(self._poll_interval)
+            self._poll()
+            self._batcher.flush()
+
+
+def dir_watcher(*args, **kwargs):
+    """Return a directory watcher (see _InotifyDirWatcher and
+    _PollingDirWatcher for the arguments) with watch(), unwatch() and stop()
+    methods, using the most efficient implementation available."""
+    if imported_libc_inotify:
+        try:
+            return _InotifyDirWatcher(*args, **kwargs)
+        except OSError:
+            # e.g. the inotify instance limit has been reached
+            pass
+    return _PollingDirWatcher(*args, **kwargs)
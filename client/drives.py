@@ -1,8 +1,12 @@
 """Cross-platform abstractions for dealing with storage drives."""
 
+import errno
 import os
+import select
+import threading
 
 imported_windll_kernel32 = False
+imported_linux_mountinfo = False
 
 try:
     # Win32-based operating systems
@@ -11,10 +15,14 @@ try:
         raise ImportError("ctypes.windll does not contain kernel32 object")
     imported_windll_kernel32 = True
 except ImportError:
-    raise ImportError("no implementation could be imported")
+    # Linux
+    if not (os.path.isfile('/proc/self/mountinfo')
+            and os.path.isdir('/sys/block')):
+        raise ImportError("no implementation could be imported")
+    imported_linux_mountinfo = True
 
 
-def _is_interchangeable_win32(filename):
+def _is_interchangeable_win32(filename, device=None):
     drive = os.path.splitdrive(filename)[0] + '\\'
     drive = unicode(drive)
     drive_type = windll.kernel32.GetDriveTypeW(drive)
@@ -26,7 +34,137 @@ def _is_interchangeable_win32(filename):
         return False
 
 
+def _read_sysfs_file(filename):
+    try:
+        with open(filename) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def _parse_device_number(device_number):
+    """Return the device ID of a 'major:minor' device number string."""
+    major, minor = device_number.split(':')
+    return os.makedev(int(major), int(minor))
+
+
+class _LinuxMountTable():
+    """Index of the mounted filesystems' device IDs, mapping each to whether
+    it's on removable media.
+
+    The index is built from /proc/self/mountinfo and /sys/block, and is only
+    rebuilt when the kernel signals a change of the mount table by raising
+    POLLPRI on /proc/self/mounts.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._interchangeable = {}
+        self._mounts = None
+        self._poll = None
+        self._rebuild()
+
+    def _removable_block_devices(self):
+        """Return a set of the device IDs of the block devices (including
+        partitions) on removable media."""
+        removable = set()
+        for disk in os.listdir('/sys/block'):
+            disk_dir = os.path.join('/sys/block', disk)
+            # USB mass storage (e.g. card readers and hard drives) isn't
+            # always flagged as removable
+            if (_read_sysfs_file(os.path.join(disk_dir, 'removable')) != '1'
+                and '/usb' not in os.path.realpath(disk_dir)):
+                continue
+
+            device_number = _read_sysfs_file(os.path.join(disk_dir, 'dev'))
+            if device_number:
+                removable.add(_parse_device_number(device_number))
+            for name in os.listdir(disk_dir):
+                if not name.startswith(disk):
+                    continue
+                device_number = _read_sysfs_file(os.path.join(disk_dir, name,
+                                                              'dev'))
+                if device_number:
+                    removable.add(_parse_device_number(device_number))
+        return removable
+
+    def _rebuild(self):
+        """Rebuild the index from the current mount table."""
+        removable = self._removable_block_devices()
+
+        interchangeable = {}
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields = line.split()
+                try:
+                    separator = fields.index('-', 6)
+                    device = _parse_device_number(fields[2])
+                    fstype = fields[separator + 1]
+                except (ValueError, IndexError):
+                    continue
+                interchangeable[device] = (device in removable
+                                           or fstype in ('iso9660', 'udf'))
+
+        self._interchangeable = interchangeable
+
+        if self._mounts is None:
+            self._mounts = open('/proc/self/mounts')
+            self._poll = select.poll()
+            self._poll.register(self._mounts, select.POLLPRI | select.POLLERR)
+        # Reading the mount table acknowledges its change notification
+        self._mounts.seek(0)
+        self._mounts.read()
+
+    def _mount_table_changed(self):
+        try:
+            return bool(self._poll.poll(0))
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return True
+
+    def is_interchangeable(self, device):
+        """Return True if the filesystem with the specified device ID is on
+        removable media or a CD."""
+        with self._lock:
+            if self._mount_table_changed():
+                self._rebuild()
+            try:
+                return self._interchangeable[device]
+            except KeyError:
+                pass
+            # Possibly mounted since the last change notification was read;
+            # devices that still aren't found (e.g. btrfs subvolumes) aren't
+            # backed by a block device of their own
+            self._rebuild()
+            return self._interchangeable.setdefault(device, False)
+
+
+_linux_mount_table = None
+_linux_mount_table_lock = threading.Lock()
+
+
+def _is_interchangeable_linux(filename, device=None):
+    global _linux_mount_table
+    if device is None:
+        device = os.stat(filename).st_dev
+    with _linux_mount_table_lock:
+        if _linux_mount_table is None:
+            _linux_mount_table = _LinuxMountTable()
+    return _linux_mount_table.is_interchangeable(device)
+
+
 def is_interchangeable(*args, **kwargs):
-    """Return True if filename is on removable media or a CD."""
+    """Return True if filename is on removable media or a CD.
+
+    Arguments:
+        filename: The file's path.
+        device: The device ID (st_dev) of the file, if already known, saving
+                stat()ing the file where the implementation would have to.
+
+    """
     if imported_windll_kernel32:
         return _is_interchangeable_win32(*args, **kwargs)
+    elif imported_linux_mountinfo:
+        return _is_interchangeable_linux(*args, **kwargs)
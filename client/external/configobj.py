@@ -18,10 +18,12 @@
 
 from __future__ import generators
 
+import mmap
 import os
 import re
 import sys
 
+from array import array
 from codecs import BOM_UTF8, BOM_UTF16, BOM_UTF16_BE, BOM_UTF16_LE
 
 
@@ -1081,6 +1083,55 @@ class Section(dict):
             self[section].restore_defaults()
 
 
+class _MappedLines(object):
+    """
+    A read-only sequence of the lines of a memory-mapped config file.
+    
+    Line boundaries are found once on the raw bytes; each line is only sliced
+    out of the map (with its line ending stripped, and decoded if an encoding
+    is given) when the parser asks for it. The file is never copied into a
+    single string or split into a full list of lines.
+    """
+
+    _line_end = re.compile(r'\r\n|\r|\n')
+
+    def __init__(self, mapped, start=0, encoding=None):
+        self._mapped = mapped
+        self._encoding = encoding
+        self.newlines = None
+        self._starts = array('L')
+        self._ends = array('L')
+        pos = start
+        for match in self._line_end.finditer(mapped, start):
+            if self.newlines is None:
+                # the first line ending found
+                self.newlines = match.group()
+            self._starts.append(pos)
+            self._ends.append(match.start())
+            pos = match.end()
+        if pos < len(mapped):
+            # last line without a line ending
+            self._starts.append(pos)
+            self._ends.append(len(mapped))
+
+
+    def __len__(self):
+        return len(self._starts)
+
+
+    def __getitem__(self, index):
+        line = self._mapped[self._starts[index]:self._ends[index]]
+        if self._encoding:
+            # NOTE: Could raise a ``UnicodeDecodeError``
+            line = line.decode(self._encoding)
+        return line
+
+
+    def close(self):
+        self._mapped.close()
+
+
+
 class ConfigObj(Section):
     """An object to read, create, and write config files."""
 
@@ -1247,8 +1298,10 @@ class ConfigObj(Section):
             self.filename = infile
             if os.path.isfile(infile):
                 h = open(infile, 'rb')
-                infile = h.read() or []
-                h.close()
+                try:
+                    infile = self._map_file(h)
+                finally:
+                    h.close()
             elif self.file_error:
                 # raise an error if the file doesn't exist
                 raise IOError('Config file not found: "%s".' % self.filename)
@@ -1297,7 +1350,10 @@ class ConfigObj(Section):
         else:
             raise TypeError('infile must be a filename, file like object, or list of lines.')
         
-        if infile:
+        if isinstance(infile, _MappedLines):
+            # BOM already handled and lines already found on the raw bytes
+            self.newlines = infile.newlines
+        elif infile:
             # don't do it for the empty ConfigObj
             infile = self._handle_bom(infile)
             # infile is now *always* a list
@@ -1315,7 +1371,11 @@ class ConfigObj(Section):
 
             infile = [line.rstrip('\r\n') for line in infile]
             
-        self._parse(infile)
+        try:
+            self._parse(infile)
+        finally:
+            if isinstance(infile, _MappedLines):
+                infile.close()
         # if we had any errors, now is the time to raise them
         if self._errors:
             info = "at line %s." % self._errors[0].line_number
@@ -1382,6 +1442,85 @@ class ConfigObj(Section):
                 for key in (self.scalars + self.sections)]))
     
     
+    # line boundaries recognised by ``unicode.splitlines`` other than
+    # '\r' and '\n'
+    _unicode_line_ends = (u'\x0b', u'\x0c', u'\x1c', u'\x1d', u'\x1e',
+                          u'\x85', u'\u2028', u'\u2029')
+    
+    def _splits_on_bytes(self, mapped, encoding):
+        """
+        Return True if the lines of a mapped file in ``encoding`` can be
+        found on its raw bytes, giving the same lines as decoding the whole
+        file and calling ``splitlines``.
+        
+        That is the case if '\r' and '\n' are encoded as in ASCII and none
+        of the other line boundaries ``unicode.splitlines`` recognises occur
+        in the file.
+        """
+        try:
+            if u'\r\n'.encode(encoding) != '\r\n':
+                return False
+        except (LookupError, UnicodeError):
+            return False
+        for line_end in self._unicode_line_ends:
+            try:
+                encoded = line_end.encode(encoding)
+            except UnicodeError:
+                # can't occur in the file
+                continue
+            if mapped.find(encoded) != -1:
+                return False
+        return True
+    
+    
+    def _map_file(self, h):
+        """
+        Memory-map an open config file and return it as a ``_MappedLines``
+        sequence, detecting and skipping any BOM on the raw bytes.
+        
+        Empty files (which can't be mapped) are returned as ``[]``. UTF16
+        files can't be split into lines before decoding, so they are returned
+        as a string to be handled by ``_handle_bom``.
+        """
+        try:
+            mapped = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return h.read() or []
+        
+        if ((self.encoding is not None) and
+            not self._splits_on_bytes(mapped, self.encoding)):
+            # lines must be split after decoding, as ``_decode`` does
+            infile = mapped[:]
+            mapped.close()
+            return infile
+        
+        if ((self.encoding is not None) and
+            (self.encoding.lower() not in BOM_LIST)):
+            # the encoding specified doesn't have a BOM, just decode
+            return _MappedLines(mapped, encoding=self.encoding)
+        
+        head = mapped[:len(BOM_UTF8)]
+        if self.encoding is not None:
+            if BOM_LIST[self.encoding.lower()] == 'utf_8':
+                if not head.startswith(BOM_UTF8):
+                    return _MappedLines(mapped, encoding=self.encoding)
+                self.BOM = True
+                return _MappedLines(mapped, len(BOM_UTF8), self.encoding)
+        elif head.startswith(BOM_UTF8):
+            # UTF8 - don't decode
+            self.BOM = True
+            return _MappedLines(mapped, len(BOM_UTF8))
+        elif not (head.startswith(BOM_UTF16_BE) or
+                  head.startswith(BOM_UTF16_LE)):
+            # No BOM discovered and no encoding specified
+            return _MappedLines(mapped)
+        
+        # UTF16
+        infile = mapped[:]
+        mapped.close()
+        return infile
+
+
     def _handle_bom(self, infile):
         """
         Handle any BOM, and decode if necessary.
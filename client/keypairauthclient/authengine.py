@@ -1,156 +1,949 @@
 """Core interface for authentication."""
 
+import asynchat
+from collections import namedtuple
+import asyncore
+import errno
+import heapq
+import httplib
+import itertools
 import json
+import os
+import random
+import select
+import socket
+import threading
 import time
-import thread
 from urlparse import urlparse
 
-from cherrypy.wsgiserver import CherryPyWSGIServer
+imported_cherrypy = False
+
+try:
+    from cherrypy.wsgiserver import CherryPyWSGIServer
+    imported_cherrypy = True
+except ImportError:
+    pass
 
 MODE_REGISTER = 'register'
 MODE_AUTH = 'auth'
 
+VERIFIER_ADDRESS = ('127.0.0.1', 2448)
+
+# Verifier HTTP server implementations
+SERVER_CHERRYPY = 'cherrypy'
+SERVER_ASYNCORE = 'asyncore'
+
+# Maximum sizes of verifier HTTP request headers and bodies
+MAX_HEADER_SIZE = 8192
+MAX_BODY_SIZE = 65536
+
+# Seconds in between polls of the process serving the verifier address for
+# the results of forwarded verifications (see _InvocationVerifier), and the
+# maximum timeout of a forwarded verification
+FORWARD_POLL_INTERVAL = 0.05
+MAX_FORWARDED_TIMEOUT = 60
+
+# The server implementation of the shared verifier (see set_verifier_server())
+verifier_server = SERVER_CHERRYPY if imported_cherrypy else SERVER_ASYNCORE
+
 
 def verify_invocation(*args, **kwargs):
-    """Call _VerifyInvocation() and return the result."""
-    return _VerifyInvocation(*args, **kwargs).result
+    """Call verify_invocation_async() and wait for the result."""
+    return verify_invocation_async(*args, **kwargs).result()
 
 
-class _VerifyInvocation():
+def verify_invocation_async(auth_url, identity_assertion, mode, timeout=2.5):
     """Verify that an authentication request was invoked by the domain and
-    scheme that is to be authenticated to, by waiting for a HTTP JSON request
-    to localhost that mirrors the specified authentication parameters and has
-    an Origin header that matches the auth_url domain and scheme."""
+    scheme that is to be authenticated to (see _InvocationVerifier), returning
+    a VerificationFuture of the result without waiting for it."""
+    return _get_verifier().register(auth_url, identity_assertion, mode,
+                                    timeout)
 
-    def __init__(self, auth_url, identity_assertion, mode, timeout=2.5):
-        self._auth_url = auth_url
-        self._identity_assertion = identity_assertion
-        self._mode = mode
 
-        self._auth_url_components = urlparse(auth_url)
+def set_verifier_server(server):
+    """Select the HTTP server implementation of the shared verifier, either
+    SERVER_CHERRYPY (a threaded WSGI server) or SERVER_ASYNCORE (a
+    single-threaded event-driven server). This must be done before any
+    verification."""
+    global verifier_server
+    if server not in (SERVER_CHERRYPY, SERVER_ASYNCORE):
+        raise ValueError("unknown verifier server: " + repr(server))
+    if server == SERVER_CHERRYPY and not imported_cherrypy:
+        raise ValueError("CherryPy is unavailable")
+    with _verifier_lock:
+        if _verifier is not None:
+            raise RuntimeError("the verifier has already been started")
+        verifier_server = server
 
-        self._result = None  # the result of the verification
 
-        # Start the WSGI server in a new thread
-        thread.start_new_thread(self._wsgi_start, ())
+def _origin(url_components):
+    return url_components[0] + "://" + url_components[1]
 
-        # Wait until self._result changes or the timeout time passes
-        wait_start = time.time()
-        while True:
-            time.sleep(0.01)
-            if (timeout + wait_start) < time.time():
-                # Timeout time passed, close the server and stop waiting
-                self._wsgi_server.stop()
-                break
-            elif self._result is not None:
-                # Result changed, stop waiting
-                break
-
-    @property
-    def result(self):
-        """Return the result."""
+
+class VerificationFuture():
+    """The pending result of an invocation verification: True if the
+    invocation was verified, None if it wasn't before the timeout, or False
+    if it couldn't be verified as the verifier address couldn't be listened
+    on (and no other process was verifying on it).
+
+    The token attribute identifies the verification to the verifier (see
+    _InvocationVerifier.cancel()).
+
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._callbacks = []
+
+    def done(self):
+        """Return True if the verification has completed."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait until the verification completes (for at most timeout seconds
+        if specified) and return its result."""
+        self._done.wait(timeout)
         return self._result
 
-    def _wsgi_app(self, environ, start_response):
-        """HTTP request handler for the WSGI server."""
-        print environ
+    def add_done_callback(self, callback):
+        """Call callback with this future when the verification completes
+        (straight away if it already has)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set_result(self, result):
+        """Complete the verification, returning False if it already was."""
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._result = result
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+        return True
+
+
+class _InvocationVerifier():
+    """Verify that authentication requests were invoked by the domain and
+    scheme that is to be authenticated to, by waiting for HTTP JSON requests
+    to localhost that mirror the authentication parameters and have an Origin
+    header that matches the auth_url domain and scheme.
+
+    A single long-lived server verifies any number of pending verifications,
+    each registered under a token and indexed by its authentication
+    parameters. Pending verifications expire after their timeout.
+
+    As each authentication may run in its own process, the address may
+    already be served by another process's verifier. Verifications are then
+    forwarded to that process, which is polled for their results; a process
+    that registers a verification after the serving process has exited takes
+    over the address.
+
+    Arguments:
+        address: (host, port) tuple of the address to listen on.
+        server: The HTTP server implementation, SERVER_CHERRYPY or
+                SERVER_ASYNCORE.
+
+    """
+
+    def __init__(self, address=VERIFIER_ADDRESS, server=SERVER_CHERRYPY):
+        self._address = address
+        self._server_type = server
+        self._host = "localhost:" + str(address[1])
+
+        self._lock = threading.Condition()
+        self._tokens = itertools.count(1)
+        # Token -> (params, origin, future) of pending verifications
+        self._pending = {}
+        # (auth_url, identity_assertion, mode) -> set of tokens
+        self._params_index = {}
+        # Origin -> number of pending verifications, to answer CORS preflights
+        self._origin_counts = {}
+        # Heap of (expiry time, token)
+        self._expiries = []
+        # Token -> [future, completion time] of verifications forwarded from
+        # other processes (see _handle_forwarded())
+        self._forwarded = {}
+
+        self._server = None
+        self._expirer = threading.Thread(target=self._expiry_loop)
+        self._expirer.daemon = True
+        self._expirer.start()
+
+    def _start_server(self):
+        """Start the HTTP server in a new thread if it isn't running,
+        returning True if it is running or False if another process is
+        listening on the address. Other errors binding to the address are
+        raised (as socket.error)."""
+        if self._server is not None:
+            return True
+        try:
+            if self._server_type == SERVER_ASYNCORE:
+                server = _AsyncoreVerifierServer(self._address, self)
+            else:
+                # The CherryPy server binds to the address in its own thread,
+                # so check that it can be bound to first
+                _check_bindable(self._address)
+                server = CherryPyWSGIServer(self._address, self._wsgi_app)
+        except socket.error, e:
+            if e.errno in _ADDRESS_IN_USE_ERRNOS:
+                return False
+            raise
+        self._server = server
+        server_thread = threading.Thread(target=self._server.start)
+        server_thread.daemon = True
+        server_thread.start()
+        return True
+
+    def register(self, auth_url, identity_assertion, mode, timeout):
+        """Register a pending verification, returning its
+        VerificationFuture."""
+        params = (auth_url, identity_assertion, mode)
+        origin = _origin(urlparse(auth_url))
+        with self._lock:
+            token = next(self._tokens)
+            future = VerificationFuture(token)
+            self._pending[token] = (params, origin, future)
+            self._params_index.setdefault(params, set()).add(token)
+            self._origin_counts[origin] = (self._origin_counts.get(origin, 0)
+                                           + 1)
+            heapq.heappush(self._expiries, (time.time() + timeout, token))
+            self._lock.notify()
+            try:
+                serving = self._start_server()
+            except socket.error:
+                # The address can't be listened on at all
+                self._unregister(token)
+                serving = None
+
+        if serving is None:
+            future._set_result(False)
+        elif not serving:
+            forwarder = threading.Thread(target=self._forward,
+                                         args=(token, params, timeout))
+            forwarder.daemon = True
+            forwarder.start()
+        return future
+
+    def _complete(self, token, result):
+        """Complete a pending verification with a result, if it is still
+        pending."""
+        with self._lock:
+            future = self._unregister(token)
+        if future is not None:
+            future._set_result(result)
+
+    def _forward(self, token, params, timeout):
+        """Forward a pending verification to the verifier of the process
+        serving the address, and wait for its result."""
+        connection = httplib.HTTPConnection(self._address[0],
+                                            self._address[1],
+                                            timeout=max(timeout, 1))
+        try:
+            forwarded_token = self._forwarded_request(
+                connection, {'action': 'register',
+                             'auth_url': params[0],
+                             'identity_assertion': params[1],
+                             'mode': params[2],
+                             'timeout': timeout})['token']
+            while True:
+                with self._lock:
+                    if token not in self._pending:
+                        # Expired or cancelled
+                        return
+                status = self._forwarded_request(
+                    connection, {'action': 'status',
+                                 'token': forwarded_token})
+                if status['done']:
+                    if status['result'] is True:
+                        self._complete(token, True)
+                    # Otherwise it expired there, and will here too
+                    return
+                time.sleep(FORWARD_POLL_INTERVAL)
+        except (socket.error, httplib.HTTPException, ValueError, KeyError,
+                TypeError):
+            # The serving process exited, or the address is served by
+            # something other than a verifier; take over the address if it
+            # is free now
+            with self._lock:
+                if token not in self._pending:
+                    return
+                try:
+                    serving = self._start_server()
+                except socket.error:
+                    serving = False
+            if not serving:
+                self._complete(token, False)
+        finally:
+            connection.close()
+
+    def _forwarded_request(self, connection, request):
+        """Send a request about a forwarded verification to the verifier of
+        the process serving the address, returning its JSON response."""
+        connection.request('POST', "/forward_verification",
+                           json.dumps(request),
+                           {'Host': self._host,
+                            'Content-Type': "application/json",
+                            'Accept': "application/json"})
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise httplib.HTTPException("forwarding failed: "
+                                        + str(response.status))
+        return json.loads(body)
+
+    def _handle_forwarded(self, request):
+        """Handle a request about a verification forwarded from another
+        process's verifier (see _forward()), returning its JSON response or
+        None if it is invalid."""
+        if not isinstance(request, dict):
+            return None
+
+        if request.get('action') == 'register':
+            try:
+                params = (request['auth_url'], request['identity_assertion'],
+                          request['mode'])
+                timeout = float(request['timeout'])
+                origin = _origin(urlparse(params[0]))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                return None
+            if not 0 < timeout <= MAX_FORWARDED_TIMEOUT:
+                return None
+            future = self.register(params[0], params[1], params[2], timeout)
+            entry = [future, None]
+
+            def on_done(future):
+                entry[1] = time.time()
+
+            with self._lock:
+                # Forget the results of verifications whose forwarding
+                # process stopped polling for them
+                now = time.time()
+                for token, (future_, done_time) in self._forwarded.items():
+                    if (done_time is not None
+                        and now - done_time > MAX_FORWARDED_TIMEOUT):
+                        del self._forwarded[token]
+                self._forwarded[future.token] = entry
+            future.add_done_callback(on_done)
+            return {'token': future.token}
+
+        elif request.get('action') == 'status':
+            with self._lock:
+                try:
+                    future = self._forwarded[request.get('token')][0]
+                except (KeyError, TypeError):
+                    # Unknown; it was never verified
+                    return {'done': True, 'result': None}
+                if future.done():
+                    del self._forwarded[future.token]
+            return {'done': future.done(), 'result': future.result(0)}
+
+        return None
+
+    def _unregister(self, token):
+        """Remove a pending verification, returning its future or None if it
+        isn't pending. Must be called with the lock held."""
+        try:
+            params, origin, future = self._pending.pop(token)
+        except KeyError:
+            return None
+        tokens = self._params_index[params]
+        tokens.discard(token)
+        if not tokens:
+            del self._params_index[params]
+        self._origin_counts[origin] -= 1
+        if not self._origin_counts[origin]:
+            del self._origin_counts[origin]
+        return future
+
+    def cancel(self, token):
+        """Stop waiting for a pending verification, completing it
+        unverified."""
+        with self._lock:
+            future = self._unregister(token)
+        if future is not None:
+            future._set_result(None)
+
+    def _verify(self, params, origin):
+        """Complete the pending verifications with the specified parameters
+        and origin, returning True if there were any."""
+        with self._lock:
+            try:
+                tokens = self._params_index.get(params, ())
+            except TypeError:
+                # Unhashable JSON parameters
+                return False
+            futures = [self._unregister(token) for token in list(tokens)
+                       if self._pending[token][1] == origin]
+        for future in futures:
+            future._set_result(True)
+        return bool(futures)
+
+    def _expiry_loop(self):
+        """Complete the pending verifications that have expired."""
+        while True:
+            with self._lock:
+                while not self._expiries:
+                    self._lock.wait()
+                expiry_time, token = self._expiries[0]
+                timeout = expiry_time - time.time()
+                if timeout > 0:
+                    self._lock.wait(timeout)
+                    continue
+                heapq.heappop(self._expiries)
+                future = self._unregister(token)
+            if future is not None:
+                future._set_result(None)
+
+    def _handle_request(self, method, path, headers, body):
+        """Handle a HTTP request to the verifier, returning a (status,
+        response headers, response body) tuple.
+
+        Arguments:
+            method: Request method.
+            path: Request path.
+            headers: Dictionary mapping lower-case request header names to
+                     their values.
+            body: Request body string.
+
+        """
         # Set base response headers
         response_headers = [('Server', "KeypairAuth invocation verifier")]
 
         # Get a list of Accept header entries
         accept_entries = []
-        if 'HTTP_ACCEPT' in environ:
-            for accept_entry in environ['HTTP_ACCEPT'].split(";"):
+        if 'accept' in headers:
+            for accept_entry in headers['accept'].split(";"):
                 accept_entry = accept_entry.strip()
                 accept_entries.append(accept_entry)
 
         # Get components of the Origin header URL
-        if 'HTTP_ORIGIN' in environ:
-            origin_components = urlparse(environ['HTTP_ORIGIN'])
-        else:
-            origin_components = urlparse()
+        origin_components = urlparse(headers.get('origin', ''))
 
         #
         # Check that the request is valid
         #
 
+        # Handle verifications forwarded from other processes, which
+        # browsers (which send an Origin header with cross-origin POST
+        # requests) aren't allowed to make
+        if (path == "/forward_verification"
+            and headers.get('host') == self._host
+            and method == 'POST' and 'origin' not in headers
+            and headers.get('content-type') == 'application/json'):
+            try:
+                forwarded_response = self._handle_forwarded(json.loads(body))
+            except ValueError:
+                forwarded_response = None
+            if forwarded_response is None:
+                return '400 Bad Request', response_headers, ""
+            response_headers.append(('Content-Type', 'application/json'))
+            return ('200 OK', response_headers,
+                    json.dumps(forwarded_response))
+
         # 404 irrelevant requests
-        if (environ['PATH_INFO'] != "/verify_invocation"
-            or 'HTTP_HOST' not in environ
-            or environ['HTTP_HOST'] != "localhost:2448"):
-            start_response('404 Not Found', response_headers)
-            return ""
+        if path != "/verify_invocation" or headers.get('host') != self._host:
+            return '404 Not Found', response_headers, ""
 
         # Allow POST and OPTIONS requests only
-        if environ['REQUEST_METHOD'] not in ('POST', 'OPTIONS'):
-            start_response('405 Method Not Allowed', response_headers)
-            return ""
+        if method not in ('POST', 'OPTIONS'):
+            return '405 Method Not Allowed', response_headers, ""
 
         # Allow a content type of application/json only
-        if ('CONTENT_TYPE' not in environ
-            or environ['CONTENT_TYPE'] != 'application/json'):
-            start_response('415 Unsupported Media Type', response_headers)
-            return ""
+        if headers.get('content-type') != 'application/json':
+            return '415 Unsupported Media Type', response_headers, ""
 
         # Accept header must allow for an application/json response
         if 'application/json' not in accept_entries:
-            start_response('406 Not Acceptable', response_headers)
-            return ""
+            return '406 Not Acceptable', response_headers, ""
 
         # Handle OPTIONS (and CORS preflight) requests
-        if environ['REQUEST_METHOD'] == 'OPTIONS':
+        if method == 'OPTIONS':
 
             response_headers.append(('Allow', 'POST'))
             response_headers.append(('Access-Control-Allow-Methods', 'POST'))
 
-            if (self._auth_url_components[0] == origin_components[0]
-                and self._auth_url_components[1] == origin_components[1]):
-                auth_url_root = self._auth_url_components[0] + "://"
-                auth_url_root += self._auth_url_components[1]
-                response_headers.append('Access-Control-Allow-Origin',
-                                        auth_url_root)
+            origin = _origin(origin_components)
+            if origin in self._origin_counts:
+                response_headers.append(('Access-Control-Allow-Origin',
+                                         origin))
 
-            start_response('200 OK', response_headers)
-            return ""
+            return '200 OK', response_headers, ""
 
         # Try to load the JSON data
         try:
-            json_data = json.load(environ['wsgi.input'])
-            assert ('auth_url' in json_data
+            json_data = json.loads(body)
+            assert (isinstance(json_data, dict)
+                    and isinstance(json_data.get('auth_url'), basestring)
                     and 'identity_assertion' in json_data
                     and 'mode' in json_data)
         except (ValueError, AssertionError):
             # Bad JSON data
-            start_response('400 Bad Request', response_headers)
-            return ""
+            return '400 Bad Request', response_headers, ""
 
         #
         # Check the Origin header domain and scheme against the auth_url
-        # domain and scheme, and compare the JSON authentication parameters
-        # against the authentication parameters specified to this class to
-        # verify the invocation
+        # domain and scheme, and look up pending verifications with the JSON
+        # authentication parameters to verify their invocation
         #
 
-        # Verify the invocation
-        if (origin_components[0] == self._auth_url_components[0]
-            and origin_components[1] == self._auth_url_components[1]
-            and json_data['auth_url'] == self._auth_url
-            and json_data['identity_assertion'] == self._identity_assertion
-            and json_data['mode'] == self._mode):
-            verify_result = True
+        params = (json_data['auth_url'], json_data['identity_assertion'],
+                  json_data['mode'])
+        if _origin(origin_components) == _origin(urlparse(params[0])):
+            verify_result = self._verify(params, _origin(origin_components))
         else:
             verify_result = False
 
-        # Update self._result if the verification was successful
-        if verify_result:
-            self._result = True
-
         # Return the result of the verification in JSON form
-        response_headers.append('Content-Type', 'application/json')
-        return json.dumps({"success": verify_result})
-
-    def _wsgi_start(self):
-        """Start the WSGI server."""
-        self._wsgi_server = CherryPyWSGIServer(('127.0.0.1', 2448),
-                                               self._wsgi_app)
-        self._wsgi_server.start()
+        response_headers.append(('Content-Type', 'application/json'))
+        return '200 OK', response_headers, json.dumps({"success":
+                                                       verify_result})
+
+    def _wsgi_app(self, environ, start_response):
+        """HTTP request handler for the WSGI server."""
+        headers = {}
+        for key, value in environ.iteritems():
+            if key.startswith('HTTP_'):
+                headers[key[5:].replace('_', '-').lower()] = value
+        if 'CONTENT_TYPE' in environ:
+            headers['content-type'] = environ['CONTENT_TYPE']
+
+        try:
+            content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = -1
+        if not 0 <= content_length <= MAX_BODY_SIZE:
+            start_response('413 Request Entity Too Large',
+                           [('Content-Length', '0')])
+            return [""]
+        body = environ['wsgi.input'].read(content_length)
+
+        status, response_headers, response_body = self._handle_request(
+            environ['REQUEST_METHOD'], environ['PATH_INFO'], headers, body)
+        response_headers.append(('Content-Length', str(len(response_body))))
+        start_response(status, response_headers)
+        return [response_body]
+
+
+class _VerifierChannel(asynchat.async_chat):
+    """A connection to the asyncore verifier server, parsing HTTP/1.x
+    requests with a bounded amount of buffering."""
+
+    def __init__(self, sock, verifier, socket_map):
+        asynchat.async_chat.__init__(self, sock, map=socket_map)
+        self._verifier = verifier
+        self._buffer = []
+        self._buffer_size = 0
+        # (method, path, version, headers) of a request whose body is being
+        # read
+        self._request = None
+        self._closing = False
+        self.last_activity = time.time()
+        self.set_terminator("\r\n\r\n")
+
+    def readable(self):
+        # Stop reading pipelined requests while responses are backed up
+        return len(self.producer_fifo) < 8
+
+    def collect_incoming_data(self, data):
+        self.last_activity = time.time()
+        if self._closing:
+            return
+        self._buffer_size += len(data)
+        if self._request is None and self._buffer_size > MAX_HEADER_SIZE:
+            self._respond('431 Request Header Fields Too Large', [], "",
+                          False)
+            return
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        if self._closing:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+
+        if self._request is None:
+            try:
+                request_line, header_data = (data.lstrip("\r\n")
+                                             .split("\r\n", 1) + [""])[:2]
+                method, path, version = request_line.split()
+                if not version.startswith("HTTP/1."):
+                    raise ValueError
+                headers = {}
+                for header_line in header_data.split("\r\n"):
+                    if not header_line:
+                        continue
+                    name, value = header_line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get('content-length', 0))
+                if 'transfer-encoding' in headers or content_length < 0:
+                    raise ValueError
+            except ValueError:
+                self._respond('400 Bad Request', [], "", False)
+                return
+            if content_length > MAX_BODY_SIZE:
+                self._respond('413 Request Entity Too Large', [], "", False)
+                return
+            path = path.split("?", 1)[0]
+            self._request = (method, path, version, headers)
+            if content_length:
+                self.set_terminator(content_length)
+                return
+            data = ""
+
+        method, path, version, headers = self._request
+        self._request = None
+        self.set_terminator("\r\n\r\n")
+
+        connection = headers.get('connection', "").lower()
+        if version == "HTTP/1.0":
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        status, response_headers, response_body = \
+            self._verifier._handle_request(method, path, headers, data)
+        self._respond(status, response_headers, response_body, keep_alive)
+
+    def _respond(self, status, headers, body, keep_alive):
+        headers = headers + [('Content-Length', str(len(body)))]
+        if not keep_alive:
+            headers.append(('Connection', 'close'))
+        self.push("HTTP/1.1 " + status + "\r\n"
+                  + "".join(name + ": " + value + "\r\n"
+                            for name, value in headers)
+                  + "\r\n" + body)
+        if not keep_alive:
+            # Ignore any further data until the connection is closed
+            self._closing = True
+            self._buffer = []
+            self.set_terminator(None)
+            self.close_when_done()
+
+    def handle_error(self):
+        self.close()
+
+
+class _AsyncoreVerifierServer(asyncore.dispatcher):
+    """A single-threaded HTTP server for the verifier, based on asyncore.
+
+    Arguments:
+        address: (host, port) tuple of the address to listen on.
+        verifier: The _InvocationVerifier to handle requests with.
+        max_connections: Maximum number of open connections. Further
+                         connections are closed straight away.
+        idle_timeout: Seconds after which idle connections are closed.
+
+    """
+
+    def __init__(self, address, verifier, max_connections=256,
+                 idle_timeout=30):
+        self._socket_map = {}
+        asyncore.dispatcher.__init__(self, map=self._socket_map)
+        self._verifier = verifier
+        self._max_connections = max_connections
+        self._idle_timeout = idle_timeout
+        self._stopped = False
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if os.name != 'nt':
+                # On Windows this would allow binding to an address that
+                # another process is listening on
+                self.set_reuse_addr()
+            self.bind(address)
+            self.listen(128)
+        except socket.error:
+            self.close()
+            raise
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock = pair[0]
+        if len(self._socket_map) > self._max_connections:
+            sock.close()
+            return
+        _VerifierChannel(sock, self._verifier, self._socket_map)
+
+    def start(self):
+        """Serve requests until stopped."""
+        while not self._stopped:
+            asyncore.loop(timeout=1, map=self._socket_map, count=1)
+            idle_time = time.time() - self._idle_timeout
+            for channel in self._socket_map.values():
+                if (channel is not self
+                    and channel.last_activity < idle_time):
+                    channel.close()
+        asyncore.close_all(map=self._socket_map)
+
+    def stop(self):
+        """Stop serving requests."""
+        self._stopped = True
+
+
+# socket.error errnos of binding to an address that is in use
+_ADDRESS_IN_USE_ERRNOS = set(
+    getattr(errno, name) for name in ('EADDRINUSE', 'WSAEADDRINUSE')
+    if hasattr(errno, name))
+
+
+def _check_bindable(address):
+    """Raise socket.error if a TCP server can't bind to an address (e.g.
+    as another process is listening on it)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name != 'nt':
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+    finally:
+        sock.close()
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def _get_verifier():
+    """Return the shared _InvocationVerifier, creating it if needed."""
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = _InvocationVerifier(server=verifier_server)
+        return _verifier
+
+
+class SubmissionError(Exception):
+    """Raised when an identity assertion couldn't be submitted.
+
+    Attributes:
+        response: The last SubmissionResponse received, or None if no response
+                  was received.
+
+    """
+
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.response = response
+
+
+SubmissionResponse = namedtuple('SubmissionResponse', 'status reason headers '
+                                                      'body')
+
+
+class _ResponseError(Exception):
+    """Raised when no response was received to a request that was sent. The
+    request isn't retried, as the server may have processed it."""
+
+
+def _is_dropped(connection):
+    """Return whether an idle connection can't be reused, as it's closed or
+    readable (e.g. the server closed it) while no response is expected."""
+    if connection.sock is None:
+        return True
+    try:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class AssertionSubmitter():
+    """Submit signed identity assertions to authentication URLs, reusing
+    keep-alive connections pooled per origin.
+
+    Arguments:
+        max_idle_per_origin: Maximum number of idle connections kept open to
+                             each origin.
+        timeout: Seconds to wait to connect and for each response.
+        retries: Number of times to retry a submission after failing to
+                 connect or to send it, or after a 502, 503 or 504 response.
+                 A submission that was sent but got no response (e.g. it
+                 timed out) isn't retried, as it may have been processed.
+        backoff: Base seconds of the exponential backoff before retrying. Each
+                 delay is jittered between zero and the exponential delay.
+        max_backoff: Maximum seconds of the backoff before retrying.
+
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, max_idle_per_origin=4, timeout=10, retries=2,
+                 backoff=0.25, max_backoff=4):
+        self._max_idle_per_origin = max_idle_per_origin
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> list of idle connections
+        self._idle = {}
+
+    def _get_connection(self, origin):
+        """Return an idle connection to an origin, or a new one, and whether
+        it was reused. If the idle connection was dropped (e.g. closed by the
+        server while idle), the origin's other idle connections, which are
+        most likely dropped too, are closed and a new one is returned."""
+        with self._lock:
+            idle = self._idle.get(origin)
+            connection = idle.pop() if idle else None
+        if connection is not None:
+            if not _is_dropped(connection):
+                return connection, True
+            connection.close()
+            self._drop_idle(origin)
+        scheme, host, port = origin
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class(host, port, timeout=self._timeout), False
+
+    def _put_connection(self, origin, connection):
+        """Return a connection to the pool of an origin."""
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self._max_idle_per_origin:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _drop_idle(self, origin):
+        """Close all the idle connections to an origin."""
+        with self._lock:
+            idle = self._idle.pop(origin, [])
+        for connection in idle:
+            connection.close()
+
+    def _request(self, origin, path, body, headers):
+        """Send a request over a pooled connection, returning its
+        SubmissionResponse.
+
+        Failing to connect or to send the request raises socket.error or
+        httplib.HTTPException, except that failing to send it over a reused
+        connection (e.g. it was closed by the server while idle) is retried
+        once on a new one, after closing the origin's other idle connections,
+        which are most likely stale too. Failing to receive the response once
+        the request was sent raises _ResponseError.
+
+        """
+        while True:
+            connection, reused = self._get_connection(origin)
+            try:
+                connection.request('POST', path, body, headers)
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                if reused:
+                    self._drop_idle(origin)
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+                response_body = response.read()
+            except (socket.error, httplib.HTTPException), e:
+                connection.close()
+                raise _ResponseError(str(e) or type(e).__name__)
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(origin, connection)
+            return SubmissionResponse(response.status, response.reason,
+                                      dict(response.getheaders()),
+                                      response_body)
+
+    def submit(self, auth_url, identity_assertion, mode, signature,
+               public_key=None):
+        """POST a signed identity assertion to auth_url as JSON, returning the
+        SubmissionResponse.
+
+        Arguments:
+            auth_url: HTTP(S) URL of the server-side authentication
+                      application.
+            identity_assertion: The identity assertion string.
+            mode: MODE_REGISTER or MODE_AUTH.
+            signature: Base64-encoded signature of the identity assertion.
+            public_key: OpenSSH-format public key, sent in MODE_REGISTER.
+
+        """
+        auth_url_components = urlparse(auth_url)
+        scheme = auth_url_components.scheme
+        if scheme not in ('http', 'https') or not auth_url_components.hostname:
+            raise ValueError("authentication URL must be a HTTP(S) URL")
+        port = auth_url_components.port
+        if port is None:
+            port = 443 if scheme == 'https' else 80
+        origin = (scheme, auth_url_components.hostname, port)
+        path = auth_url_components.path or "/"
+        if auth_url_components.query:
+            path += "?" + auth_url_components.query
+
+        payload = {'auth_url': auth_url,
+                   'identity_assertion': identity_assertion,
+                   'mode': mode,
+                   'signature': signature}
+        if mode == MODE_REGISTER:
+            if public_key is None:
+                raise ValueError("a public key is required to register")
+            payload['public_key'] = public_key
+        body = json.dumps(payload)
+        headers = {'Content-Type': "application/json",
+                   'Accept': "application/json"}
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self._request(origin, path, body, headers)
+                error = None
+            except (socket.error, httplib.HTTPException), e:
+                error = e
+            except _ResponseError, e:
+                raise SubmissionError("no response to the submission to {0}: "
+                                      "{1}".format(auth_url, e))
+            if error is None and response.status not in self.RETRY_STATUSES:
+                return response
+
+            if attempt >= self._retries:
+                if error is not None:
+                    raise SubmissionError("submission to {0} failed: {1}"
+                                          .format(auth_url, error))
+                raise SubmissionError("submission to {0} failed with status "
+                                      "{1}".format(auth_url, response.status),
+                                      response=response)
+            delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+
+_submitter = None
+_submitter_lock = threading.Lock()
+
+
+def submit_assertion(*args, **kwargs):
+    """Submit a signed identity assertion with the shared AssertionSubmitter
+    (see AssertionSubmitter.submit()), so that repeated submissions to the
+    same site reuse its connections."""
+    global _submitter
+    with _submitter_lock:
+        if _submitter is None:
+            _submitter = AssertionSubmitter()
+    return _submitter.submit(*args, **kwargs)
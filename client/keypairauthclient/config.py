@@ -4,6 +4,7 @@ import errno
 import os
 import shutil
 import stat
+import threading
 import time
 
 import dicttools
@@ -19,9 +20,13 @@ removed = force_list(default=list())
 name = string(default="")
 added = float()
 last_used = float(default=-1)
+use_count = integer(default=0)
+used_origins = force_list(default=list())
 on_interchangeable_storage = integer(default=-1)
 passphrased = integer(default=-1)
 last_file_check = float(default=-1)
+file_identity = int_list(default=list())
+header_hash = string(default="")
 available = boolean(default=False)
 fingerprint = string()
 """
@@ -44,6 +49,11 @@ class Config():
         self._backup_filename = filename + ".backup"
         self._backup_temp_filename = self._backup_filename + ".temp"
 
+        # Lock held while the configuration is saved or synchronised, which
+        # users sharing the configuration between threads also hold while
+        # changing it (it is reentrant, so they can save while holding it)
+        self.lock = threading.RLock()
+
         # Set the number of seconds the temporary configuration "lock" file can
         # exist without it being assumed that the application that made it died
         self._temp_file_timeout = 2
@@ -111,6 +121,10 @@ class Config():
 
     def save(self):
         """Save the configuration to its file."""
+        with self.lock:
+            self._save()
+
+    def _save(self):
         # Sanity check: ensure that the configuration is valid before saving
         self.validate()
 
@@ -165,14 +179,15 @@ class Config():
         # Attempt to secure configuration file permissions (file can only be
         # read from and written to by the owner)
         try:
-            os.fchmod(self._temp_filename, stat.S_IRUSR | stat.S_IWUSR)
-        except AttributeError:
-            # Unsupported by the system
+            os.chmod(self._temp_filename, stat.S_IRUSR | stat.S_IWUSR)
+        except OSError:
+            # Unsupported by the system, or the temporary file doesn't exist
+            # yet (a new configuration)
             pass
 
         # Synchronise the configuration before writing it out
         if not new_config:
-            self.sync(filename=self._temp_filename)
+            self._sync(filename=self._temp_filename)
 
         # Make a backup of the configuration file in case the application
         # doesn't finish writing the configuration out
@@ -197,6 +212,10 @@ class Config():
     def sync(self, filename=None):
         """Update the configuration values from a specified configuration file
         if the file is newer than the current configuration."""
+        with self.lock:
+            return self._sync(filename)
+
+    def _sync(self, filename=None):
         if filename is None:
             filename = self._configobj.filename
 
@@ -1,17 +1,222 @@
 """Keypair database management."""
 
 import binascii
-import glob
+import bisect
+import collections
+import fnmatch
+import hashlib
+import itertools
+from multiprocessing.pool import ThreadPool
 import os
 import stat
+import sys
+import threading
 import time
+import traceback
 
+import dirwatch
 try:
     import drives
 except ImportError:
     pass
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 from keypairauthclient import keypairengine
 
+# Number of bytes at the start of a keypair file that are hashed to recognise
+# the file when its identity changes only by device (e.g. its removable media
+# was remounted)
+HEADER_HASH_SIZE = 4096
+
+
+class FileState(collections.namedtuple('FileState', 'mtime size inode is_dir '
+                                       'device mtime_ns ctime_ns')):
+    """The state of a file as collected by KeypairDB."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_stat(cls, file_stat, inode=None):
+        """Return the FileState of an os.stat() result, optionally overriding
+        its inode number."""
+        if inode is None:
+            inode = file_stat.st_ino
+        try:
+            mtime_ns = file_stat.st_mtime_ns
+            ctime_ns = file_stat.st_ctime_ns
+        except AttributeError:
+            mtime_ns = int(round(file_stat.st_mtime * 1e9))
+            ctime_ns = int(round(file_stat.st_ctime * 1e9))
+        return cls(file_stat.st_mtime, file_stat.st_size, inode,
+                   stat.S_ISDIR(file_stat.st_mode), file_stat.st_dev,
+                   mtime_ns, ctime_ns)
+
+    @property
+    def identity(self):
+        """Return the file's identity: a (device, inode, size, mtime_ns,
+        ctime_ns) list, as stored in a keypair's file_identity property."""
+        return [self.device, self.inode, self.size, self.mtime_ns,
+                self.ctime_ns]
+
+
+# A compact, immutable record of a keypair's properties (see
+# KeypairDB.snapshot())
+KeypairRecord = collections.namedtuple('KeypairRecord', 'filename name '
+                                       'fingerprint added last_used use_count '
+                                       'used_origins on_interchangeable_storage '
+                                       'passphrased available')
+
+
+class KeypairSnapshot(object):
+    """An immutable collection of KeypairRecord objects of every keypair in the
+    keypair database at one generation (see KeypairDB.snapshot()).
+
+    Iterating a snapshot yields its records in filename order; records can be
+    looked up by filename.
+
+    """
+
+    __slots__ = ('_generation', '_records', '_records_by_filename')
+
+    def __init__(self, generation, records):
+        self._generation = generation
+        self._records = tuple(sorted(records))
+        self._records_by_filename = dict((record.filename, record)
+                                         for record in self._records)
+
+    @property
+    def generation(self):
+        """Return the keypair database generation the snapshot was built
+        at."""
+        return self._generation
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, filename):
+        return filename in self._records_by_filename
+
+    def __getitem__(self, filename):
+        return self._records_by_filename[filename]
+
+    @property
+    def filenames(self):
+        """Return a tuple of the keypair filenames in the snapshot."""
+        return tuple(record.filename for record in self._records)
+
+
+def hash_file_header(filename):
+    """Return a hex digest of the first HEADER_HASH_SIZE bytes of a file."""
+    file_handle = open(filename, 'rb')
+    header = file_handle.read(HEADER_HASH_SIZE)
+    file_handle.close()
+    return hashlib.sha1(header).hexdigest()
+
+# Minimum number of files for KeypairDB.import_many() to read the files in a
+# thread pool rather than in the calling thread
+IMPORT_POOL_THRESHOLD = 8
+
+# Number of threads KeypairDB.import_many() reads files on by default; files
+# may be on slow storage, so reads are overlapped even on a single CPU
+IMPORT_THREADS = 4
+
+
+def _read_keypair_file(job):
+    """Read a keypair file for KeypairDB.import_many() (possibly on a worker
+    thread), returning a (filename, properties, error) tuple."""
+    filename, passphrase = job
+    try:
+        keypair = keypairengine.read(filename, passphrase=passphrase)
+        file_state = FileState.from_stat(os.stat(filename))
+        properties = {
+                      'name': os.path.splitext(os.path.basename(filename))[0],
+                      'fingerprint': keypairengine.fingerprint(keypair),
+                      'passphrased': int(keypairengine.is_pem_passphrased(
+                                                                   filename)),
+                      'last_file_check': file_state.mtime,
+                      'file_identity': file_state.identity,
+                      'header_hash': hash_file_header(filename),
+                      'available': True,
+                      }
+    except Exception, e:
+        return filename, None, e
+    return filename, properties, None
+
+
+class KeypairRoot():
+    """A directory tree that is checked for keypair file additions and
+    deletions.
+
+    Arguments:
+        path: Root directory.
+        depth: Number of levels of subdirectories to descend into. Set to -1
+               for infinite recursiveness.
+        include: fnmatch patterns of the file names to treat as keypair files.
+        exclude: fnmatch patterns of the file and directory names to skip.
+        scan_budget: Maximum seconds a scan of the root may take, or None for
+                     no limit. A scan that runs out of time (e.g. on a slow
+                     or hung mount) doesn't hold up the scans of the other
+                     roots, and no files under the root are considered deleted
+                     until a scan completes.
+
+    """
+
+    def __init__(self, path, depth=0, include=("*.key",), exclude=(),
+                 scan_budget=5):
+        self.path = path
+        self.depth = depth
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.scan_budget = scan_budget
+
+    def excludes(self, name):
+        """Return True if a file or directory name is excluded."""
+        for pattern in self.exclude:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def includes(self, name):
+        """Return True if a file name is included."""
+        for pattern in self.include:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def contains(self, filename):
+        """Return True if a file is within the root's directory tree (within
+        its depth)."""
+        try:
+            relative_path = os.path.relpath(filename, self.path)
+        except ValueError:
+            # On a different drive (Windows)
+            return False
+        if (relative_path == os.pardir
+            or relative_path.startswith(os.pardir + os.sep)):
+            return False
+        levels = relative_path.count(os.sep)
+        return self.depth == -1 or levels <= self.depth
+
+    def matches(self, filename):
+        """Return True if a file is within the root and is a keypair file
+        according to the include and exclude patterns."""
+        if not self.contains(filename):
+            return False
+        relative_path = os.path.relpath(filename, self.path)
+        names = relative_path.split(os.sep)
+        for name in names:
+            if self.excludes(name):
+                return False
+        return self.includes(names[-1])
+
 
 class KeypairDB():
     """A keypair database object for managing (adding, removing, etc)
@@ -23,28 +228,108 @@ class KeypairDB():
         my_keypairs_dir: Default/main keypair storage directory. This directory
                          is checked for additions and deletions if
                          sync_my_keypairs_dir is True.
-        sync_my_keypairs_dir: See my_keypairs_dir.
+        sync_my_keypairs_dir: See my_keypairs_dir and keypair_roots.
+        keypair_roots: List of additional KeypairRoot objects that are
+                       checked for additions and deletions (concurrently) if
+                       sync_my_keypairs_dir is True.
+        file_state_lifetime: Seconds that the file states collected by a
+                             directory scan are reused for (by other scans
+                             and property lookups) before the directory is
+                             scanned again.
+        refresh_interval: Seconds after a keypair's dynamic properties were
+                          determined before a lookup queues them to be
+                          refreshed again.
 
     """
 
     def __init__(self, config, my_keypairs_dir=None,
-                 sync_my_keypairs_dir=False):
+                 sync_my_keypairs_dir=False, keypair_roots=None,
+                 file_state_lifetime=0.5, refresh_interval=1):
         self._config = config
+        # Guards changes to (and the saving of) the configuration, which the
+        # background refresher and the GUI thread share
+        self._lock = config.lock
         self._my_keypairs_dir = my_keypairs_dir
         self.sync_my_keypairs_dir = sync_my_keypairs_dir
+        self.file_state_lifetime = file_state_lifetime
+        self.refresh_interval = refresh_interval
+
+        self._roots = []
+        if my_keypairs_dir is not None:
+            self._roots.append(KeypairRoot(my_keypairs_dir))
+        if keypair_roots is not None:
+            self._roots.extend(keypair_roots)
+
+        # Root path -> frozenset of the keypair files found by the last
+        # completed scan of the root
+        self._root_listings = {}
+        # Root path -> (AsyncResult, start time) of scans in progress
+        self._root_scans = {}
+        self._scan_pool = None
+        self._no_sync = set()
+        # Held by _sync_keypair_roots(), which scans the roots without holding
+        # the configuration lock
+        self._roots_sync_lock = threading.Lock()
+
+        # Set mirror of the persistent keypairdb_meta 'removed' list, rebuilt
+        # whenever the list is replaced (e.g. by a configuration sync)
+        self._removed_list = None
+        self._removed_set = set()
+
+        # Cache of directory scans: directory name -> (scan time, dictionary
+        # mapping entry names to their FileState)
+        self._dir_states = {}
+        # Directory listings used without os.scandir: directory name ->
+        # (FileState of the directory, list of entry names)
+        self._dir_listings = {}
+        # Directory name -> number of times its cached scans were
+        # invalidated, so that a scan in progress at the time isn't cached
+        self._dir_invalidations = {}
+        self._dir_cache_lock = threading.Lock()
 
-        self._my_keypairs_dir_listing = None
-        self._no_sync = []
+        # Directory watcher (see watch()); while watching, keypair roots are
+        # only rescanned after the watcher reports a change in them
+        self._watcher = None
+        self._watch_callback = None
+        self._changed_roots = set(root.path for root in self._roots)
+
+        # In-memory secondary indexes over the keypair database, rebuilt
+        # whenever the keypairdb section is replaced (e.g. by a configuration
+        # sync)
+        self._indexed_section = None
+        self._index_entries = {}  # filename -> (fingerprint, name, recency)
+        self._fingerprint_index = collections.defaultdict(set)
+        self._name_index = collections.defaultdict(set)
+        self._recency_index = []  # sorted list of (recency, filename)
+
+        # Background refresher of dynamic keypair properties (see
+        # __getitem__())
+        self._refresh_condition = threading.Condition()
+        self._refresh_queue = []
+        self._refresh_pending = set()
+        self._refresh_batch_delay = 0.05
+        self._refresher = None
+        self._refresh_listeners = []
+        self._checked = {}  # filename -> time properties were determined
+
+        # Generation of the keypair database, incremented on every change,
+        # and the snapshot built for it (see snapshot())
+        self._generation = 0
+        self._snapshot = None
+        self._snapshot_section = None
 
     @property
     def __iter__(self):
-        # Synchronise the keypair database with the My Keypairs directory
-        # before returning the iterator
+        # Synchronise the keypair database with the My Keypairs directory and
+        # the other keypair roots before returning the iterator
         if self.sync_my_keypairs_dir:
-            self._sync_my_keypairs_dir()
+            self._sync_keypair_roots()
 
-        # Return the iterator
-        return self._keypairdb_config.__iter__
+        # Return an iterator over a copy of the filenames, as the keypairdb
+        # section may change while it is being iterated over
+        with self._lock:
+            filenames = self._keypairdb_config.keys()
+        return filenames.__iter__
 
     @property
     def _keypairdb_config(self):
@@ -54,6 +339,21 @@ class KeypairDB():
     def _keypairdb_meta_config(self):
         return self._config['keypairdb_meta']
 
+    @property
+    def _removed_keypairs(self):
+        """Return the set of keypair filenames tagged as removed."""
+        removed_list = self._keypairdb_meta_config['removed']
+        if removed_list is not self._removed_list:
+            self._removed_list = removed_list
+            self._removed_set = set(removed_list)
+        return self._removed_set
+
+    def _set_removed_keypairs(self, removed_keypairs):
+        """Replace the set of keypair filenames tagged as removed."""
+        self._keypairdb_meta_config['removed'] = list(removed_keypairs)
+        self._removed_list = self._keypairdb_meta_config['removed']
+        self._removed_set = set(removed_keypairs)
+
     @property
     def my_keypairs_dir(self):
         """Return the My Keypairs directory, creating it if it doesn't
@@ -66,108 +366,839 @@ class KeypairDB():
 
         return self._my_keypairs_dir
 
+    @property
+    def watching(self):
+        """True if the keypair directories are being watched for changes."""
+        return self._watcher is not None
+
+    @property
+    def keypair_roots(self):
+        """Return the list of KeypairRoot objects checked for additions and
+        deletions, the first of which is the My Keypairs directory if there
+        is one."""
+        return list(self._roots)
+
+    def watch(self, callback=None):
+        """Start watching the keypair roots and the directories containing
+        keypairs for changes, instead of polling them.
+
+        callback is called from the watcher thread with a coalesced batch of
+        changes (see the dirwatch module) after the database has taken note of
+        them.
+
+        """
+        if self._watcher is not None:
+            self.unwatch()
+
+        self._watch_callback = callback
+        self._watcher = dirwatch.dir_watcher(self._on_dir_changes)
+        self._changed_roots.update(root.path for root in self._roots)
+
+        # Subdirectories of the roots are watched as they are scanned
+        with self._lock:
+            dirnames = set(os.path.dirname(filename)
+                           for filename in self._keypairdb_config)
+        dirnames.update(root.path for root in self._roots)
+        for dirname in dirnames:
+            self._watcher.watch(dirname)
+
+    def unwatch(self):
+        """Stop watching for changes (see watch())."""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+            self._watch_callback = None
+
+    def _on_dir_changes(self, changes):
+        """Handle a batch of changes reported by the directory watcher."""
+        for path, change in changes.iteritems():
+            if change == dirwatch.RESCAN:
+                dirname = path
+            else:
+                dirname = os.path.dirname(path)
+
+            # Cached scans of the directory are now out of date
+            self._invalidate_dir(dirname)
+
+            for root in self._roots:
+                if root.contains(dirname):
+                    self._changed_roots.add(root.path)
+
+        if self._watch_callback is not None:
+            self._watch_callback(changes)
+
+    def _build_indexes(self):
+        """Rebuild the secondary indexes if the keypairdb section has been
+        replaced since they were built."""
+        keypairdb_config = self._keypairdb_config
+        if keypairdb_config is self._indexed_section:
+            return
+
+        self._indexed_section = keypairdb_config
+        self._index_entries = {}
+        self._fingerprint_index = collections.defaultdict(set)
+        self._name_index = collections.defaultdict(set)
+        self._recency_index = []
+
+        for filename, properties in keypairdb_config.iteritems():
+            self._index_keypair(filename, properties)
+
+    def _index_keypair(self, filename, properties):
+        """Add (or update) a keypair in the secondary indexes."""
+        if self._indexed_section is not self._keypairdb_config:
+            # Stale indexes are rebuilt on the next query
+            return
+
+        if properties['last_used'] != -1:
+            recency = properties['last_used']
+        else:
+            recency = properties['added']
+        entry = (properties['fingerprint'], properties['name'], recency)
+
+        if self._index_entries.get(filename) == entry:
+            return
+        self._unindex_keypair(filename)
+
+        self._index_entries[filename] = entry
+        self._fingerprint_index[entry[0]].add(filename)
+        self._name_index[entry[1]].add(filename)
+        bisect.insort(self._recency_index, (recency, filename))
+
+    def _unindex_keypair(self, filename):
+        """Remove a keypair from the secondary indexes."""
+        try:
+            fingerprint, name, recency = self._index_entries.pop(filename)
+        except KeyError:
+            return
+
+        self._fingerprint_index[fingerprint].discard(filename)
+        if not self._fingerprint_index[fingerprint]:
+            del self._fingerprint_index[fingerprint]
+        self._name_index[name].discard(filename)
+        if not self._name_index[name]:
+            del self._name_index[name]
+        index = bisect.bisect_left(self._recency_index, (recency, filename))
+        del self._recency_index[index]
+
+    def find_by_fingerprint(self, fingerprint):
+        """Return the filename of the keypair with a fingerprint (the most
+        recently used or added one if several files hold the same keypair),
+        or None if there isn't one."""
+        with self._lock:
+            self._build_indexes()
+            filenames = self._fingerprint_index.get(fingerprint)
+            if not filenames:
+                return None
+            return max(filenames,
+                       key=lambda filename: self._index_entries[filename][2])
+
+    def find_by_name(self, name):
+        """Return a sorted list of the filenames of the keypairs with a
+        name."""
+        with self._lock:
+            self._build_indexes()
+            return sorted(self._name_index.get(name, ()))
+
+    def most_recent(self, n):
+        """Return the filenames of the n most recently used keypairs, most
+        recent first, falling back to the time keypairs were added for
+        keypairs that have never been used."""
+        with self._lock:
+            self._build_indexes()
+            if n <= 0:
+                return []
+            return [filename for recency, filename
+                    in reversed(self._recency_index[-n:])]
+
+    def _changed(self):
+        """Note a change to the keypair database."""
+        self._generation += 1
+
+    @property
+    def generation(self):
+        """Return the generation of the keypair database, which is
+        incremented on every change."""
+        return self._generation
+
+    def snapshot(self, sync=False):
+        """Return a KeypairSnapshot of the keypair database.
+
+        Snapshots are only built once per generation, and reading them
+        doesn't access keypair files or the configuration. If sync is True,
+        the keypair database is first synchronised with the keypair roots
+        (if sync_my_keypairs_dir is True), which may take a while; the
+        database stays usable from other threads meanwhile.
+
+        """
+        if sync and self.sync_my_keypairs_dir:
+            self._sync_keypair_roots()
+
+        with self._lock:
+            keypairdb_config = self._keypairdb_config
+            if keypairdb_config is not self._snapshot_section:
+                # Replaced (e.g. by a configuration sync)
+                self._snapshot_section = keypairdb_config
+                self._changed()
+
+            snapshot = self._snapshot
+            if (snapshot is not None
+                    and snapshot.generation == self._generation):
+                return snapshot
+
+            generation = self._generation
+            records = []
+            for filename, properties in keypairdb_config.items():
+                get = properties.get
+                records.append(KeypairRecord(
+                    filename,
+                    get('name', ""),
+                    get('fingerprint', ""),
+                    get('added', -1),
+                    get('last_used', -1),
+                    get('use_count', 0),
+                    tuple(get('used_origins', ())),
+                    get('on_interchangeable_storage', -1),
+                    get('passphrased', -1),
+                    get('available', False)))
+
+            self._snapshot = snapshot = KeypairSnapshot(generation, records)
+            return snapshot
+
+    def refresh_stale(self, filenames=None):
+        """Queue the properties of keypairs that may be out of date to be
+        refreshed in the background (see __getitem__()), without accessing
+        the file system. All keypairs are checked if filenames is None."""
+        with self._lock:
+            keypairdb_config = self._keypairdb_config
+            if filenames is None:
+                filenames = keypairdb_config.keys()
+            for filename in filenames:
+                try:
+                    properties = keypairdb_config[filename]
+                except KeyError:
+                    continue
+                if self._is_stale(filename, properties):
+                    self._queue_refresh(filename)
+
     def __getitem__(self, filename):
-        """Return a keypair's properties, determining or updating dynamic
-        properties as necessary."""
-        properties = self._keypairdb_config[filename]
+        """Return a keypair's properties.
+
+        This doesn't access the keypair's file, save the configuration or
+        update the secondary indexes; the cached properties are returned
+        immediately. If they may be out of date, a refresh is queued to a
+        background thread and the refresh listeners (see
+        add_refresh_listener()) are notified if any properties change.
+
+        """
+        with self._lock:
+            properties = self._keypairdb_config[filename]
+
+            if self._is_stale(filename, properties):
+                self._queue_refresh(filename)
+
+        return properties
+
+    def _is_stale(self, filename, properties):
+        """Return True if a keypair's dynamic properties may be out of date,
+        without accessing the file system."""
+        checked = self._checked.get(filename)
+        if checked is None or time.time() - checked > self.refresh_interval:
+            return True
+
+        # Compare against a recent scan of the keypair's directory if there
+        # is one
+        try:
+            scan_time, states = self._dir_states[os.path.dirname(filename)]
+        except KeyError:
+            return False
+        if scan_time < checked:
+            return False
+        file_state = states.get(os.path.basename(filename))
+        if file_state is None:
+            return properties['available']
+        return (not properties['available']
+                or file_state.identity != properties['file_identity'])
+
+    def _determine_properties(self, filename):
+        """Return a dictionary of a keypair's dynamic properties determined
+        from its file, where they need updating."""
+        with self._lock:
+            properties = self._keypairdb_config[filename].dict()
         new_properties = {}
 
         # Determine keypair name from filename
         new_properties['name'] = os.path.basename(filename)
         new_properties['name'] = os.path.splitext(new_properties['name'])[0]
 
-        # Calculate the difference between the current keypair file
-        # modification time and the modification time when it was last checked
-        try:
-            mtime = os.path.getmtime(filename)
-            time_difference = mtime - properties['last_file_check']
-            time_difference = round(time_difference, 2)
-            new_properties['available'] = True
-        except OSError:
+        # Compare the keypair file's current identity with its identity when
+        # it was last checked
+        file_state = self._get_file_state(filename)
+        if file_state is None:
             # An example of a legitimate case when this might happen is if the
             # PEM file is stored on removable media, and the media is removed
-            time_difference = 0
             new_properties['available'] = False
+            return new_properties
+        new_properties['available'] = True
+
+        identity = file_state.identity
+        old_identity = properties['file_identity']
+        if identity == old_identity:
+            return new_properties
+
+        # A file whose identity changed only by device is most likely the
+        # same file on remounted removable media; if its header is unchanged
+        # too, its properties don't need to be determined again
+        if (len(old_identity) == len(identity)
+            and identity[1:] == old_identity[1:]
+            and properties['header_hash']):
+            header_hash = hash_file_header(filename)
+            if header_hash == properties['header_hash']:
+                new_properties['file_identity'] = identity
+                return new_properties
+        else:
+            header_hash = hash_file_header(filename)
 
         #
         # Perform property updates that involve accessing the keypair's PEM
-        # file if it has been modified since the last check
+        # file as it has changed since the last check
         #
-        if time_difference != 0:
 
-            # Update last check modification time
-            new_properties['last_file_check'] = mtime
+        # Update last check file identity
+        new_properties['last_file_check'] = file_state.mtime
+        new_properties['file_identity'] = identity
+        new_properties['header_hash'] = header_hash
+
+        # Is the PEM file on removable media?
+        is_interchangeable = self._is_interchangeable(filename,
+                                                      device=file_state.device)
+        new_properties['on_interchangeable_storage'] = is_interchangeable
+
+        # Is the private key encrypted with a passphrase?
+        is_pem_passphrased = keypairengine.is_pem_passphrased(filename)
+        new_properties['passphrased'] = int(is_pem_passphrased)
+
+        return new_properties
+
+    def _apply_properties(self, new_properties_map, checked):
+        """Update keypairs' properties from a dictionary mapping filenames to
+        new properties, saving the configuration once if any properties
+        changed, and return a list of the filenames of the changed
+        keypairs."""
+        with self._lock:
+            changed_filenames = []
+
+            for filename, new_properties in new_properties_map.iteritems():
+                try:
+                    properties = self._keypairdb_config[filename]
+                except KeyError:
+                    # Removed in the meantime
+                    continue
+                self._checked[filename] = checked
+
+                updated_properties = properties.dict()
+                updated_properties.update(new_properties)
+                if properties != updated_properties:
+                    self._keypairdb_config[filename] = updated_properties
+                    self._index_keypair(filename,
+                                        self._keypairdb_config[filename])
+                    changed_filenames.append(filename)
+
+            if changed_filenames:
+                self._changed()
+                self._config.save()
+
+            return changed_filenames
+
+    def refresh(self, filename):
+        """Determine or update a keypair's dynamic properties now, saving the
+        configuration if they changed, and return its properties."""
+        checked = time.time()
+        new_properties = self._determine_properties(filename)
+        changed_filenames = self._apply_properties({filename: new_properties},
+                                                   checked)
+        if changed_filenames:
+            self._notify_refresh_listeners(changed_filenames)
+
+        return self._keypairdb_config[filename]
+
+    def add_refresh_listener(self, listener):
+        """Add a callable that is called with a list of keypair filenames
+        whenever their properties have been refreshed with new values.
 
-            # Is the PEM file on removable media?
+        Listeners are called from the background refresher thread (or the
+        thread calling refresh()).
+
+        """
+        self._refresh_listeners.append(listener)
+
+    def remove_refresh_listener(self, listener):
+        """Remove a listener added with add_refresh_listener()."""
+        self._refresh_listeners.remove(listener)
+
+    def _notify_refresh_listeners(self, filenames):
+        for listener in list(self._refresh_listeners):
+            listener(filenames)
+
+    def _queue_refresh(self, filename):
+        """Queue a keypair's properties to be refreshed in the background."""
+        with self._refresh_condition:
+            if filename in self._refresh_pending:
+                return
+            self._refresh_pending.add(filename)
+            self._refresh_queue.append(filename)
+
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._refresh_loop)
+                self._refresher.daemon = True
+                self._refresher.start()
+            self._refresh_condition.notify()
+
+    def _refresh_loop(self):
+        """Refresh queued keypair properties in batches."""
+        while True:
+            with self._refresh_condition:
+                while not self._refresh_queue:
+                    self._refresh_condition.wait()
+
+            # Let lookups made in quick succession join the batch
+            time.sleep(self._refresh_batch_delay)
+
+            with self._refresh_condition:
+                filenames = self._refresh_queue
+                self._refresh_queue = []
+
+            checked = time.time()
+            new_properties_map = {}
+            for filename in filenames:
+                try:
+                    new_properties = self._determine_properties(filename)
+                except KeyError:
+                    # Removed in the meantime
+                    continue
+                except Exception:
+                    # E.g. the file went away while being read; the next
+                    # lookup will queue it again
+                    continue
+                new_properties_map[filename] = new_properties
+
+            # A batch that fails to be applied (e.g. as the configuration
+            # can't be saved) is dropped rather than ending the refresher;
+            # the next lookups will queue its keypairs again
             try:
-                is_interchangeable = int(drives.is_interchangeable(filename))
-            except NameError:
-                is_interchangeable = -1
-            new_properties['on_interchangeable_storage'] = is_interchangeable
-
-            # Is the private key encrypted with a passphrase?
-            is_pem_passphrased = keypairengine.is_pem_passphrased(filename)
-            new_properties['passphrased'] = int(is_pem_passphrased)
-
-        # Update the keypair's properties and save the configuration if the new
-        # properties are different than the old properties
-        updated_properties = properties.dict()
-        updated_properties.update(new_properties)
-        if properties != updated_properties:
-            properties = self._keypairdb_config[filename] = updated_properties
-            self._config.save()
+                changed_filenames = self._apply_properties(new_properties_map,
+                                                           checked)
+                if changed_filenames:
+                    self._notify_refresh_listeners(changed_filenames)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._refresh_condition:
+                    self._refresh_pending.difference_update(filenames)
 
-        return properties
+    def _is_interchangeable(self, filename, device=None):
+        """Return 1 if a file is on removable media, 0 if it isn't, or -1 if
+        this can't be determined. device is the file's device ID, if known."""
+        try:
+            return int(drives.is_interchangeable(filename, device=device))
+        except NameError:
+            return -1
+
+    def _scan_dir(self, dirname):
+        """Return a dictionary mapping the names of the (non-hidden) entries
+        of a directory to their FileState, gathered with a single directory
+        scan (see _stat_dir() where os.scandir isn't available), or None if
+        the directory isn't currently accessible.
+
+        Scans are cached for self.file_state_lifetime seconds.
+
+        """
+        now = time.time()
+        try:
+            scan_time, states = self._dir_states[dirname]
+            if now - scan_time <= self.file_state_lifetime:
+                return states
+        except KeyError:
+            pass
+        invalidations = self._dir_invalidations.get(dirname, 0)
+
+        if scandir is None:
+            states = self._stat_dir(dirname, invalidations)
+        else:
+            states = {}
+            try:
+                entries = scandir(dirname)
+            except OSError:
+                # The directory isn't currently accessible
+                return None
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    states[entry.name] = FileState.from_stat(entry.stat(),
+                                                             entry.inode())
+                except OSError:
+                    pass
+
+        if states is not None:
+            self._cache_dir_scan(dirname, invalidations,
+                                 self._dir_states, (now, states))
+        return states
+
+    def _stat_dir(self, dirname, invalidations):
+        """Return a dictionary mapping the names of the (non-hidden) entries
+        of a directory to their FileState without os.scandir, or None if the
+        directory isn't currently accessible.
+
+        The entries are stated on every call, as rewriting a file in place
+        doesn't change its directory, but the directory's listing is reused
+        while the directory's own state is unchanged.
+
+        """
+        try:
+            dir_state = FileState.from_stat(os.stat(dirname))
+        except OSError:
+            # The directory isn't currently accessible
+            self._dir_listings.pop(dirname, None)
+            return None
+
+        try:
+            listing_state, names = self._dir_listings[dirname]
+        except KeyError:
+            listing_state = names = None
+        if listing_state != dir_state:
+            list_time = time.time()
+            try:
+                names = [name for name in os.listdir(dirname)
+                         if not name.startswith(".")]
+            except OSError:
+                self._dir_listings.pop(dirname, None)
+                return None
+            # Only reuse a listing of a directory that didn't change while it
+            # was listed, and that wasn't modified in the second before (it
+            # may have been modified again since without its modification
+            # time changing)
+            try:
+                changed = FileState.from_stat(os.stat(dirname)) != dir_state
+            except OSError:
+                changed = True
+            if not changed and dir_state.mtime < list_time - 1:
+                self._cache_dir_scan(dirname, invalidations,
+                                     self._dir_listings, (dir_state, names))
+
+        states = {}
+        for name in names:
+            try:
+                file_stat = os.stat(os.path.join(dirname, name))
+            except OSError:
+                continue
+            states[name] = FileState.from_stat(file_stat)
+        return states
+
+    def _cache_dir_scan(self, dirname, invalidations, cache, scan):
+        """Cache a scan of a directory, unless the directory's cached scans
+        have been invalidated since the scan started."""
+        with self._dir_cache_lock:
+            if self._dir_invalidations.get(dirname, 0) == invalidations:
+                cache[dirname] = scan
+
+    def _invalidate_dir(self, dirname):
+        """Forget the cached scans of a directory, including any scan in
+        progress."""
+        with self._dir_cache_lock:
+            self._dir_states.pop(dirname, None)
+            self._dir_listings.pop(dirname, None)
+            self._dir_invalidations[dirname] = (
+                self._dir_invalidations.get(dirname, 0) + 1)
+
+    def _stat_file(self, filename):
+        """Return the FileState of a file, or None if the file isn't currently
+        accessible."""
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            return None
+        return FileState.from_stat(file_stat)
+
+    def _get_file_state(self, filename):
+        """Return the FileState of a file, from a recent directory scan if
+        there is one, or None if the file isn't currently accessible."""
+        try:
+            scan_time, states = self._dir_states[os.path.dirname(filename)]
+            if time.time() - scan_time <= self.file_state_lifetime:
+                return states[os.path.basename(filename)]
+        except KeyError:
+            # Not scanned, or not present at scan time; stat the file
+            # directly in case it has since been created
+            pass
+
+        return self._stat_file(filename)
+
+    def _collect_file_states(self, filenames):
+        """Return a dictionary mapping each filename to its FileState (or None
+        if the file isn't currently accessible), scanning each directory
+        containing the files once rather than stating each file."""
+        filenames_by_dir = collections.defaultdict(list)
+        for filename in filenames:
+            filenames_by_dir[os.path.dirname(filename)].append(filename)
+
+        file_states = {}
+        for dirname, dir_filenames in filenames_by_dir.iteritems():
+            states = self._scan_dir(dirname) or {}
+            for filename in dir_filenames:
+                file_states[filename] = states.get(os.path.basename(filename))
+
+        return file_states
 
-    def _get_my_keypairs_dir_listing(self):
-        return glob.glob(os.path.join(self._my_keypairs_dir, "*"))
+    def _list_dir(self, dirname):
+        """Return a list of (name, is_dir) tuples for the (non-hidden) entries
+        of a directory, or None if it isn't currently accessible."""
+        states = self._scan_dir(dirname)
+        if states is None:
+            return None
+        return [(name, state.is_dir) for name, state in states.iteritems()]
 
-    def _sync_my_keypairs_dir(self):
-        """Synchronise the keypair database with the My Keypairs directory."""
-        new_my_keypairs_dir_listing = self._get_my_keypairs_dir_listing()
+    def _scan_root(self, root):
+        """Return a (filenames, dirnames, unlisted_dirnames) tuple of a
+        frozenset of the keypair files in a root, a list of the directories
+        scanned and a frozenset of the directories among them that couldn't
+        be listed (whose contents are unknown rather than empty), or None if
+        the root isn't accessible or its scan budget ran out."""
+        if root.scan_budget is None:
+            deadline = None
+        else:
+            deadline = time.time() + root.scan_budget
 
-        if new_my_keypairs_dir_listing != self._my_keypairs_dir_listing:
-            self._my_keypairs_dir_listing = new_my_keypairs_dir_listing
+        if not os.path.isdir(root.path):
+            return None
 
-            removed_keypairs = self._keypairdb_meta_config['removed']
+        filenames = set()
+        dirnames = []
+        unlisted_dirnames = set()
+        pending_dirs = [(root.path, root.depth)]
+        while pending_dirs:
+            if deadline is not None and time.time() > deadline:
+                return None
+
+            dirname, depth = pending_dirs.pop()
+            dirnames.append(dirname)
+            entries = self._list_dir(dirname)
+            if entries is None:
+                if dirname == root.path:
+                    return None
+                unlisted_dirnames.add(dirname)
+                continue
+            for name, is_dir in entries:
+                if root.excludes(name):
+                    continue
+                if is_dir:
+                    if depth != 0:
+                        pending_dirs.append((os.path.join(dirname, name),
+                                             depth - 1))
+                elif root.includes(name):
+                    filenames.add(os.path.join(dirname, name))
+
+        return frozenset(filenames), dirnames, frozenset(unlisted_dirnames)
+
+    def _scan_roots(self, roots):
+        """Scan roots concurrently on a thread pool, returning a dictionary
+        mapping the paths of the roots whose scans completed to the results of
+        _scan_root().
+
+        A scan that runs over its root's scan budget is left running in the
+        background and its result is collected by a later call, rather than
+        being started again.
+
+        """
+        if self._scan_pool is None:
+            self._scan_pool = ThreadPool(max(1, len(self._roots)))
+
+        for root in roots:
+            if root.path not in self._root_scans:
+                async_result = self._scan_pool.apply_async(self._scan_root,
+                                                           (root,))
+                self._root_scans[root.path] = (async_result, time.time())
+
+        results = {}
+        for root in roots:
+            async_result, start_time = self._root_scans[root.path]
+            if root.scan_budget is None:
+                async_result.wait()
+            else:
+                async_result.wait(max(0, start_time + root.scan_budget
+                                      - time.time()))
+            if not async_result.ready():
+                continue
+
+            del self._root_scans[root.path]
+            result = async_result.get()
+            if result is not None:
+                results[root.path] = result
+
+        return results
+
+    def _sync_keypair_roots(self):
+        """Synchronise the keypair database with the keypair roots.
+
+        Only the keypair files added to or deleted from a root since its last
+        completed scan are examined, except on the first completed scan where
+        the whole root and keypair database are reconciled. While watching
+        (see watch()) only roots with reported changes are scanned. The
+        roots are scanned and new keypair files read without holding the
+        configuration lock.
+
+        """
+        with self._roots_sync_lock:
+            if self._watcher is None:
+                roots = self._roots
+            else:
+                roots = [root for root in self._roots
+                         if root.path in self._changed_roots]
+                self._changed_roots.difference_update(root.path
+                                                      for root in roots)
+            if not roots:
+                return
+
+            results = self._scan_roots(roots)
+            new_filenames, deleted_filenames = \
+                self._reconcile_root_listings(roots, results)
 
             # Additions
-            for filename in new_my_keypairs_dir_listing:
-                if (os.path.splitext(filename)[1] == ".key"
-                    and filename not in self._keypairdb_config
-                    and filename not in removed_keypairs
-                    and filename not in self._no_sync):
-                    try:
-                        self.import_from_file(filename)
-                    except (IOError, ValueError, binascii.Error):
-                        # Avoid trying to automatically import this keypair
-                        # for the rest of the session
-                        self._no_sync.append(filename)
+            for filename, error in self.import_many(new_filenames):
+                if isinstance(error, (EnvironmentError, ValueError,
+                                      binascii.Error)):
+                    # Avoid trying to automatically import this keypair for
+                    # the rest of the session
+                    self._no_sync.add(filename)
+                elif error is not None:
+                    raise error
 
             # Deletions
-            for filename in self._keypairdb_config:
-                if (os.path.dirname(filename) == self._my_keypairs_dir
-                    and filename not in new_my_keypairs_dir_listing):
-                    self.remove(filename, persistent=False)
+            with self._lock:
+                removed_keypairs = self._removed_keypairs
+                save = False
+                for filename in deleted_filenames:
+                    self._no_sync.discard(filename)
+                    if filename in self._keypairdb_config:
+                        self._remove(filename, persistent=False)
+                        save = True
+
+                # Compact the removed tags; a deleted file no longer needs to
+                # be kept from being re-imported
+                if not removed_keypairs.isdisjoint(deleted_filenames):
+                    self._set_removed_keypairs(removed_keypairs
+                                               - deleted_filenames)
+                    save = True
+
+                if save:
+                    self._config.save()
+
+    def _reconcile_root_listings(self, roots, results):
+        """Update the listings of roots with the results of their scans (see
+        _scan_roots()), returning a list of the new keypair files to import
+        and a set of the deleted ones."""
+        with self._lock:
+            removed_keypairs = self._removed_keypairs
+            added_filenames = set()
+            deleted_filenames = set()
+
+            for root in roots:
+                if root.path not in results:
+                    # Not accessible or still scanning; try again next time
+                    if self._watcher is not None:
+                        self._changed_roots.add(root.path)
+                    continue
+                new_listing, dirnames, unlisted_dirnames = results[root.path]
+
+                if self._watcher is not None:
+                    for dirname in dirnames:
+                        self._watcher.watch(dirname)
+                    if unlisted_dirnames:
+                        # Try to list them again next time
+                        self._changed_roots.add(root.path)
+
+                def is_known(filename):
+                    return not any(filename.startswith(dirname + os.sep)
+                                   for dirname in unlisted_dirnames)
+
+                old_listing = self._root_listings.get(root.path)
+                if unlisted_dirnames and old_listing is not None:
+                    # Keep what was last known of the directories that
+                    # couldn't be listed (e.g. they are briefly unreadable),
+                    # so that their files aren't taken to be deleted
+                    new_listing = new_listing.union(
+                        filename for filename in old_listing
+                        if not is_known(filename))
+                if new_listing == old_listing:
+                    continue
+                self._root_listings[root.path] = new_listing
+
+                if old_listing is None:
+                    added_filenames.update(new_listing)
+                    deleted_filenames.update(
+                        filename for filename in self._keypairdb_config
+                        if filename not in new_listing
+                        and root.matches(filename) and is_known(filename))
+                    deleted_filenames.update(
+                        filename for filename in removed_keypairs
+                        if filename not in new_listing
+                        and root.matches(filename) and is_known(filename))
+                else:
+                    added_filenames.update(new_listing - old_listing)
+                    deleted_filenames.update(old_listing - new_listing)
+
+            new_filenames = [filename for filename in added_filenames
+                             if filename not in self._keypairdb_config
+                             and filename not in removed_keypairs
+                             and filename not in self._no_sync]
+            return new_filenames, deleted_filenames
 
     def get_keypair_file_state(self, filename):
         """Return the modified time of a (keypair) file, or False if the file
         isn't currently accessible."""
-        try:
-            return os.path.getmtime(filename)
-        except OSError:
+        file_state = self._get_file_state(filename)
+        if file_state is None:
             return False
+        return file_state.mtime
+
+    def get_keypair_files_state(self, filenames=None):
+        """Return a dictionary storing the state of each keypair file (see
+        get_keypair_file_state()).
 
-    def get_keypair_files_state(self):
-        """Return a dictionary storing the state of each keypair file."""
+        If filenames is given, only the state of those files is collected,
+        without synchronising the keypair database with the keypair roots or
+        changing it in any other way, so that it can be done on another
+        thread than the one changing the database.
+
+        """
+        if filenames is None:
+            filenames = list(self)
         keypair_files_state = {}
 
-        for filename in self:
-            keypair_file_state = self.get_keypair_file_state(filename)
-            keypair_files_state[filename] = keypair_file_state
+        file_states = self._collect_file_states(filenames)
+        for filename, file_state in file_states.iteritems():
+            if file_state is None:
+                keypair_files_state[filename] = False
+            else:
+                keypair_files_state[filename] = file_state.mtime
 
         return keypair_files_state
 
+    def _add_keypair(self, filename, properties):
+        """Add a keypair's properties to the database without validating or
+        saving the configuration."""
+        self._keypairdb_config[filename] = properties
+
+        # The keypair file may be newer than the last scan of its directory
+        self._invalidate_dir(os.path.dirname(filename))
+
+        if self._watcher is not None:
+            self._watcher.watch(os.path.dirname(filename))
+
+        # Untag as removed
+        if filename in self._removed_keypairs:
+            self._removed_keypairs.discard(filename)
+            self._keypairdb_meta_config['removed'].remove(filename)
+
     def import_from_file(self, filename, passphrase=None):
         """Import a keypair to the database from a PEM file containing its
         private key."""
@@ -179,27 +1210,147 @@ class KeypairDB():
         keypair = keypairengine.read(filename, passphrase=passphrase)
         properties['fingerprint'] = keypairengine.fingerprint(keypair)
 
-        # Add this keypair to the keypair database
-        self._keypairdb_config[filename] = properties
-
-        # Untag as removed
-        if filename in self._keypairdb_meta_config['removed']:
-            self._keypairdb_meta_config['removed'].remove(filename)
+        with self._lock:
+            # Add this keypair to the keypair database
+            self._add_keypair(filename, properties)
 
-        # Validate configuration to enforce the default values
-        self._config.validate()
+            # Validate configuration to enforce the default values
+            self._config.validate()
+            self._index_keypair(filename, self._keypairdb_config[filename])
+            self._changed()
 
         # Initial load into the database
-        self.__getitem__(filename)
+        self.refresh(filename)
+
+    def import_many(self, filenames, passphrases=None, threads=None):
+        """Import keypairs to the database from PEM files containing their
+        private keys, yielding a (filename, error) tuple for each file as it
+        is processed, where error is None if the keypair was imported or
+        otherwise the exception raised while reading the file.
+
+        The files are read and fingerprinted on a pool of worker threads (of
+        the given number of threads, defaulting to IMPORT_THREADS) if there
+        are at least IMPORT_POOL_THRESHOLD of them. Threads rather than
+        processes are used as the database is used from multi-threaded
+        processes, which can't safely be forked. The
+        configuration is validated and saved once, when all the files have
+        been processed or the generator is closed.
+
+        Arguments:
+            passphrases: A dictionary mapping filenames to the passphrases of
+                         their private keys.
+
+        """
+        if passphrases is None:
+            passphrases = {}
+        jobs = [(filename, passphrases.get(filename))
+                for filename in filenames]
+
+        if len(jobs) < IMPORT_POOL_THRESHOLD:
+            pool = None
+            results = itertools.imap(_read_keypair_file, jobs)
+        else:
+            pool = ThreadPool(threads or IMPORT_THREADS)
+            results = pool.imap_unordered(_read_keypair_file, jobs)
+
+        imported_filenames = []
+        try:
+            for filename, properties, error in results:
+                if error is None:
+                    properties['added'] = time.time()
+                    properties['on_interchangeable_storage'] = \
+                        self._is_interchangeable(
+                            filename, device=properties['file_identity'][0])
+                    with self._lock:
+                        self._add_keypair(filename, properties)
+                        self._checked[filename] = time.time()
+                    imported_filenames.append(filename)
+                yield filename, error
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+            if imported_filenames:
+                with self._lock:
+                    # Validate configuration to enforce the default values
+                    self._config.validate()
+                    self._changed()
+                    for filename in imported_filenames:
+                        if filename in self._keypairdb_config:
+                            self._index_keypair(
+                                filename, self._keypairdb_config[filename])
+                    self._config.save()
+
+    def record_usage(self, usage):
+        """Record the usage of keypairs, saving the configuration once.
+
+        Arguments:
+            usage: A dictionary mapping keypair filenames to (last_used,
+                   use_count_increment, origins) tuples, where origins is a
+                   set of the auth_url origins the keypair was used with.
+
+        If the configuration can't be saved, the usage isn't recorded (so
+        that it can be recorded again later without being counted twice) and
+        the exception is raised.
+
+        """
+        with self._lock:
+            # Filename -> properties before the usage was recorded
+            previous = {}
+
+            for filename, (last_used, count, origins) in usage.iteritems():
+                try:
+                    properties = self._keypairdb_config[filename]
+                except KeyError:
+                    # Removed in the meantime
+                    continue
+                previous[filename] = properties.dict()
+
+                properties['last_used'] = max(properties['last_used'],
+                                              last_used)
+                properties['use_count'] += count
+                used_origins = properties['used_origins']
+                new_origins = set(origins).difference(used_origins)
+                if new_origins:
+                    properties['used_origins'] = (used_origins
+                                                  + sorted(new_origins))
+                self._index_keypair(filename, properties)
+
+            if previous:
+                self._changed()
+                try:
+                    self._config.save()
+                except Exception:
+                    exc_info = sys.exc_info()
+                    for filename, properties in previous.iteritems():
+                        if filename in self._keypairdb_config:
+                            self._keypairdb_config[filename].update(
+                                properties)
+                            self._index_keypair(
+                                filename, self._keypairdb_config[filename])
+                    self._changed()
+                    raise exc_info[0], exc_info[1], exc_info[2]
 
     def remove(self, filename, persistent=True):
         """Remove a keypair from the database."""
+        with self._lock:
+            self._remove(filename, persistent)
+
+            # Save configuration
+            self._config.save()
+
+    def _remove(self, filename, persistent):
+        """Remove a keypair from the database without saving the
+        configuration."""
         del self._keypairdb_config[filename]
+        self._unindex_keypair(filename)
+        self._checked.pop(filename, None)
+        self._changed()
 
-        # If the keypair file is located in the My Keypairs directory, tag it
-        # as removed so that it isn't automatically re-imported
-        if persistent and os.path.dirname(filename) == self._my_keypairs_dir:
+        # If the keypair file is located in a keypair root (e.g. the My
+        # Keypairs directory), tag it as removed so that it isn't
+        # automatically re-imported
+        if (persistent and filename not in self._removed_keypairs
+            and any(root.contains(filename) for root in self._roots)):
+            self._removed_keypairs.add(filename)
             self._keypairdb_meta_config['removed'].append(filename)
-
-        # Save configuration
-        self._config.save()
@@ -5,7 +5,9 @@ import hashlib
 import os
 import stat
 
+from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
 
 
 def fingerprint(keypair):
@@ -17,6 +19,11 @@ def fingerprint(keypair):
                                           md5_fingerprint[1::2]))
 
 
+def export_public_key(keypair):
+    """Return a keypair's public key in OpenSSH format."""
+    return keypair.publickey().exportKey(format='OpenSSH')
+
+
 def generate():
     """Return a fresh RSA key(pair) object."""
     return RSA.generate(2048)
@@ -80,3 +87,12 @@ def save(keypair, filename, passphrase=None):
 
     # Close file
     file_handle.close()
+
+
+def sign(keypair, message):
+    """Return the base64-encoded PKCS#1 v1.5 signature of the SHA-256 hash of
+    a message."""
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    signer = PKCS1_v1_5.new(keypair)
+    return base64.b64encode(signer.sign(SHA256.new(message)))
@@ -0,0 +1,202 @@
+"""Batch signing of identity assertions."""
+
+from collections import namedtuple
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+from keypairauthclient import authengine
+from keypairauthclient import keypairengine
+
+# Minimum number of signatures for which signing is spread across threads
+SIGN_POOL_THRESHOLD = 32
+
+# Maximum number of signatures per job of a signing thread
+SIGN_CHUNK_SIZE = 16
+
+SignRequest = namedtuple('SignRequest', 'auth_url identity_assertion mode')
+
+SignResult = namedtuple('SignResult', 'request filename fingerprint signature '
+                                      'public_key error')
+
+
+def assertion_message(auth_url, identity_assertion, mode):
+    """Return the message that is signed to assert an identity: the
+    authentication mode, URL and identity assertion, each on a line, encoded
+    as UTF-8. Byte string arguments are taken to be UTF-8 already."""
+    parts = []
+    for part in (mode, auth_url, identity_assertion):
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        parts.append(part)
+    return "\n".join(parts)
+
+
+def _origin(auth_url):
+    auth_url_components = urlparse(auth_url)
+    return auth_url_components[0] + "://" + auth_url_components[1]
+
+
+def _sign_chunk(job):
+    """Sign a chunk of messages with a keypair in a signing thread,
+    returning a list of (index, signature, error) tuples, where error is the
+    exception that prevented signing or None."""
+    keypair, indexed_messages = job
+    try:
+        return [(index, keypairengine.sign(keypair, message), None)
+                for index, message in indexed_messages]
+    except Exception, e:
+        return [(index, None, e) for index, message in indexed_messages]
+
+
+class BatchSigner():
+    """Sign identity assertions for many sites at once, with the keypair
+    most likely to be used with each site.
+
+    Arguments:
+        keypairdb: The KeypairDB to choose keypairs from.
+        usage_tracker: A usage.UsageTracker to rank keypairs with. If None,
+                       keypairs are ranked by their recorded usage.
+        passphrases: A dictionary mapping keypair filenames to the passphrases
+                     of their private keys.
+        threads: Number of signing threads for large batches (see
+                 SIGN_POOL_THRESHOLD), or None for one per CPU. Signing
+                 threads only run in parallel as far as the crypto library
+                 releases the GIL while signing.
+
+    """
+
+    def __init__(self, keypairdb, usage_tracker=None, passphrases=None,
+                 threads=None):
+        self._keypairdb = keypairdb
+        self._usage_tracker = usage_tracker
+        self._passphrases = passphrases if passphrases is not None else {}
+        self._threads = threads
+
+    def choose_keypair(self, auth_url, snapshot=None):
+        """Return the filename of the available keypair to sign for auth_url
+        with, or None if there isn't one. Keypairs that have been used with
+        the auth_url origin are preferred, then the most recently used
+        ones."""
+        if snapshot is None:
+            snapshot = self._keypairdb.snapshot()
+        filenames = [record.filename for record in snapshot
+                     if record.available]
+        if not filenames:
+            return None
+
+        if self._usage_tracker is not None:
+            return self._usage_tracker.rank(filenames, auth_url=auth_url)[0]
+
+        origin = _origin(auth_url)
+
+        def sort_key(filename):
+            record = snapshot[filename]
+            return (origin in record.used_origins, record.last_used,
+                    record.added)
+
+        return max(filenames, key=sort_key)
+
+    def sign(self, requests):
+        """Sign a list of SignRequest (or (auth_url, identity_assertion, mode)
+        tuple) requests, yielding a SignResult for each as they complete.
+
+        Each keypair is read (and decrypted) once per batch. Results of
+        requests that couldn't be signed have their error set to the
+        exception that prevented signing.
+
+        """
+        requests = [SignRequest(*request) for request in requests]
+        snapshot = self._keypairdb.snapshot()
+
+        # Group the requests by the keypair chosen for their origin
+        chosen = {}
+        requests_by_filename = {}
+        for index, request in enumerate(requests):
+            origin = _origin(request.auth_url)
+            if origin not in chosen:
+                chosen[origin] = self.choose_keypair(request.auth_url,
+                                                     snapshot=snapshot)
+            requests_by_filename.setdefault(chosen[origin], []).append(index)
+
+        # Read each keypair once
+        keypairs = {}
+        for filename, indexes in requests_by_filename.iteritems():
+            if filename is None:
+                for index in indexes:
+                    yield SignResult(requests[index], None, None, None, None,
+                                     LookupError("no keypair available"))
+                continue
+            try:
+                keypairs[filename] = keypairengine.read(
+                    filename, passphrase=self._passphrases.get(filename))
+            except Exception, e:
+                for index in indexes:
+                    yield SignResult(requests[index], filename, None, None,
+                                     None, e)
+
+        key_infos = {}
+        for filename, keypair in keypairs.iteritems():
+            key_infos[filename] = (keypairengine.fingerprint(keypair),
+                                   keypairengine.export_public_key(keypair))
+
+        def result(index, filename, signature):
+            request = requests[index]
+            fingerprint, public_key = key_infos[filename]
+            if request.mode != authengine.MODE_REGISTER:
+                public_key = None
+            return SignResult(request, filename, fingerprint, signature,
+                              public_key, None)
+
+        count = sum(len(requests_by_filename[filename])
+                    for filename in keypairs)
+        threads = self._threads
+        if threads is None:
+            threads = multiprocessing.cpu_count()
+        if count < SIGN_POOL_THRESHOLD or threads < 2:
+            for filename, keypair in keypairs.iteritems():
+                for index in requests_by_filename[filename]:
+                    message = assertion_message(*requests[index])
+                    yield result(index, filename,
+                                 keypairengine.sign(keypair, message))
+            return
+
+        # Split the signing into chunks across threads, which share the
+        # keypairs read above, rather than processes, which would have to
+        # decrypt them again (or be sent their private keys) and be forked
+        # from this multi-threaded process
+        jobs = []
+        for filename, keypair in keypairs.iteritems():
+            indexes = requests_by_filename[filename]
+            for start in xrange(0, len(indexes), SIGN_CHUNK_SIZE):
+                indexed_messages = [(index,
+                                     assertion_message(*requests[index]))
+                                    for index
+                                    in indexes[start:start + SIGN_CHUNK_SIZE]]
+                jobs.append((keypair, indexed_messages))
+
+        filename_by_index = {}
+        for filename in keypairs:
+            for index in requests_by_filename[filename]:
+                filename_by_index[index] = filename
+
+        pool = ThreadPool(threads)
+        try:
+            for signatures in pool.imap_unordered(_sign_chunk, jobs):
+                for index, signature, error in signatures:
+                    filename = filename_by_index[index]
+                    if error is None:
+                        yield result(index, filename, signature)
+                    else:
+                        yield SignResult(requests[index], filename,
+                                         key_infos[filename][0], None, None,
+                                         error)
+        finally:
+            pool.terminate()
+
+
+def sign_batch(keypairdb, requests, **kwargs):
+    """Sign a list of (auth_url, identity_assertion, mode) requests with a
+    BatchSigner (see its arguments), yielding SignResults as they
+    complete."""
+    return BatchSigner(keypairdb, **kwargs).sign(requests)
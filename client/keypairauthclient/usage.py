@@ -0,0 +1,157 @@
+"""Keypair usage tracking."""
+
+import atexit
+import threading
+import time
+import traceback
+from urlparse import urlparse
+
+
+def origin(auth_url):
+    """Return the origin (scheme://netloc) of an authentication URL."""
+    auth_url_components = urlparse(auth_url)
+    return auth_url_components[0] + "://" + auth_url_components[1]
+
+
+class UsageTracker():
+    """Record keypair uses in memory and periodically flush them to the keypair
+    database, so that frequent authentications don't each rewrite the
+    configuration.
+
+    Arguments:
+        keypairdb: The KeypairDB to flush usage to.
+        flush_interval: Seconds in between flushes of recorded uses. Recorded
+                        uses are also flushed at exit.
+        half_life: Seconds it takes for the weight of a keypair's uses to
+                   halve when ranking keypairs (see rank()).
+
+    """
+
+    def __init__(self, keypairdb, flush_interval=30, half_life=7 * 86400):
+        self._keypairdb = keypairdb
+        self._flush_interval = flush_interval
+        self._half_life = half_life
+
+        self._lock = threading.Lock()
+        # Keypair filename -> [last used time, use count, set of origins] of
+        # uses not yet flushed to the keypair database
+        self._pending = {}
+
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+        atexit.register(self.flush)
+
+    def record_use(self, filename, auth_url):
+        """Record a use of a keypair to authenticate to auth_url."""
+        now = time.time()
+        with self._lock:
+            try:
+                use = self._pending[filename]
+            except KeyError:
+                use = self._pending[filename] = [now, 0, set()]
+            use[0] = max(use[0], now)
+            use[1] += 1
+            use[2].add(origin(auth_url))
+
+    def flush(self):
+        """Write the recorded uses to the keypair database (which saves it
+        under the configuration's lock).
+
+        If that fails, the uses are kept to be flushed again later and the
+        exception is raised.
+
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+
+        if not pending:
+            return
+        usage = dict((filename, tuple(use))
+                     for filename, use in pending.iteritems())
+        try:
+            self._keypairdb.record_usage(usage)
+        except Exception:
+            # Put the uses back, merged with any recorded in the meantime
+            with self._lock:
+                for filename, use in pending.iteritems():
+                    new_use = self._pending.setdefault(filename, use)
+                    if new_use is not use:
+                        new_use[0] = max(new_use[0], use[0])
+                        new_use[1] += use[1]
+                        new_use[2].update(use[2])
+            raise
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # E.g. the configuration couldn't be saved; the uses are
+                # flushed again next time
+                traceback.print_exc()
+
+    def stop(self):
+        """Stop flushing periodically and flush the recorded uses."""
+        self._stopped.set()
+        self.flush()
+
+    def get_usage(self, filename):
+        """Return a (last_used, use_count, origins) tuple of a keypair's usage,
+        including the uses not yet flushed to the keypair database.
+
+        A keypair that isn't in the keypair database (e.g. it was removed in
+        the meantime) has no flushed uses.
+
+        """
+        snapshot = self._keypairdb.snapshot()
+        if filename in snapshot:
+            record = snapshot[filename]
+            last_used = record.last_used
+            use_count = record.use_count
+            origins = set(record.used_origins)
+        else:
+            last_used, use_count, origins = -1, 0, set()
+
+        with self._lock:
+            use = self._pending.get(filename)
+            if use is not None:
+                last_used = max(last_used, use[0])
+                use_count += use[1]
+                origins.update(use[2])
+
+        return last_used, use_count, origins
+
+    def score(self, filename, now=None):
+        """Return a keypair's ranking score: its use count, weighted by how
+        recently it was last used."""
+        if now is None:
+            now = time.time()
+        last_used, use_count, origins = self.get_usage(filename)
+        if last_used == -1:
+            return 0
+        age = max(0, now - last_used)
+        return use_count * 0.5 ** (age / self._half_life)
+
+    def rank(self, filenames=None, auth_url=None):
+        """Return keypair filenames (all the keypairs in the keypair database
+        by default) sorted from most to least frequently and recently used. If
+        auth_url is given, keypairs that have been used with its origin are
+        ranked first."""
+        if filenames is None:
+            filenames = self._keypairdb.snapshot().filenames
+        now = time.time()
+        if auth_url is not None:
+            auth_origin = origin(auth_url)
+
+        def sort_key(filename):
+            score = self.score(filename, now=now)
+            if auth_url is None:
+                return (score,)
+            used_with_origin = auth_origin in self.get_usage(filename)[2]
+            return (used_with_origin, score)
+
+        return sorted(filenames, key=sort_key, reverse=True)
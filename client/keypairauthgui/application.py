@@ -9,6 +9,8 @@ import urlparse
 from external.configobj import ConfigObj
 from keypairauthclient.config import Config
 from keypairauthclient.keypairdb import KeypairDB
+from keypairauthclient.usage import UsageTracker
+from leaderlock import LeaderLock
 import osdirs
 from pkg_resources import resource_stream
 import wx
@@ -21,8 +23,6 @@ from keypairauthgui.excepthandler import ExceptHandler
 CONFIGSPEC = """
 [ui]
 locale = option('en-int', default='en-int')
-[gui]
-keypair_files_syncer = integer(default=-1)
 """
 
 
@@ -37,6 +37,9 @@ class Application():
                          is watched for additions and deletions. Set to False
                          to disable, or None to allow the application to choose
                          a sensible directory.
+        keypair_roots: List of additional keypairdb.KeypairRoot objects
+                       (directory trees) that are watched for additions and
+                       deletions.
         graphical_except: If set to True, uncaught exceptions are shown as
                           message dialogs.
         config_sync_interval: Seconds to wait in between synchronising the
@@ -45,8 +48,8 @@ class Application():
     """
 
     def __init__(self, cl_args=[], name="KeypairAuth", config_filename=None,
-                 my_keypairs_dir=None, graphical_except=True,
-                 config_sync_interval=1):
+                 my_keypairs_dir=None, keypair_roots=None,
+                 graphical_except=True, config_sync_interval=1):
         # Initialise wxWidgets application
         self._wxapp = wx.App(redirect=False)
         self._wxapp.SetAppName(name)
@@ -64,6 +67,7 @@ class Application():
             config_filename = os.path.join(user_data_dir, "userconfig.ini")
         self._config = Config(filename=config_filename,
                               configspec_string=CONFIGSPEC)
+        self._syncer_lock_filename = config_filename + ".syncer"
 
         # Load locale
         locale_stream = resource_stream('keypairauthgui.res.locales',
@@ -83,7 +87,8 @@ class Application():
 
         # Load keypair database
         self._keypairdb = KeypairDB(self._config,
-                                    my_keypairs_dir=my_keypairs_dir)
+                                    my_keypairs_dir=my_keypairs_dir,
+                                    keypair_roots=keypair_roots)
 
         # Start the needed application
         if len(cl_args) != 2:
@@ -153,14 +158,18 @@ class Application():
 
     def _start_authenticator(self, auth_url, identity_assertion, mode):
         """Start the authentication application."""
+        usage_tracker = UsageTracker(self._keypairdb)
         return authenticator.Authenticator(self._config, self._locale,
                                           self._keypairdb, auth_url,
-                                          identity_assertion, mode)
+                                          identity_assertion, mode,
+                                          usage_tracker=usage_tracker)
 
     def _start_keypairmanager(self):
         """Start the keypair management application."""
+        syncer_lock = LeaderLock(self._syncer_lock_filename)
         return keypairmanager.MainWindow(self._config, self._locale,
-                                         self._keypairdb)
+                                         self._keypairdb,
+                                         syncer_lock=syncer_lock)
 
     def MainLoop(self):
         self._wxapp.MainLoop()
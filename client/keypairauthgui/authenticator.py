@@ -1,11 +1,14 @@
 """Application (invoked by URI) for authenticating to a web application using a
 keypair."""
 
+import threading
 from urlparse import urlparse
 
 import wx
 
 from keypairauthclient import authengine
+from keypairauthclient import keypairengine
+from keypairauthclient import signing
 from keypairauthgui import keypairmanager
 
 
@@ -22,15 +25,20 @@ class Authenticator(wx.Frame):
         mode: Mode of authentication. authengine.MODE_REGISTER sends the server
         a public key in addition to authengine.MODE_AUTH, which sends a plain
         authentication request.
+        usage_tracker: A usage.UsageTracker that keypair uses are recorded to
+                       (once an identity assertion signed with the keypair
+                       has been accepted) and that ranks the keypairs to
+                       preselect the most likely one.
 
     """
 
     def __init__(self, config, locale, keypairdb, auth_url, identity_assertion,
-                 mode):
+                 mode, usage_tracker=None):
         self._config = config
         self._locale = locale
         self._text = locale['text']
         self._keypairdb = keypairdb
+        self._usage_tracker = usage_tracker
         self._auth_url = auth_url
         self._auth_url_components = urlparse(auth_url)
         self._identity_assertion = identity_assertion
@@ -96,6 +104,15 @@ class Authenticator(wx.Frame):
         self.base_boxsizer.Add(self.keypairlistctrl, flag=wx.ALL | wx.EXPAND,
                                border=10, proportion=1)
 
+        # Preselect the most frequently and recently used keypair, preferring
+        # keypairs that have been used with this site before, unless no
+        # keypair has been used (when any choice would be arbitrary)
+        if self._usage_tracker is not None:
+            ranked_filenames = self._usage_tracker.rank(auth_url=auth_url)
+            if (ranked_filenames
+                and self._usage_tracker.score(ranked_filenames[0]) > 0):
+                self.keypairlistctrl.select_filename(ranked_filenames[0])
+
         # Determine "authenticate" button text depending on the authentication
         # mode
         if self._mode == authengine.MODE_REGISTER:
@@ -121,10 +138,88 @@ class Authenticator(wx.Frame):
 
         # Bind events
         self.Bind(wx.EVT_SIZE, self.on_size)
+        self.Bind(wx.EVT_BUTTON, self._on_authenticate,
+                  source=self.authenticate_button)
 
         # Show window
         self.Show()
 
+    def _on_authenticate(self, event):
+        """Sign the identity assertion with the selected keypair and submit
+        it in the background (see _authenticate())."""
+        event.Skip()
+        filename = self.keypairlistctrl.get_selected_filename()
+        if filename is None:
+            return
+
+        # Ask for the passphrase of a passphrased keypair
+        passphrase = None
+        record = self._keypairdb.snapshot()[filename]
+        if record.passphrased == 1:
+            dialog = wx.PasswordEntryDialog(
+                self, self._text['passphrase_message'].format(record.name),
+                self._text['passphrase_caption'])
+            try:
+                if dialog.ShowModal() != wx.ID_OK:
+                    return
+                passphrase = dialog.GetValue()
+            finally:
+                dialog.Destroy()
+
+        self.authenticate_button.Disable()
+        authenticate_thread = threading.Thread(target=self._authenticate,
+                                               args=(filename, passphrase))
+        authenticate_thread.daemon = True
+        authenticate_thread.start()
+
+    def _authenticate(self, filename, passphrase):
+        """Sign the identity assertion with a keypair and submit it to the
+        authentication URL, then call _on_authenticated() on the main thread
+        with the keypair's filename and None if the assertion was accepted (a
+        2xx response) or the reason it wasn't otherwise."""
+        try:
+            keypair = keypairengine.read(filename, passphrase=passphrase)
+            message = signing.assertion_message(self._auth_url,
+                                                self._identity_assertion,
+                                                self._mode)
+            public_key = None
+            if self._mode == authengine.MODE_REGISTER:
+                public_key = keypairengine.export_public_key(keypair)
+            response = authengine.submit_assertion(
+                self._auth_url, self._identity_assertion, self._mode,
+                keypairengine.sign(keypair, message), public_key=public_key)
+        except Exception, e:
+            error = str(e)
+        else:
+            if 200 <= response.status < 300:
+                error = None
+            else:
+                error = "{0} {1}".format(response.status, response.reason)
+        wx.CallAfter(self._on_authenticated, filename, error)
+
+    def _on_authenticated(self, filename, error):
+        """Record the use of a keypair whose identity assertion was
+        accepted and close, or show why it wasn't accepted."""
+        if not self:
+            # Destroyed in the meantime
+            return
+        if error is None:
+            if self._usage_tracker is not None:
+                self._usage_tracker.record_use(filename, self._auth_url)
+            self.Close()
+            return
+
+        self.authenticate_button.Enable()
+        origin = (self._auth_url_components[0] + "://"
+                  + self._auth_url_components[1])
+        dialog = wx.MessageDialog(
+            self, self._text['authentication_failed_message'].format(origin,
+                                                                     error),
+            caption=self._text['authentication_failed_caption'],
+            style=wx.OK | wx.ICON_ERROR)
+        dialog.ShowModal()
+        dialog.Destroy()
+
     def on_size(self, event):
         """Handle a window resize, by correcting the window layout where
         necessary."""
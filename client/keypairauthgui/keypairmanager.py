@@ -1,14 +1,49 @@
 """Keypair management application."""
 
+import bisect
+from multiprocessing.pool import ThreadPool
 import os
 import thread
+import threading
 import time
 
 from keypairauthclient import keypairengine
-from pidexists import pid_exists
 from pkg_resources import resource_stream
 import wx
-from wx.lib.mixins.listctrl import ColumnSorterMixin
+
+# Number of threads the keypair list control looks up keypair properties and
+# file states on, so that slow storage doesn't block the user interface
+LOAD_THREADS = 4
+
+# Seconds a keypair's row is shown as being checked before it is shown as
+# unavailable if its file state hasn't been determined
+LOAD_TIMEOUT = 5
+
+
+def _check_keypair_file(job):
+    """Queue a keypair's properties to be refreshed if they may be out of date
+    and return a (filename, file state) tuple of its keypair file state (see
+    KeypairDB.get_keypair_file_state()), where the file state is None if it
+    couldn't be determined. Run on the keypair list control's load threads,
+    so it must always return for the result to be applied."""
+    keypairdb, filename = job
+    try:
+        keypairdb.refresh_stale([filename])
+        return filename, keypairdb.get_keypair_file_state(filename)
+    except Exception:
+        return filename, None
+
+
+def _collect_keypair_files_state(keypairdb):
+    """Synchronise the keypair database with the keypair roots and return the
+    state of all the keypair files (see KeypairDB.get_keypair_files_state()),
+    or None if it couldn't be collected. Run on the keypair list control's
+    load threads, so it must always return for the result to be applied."""
+    try:
+        filenames = keypairdb.snapshot(sync=True).filenames
+        return keypairdb.get_keypair_files_state(filenames)
+    except Exception:
+        return None
 
 
 class Generate():
@@ -77,13 +112,24 @@ class Generate():
         self._keypairdb.import_from_file(self._filename)
 
         # Immediately load the keypair into the keypair list control if one is
-        # specified
+        # specified (on the main thread)
         if self._keypairlistctrl is not None:
-            self._keypairlistctrl.load_keypair(self._filename)
+            wx.CallAfter(self._keypairlistctrl.load_keypair, self._filename)
+
+
+class KeypairListCtrl(wx.ListCtrl):
+    """Keypair list control.
 
+    The list control is virtual: rows are drawn on demand from a sorted index
+    of the keypairs' properties, so that only the visible rows' text is ever
+    formatted.
 
-class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
-    """Keypair list control."""
+    Keypair properties and file states are looked up on a pool of threads and
+    the results are applied in batches on the main thread. Keypairs are shown
+    as being checked until their file state is known, or as unavailable if it
+    isn't known within LOAD_TIMEOUT seconds.
+
+    """
 
     def __init__(self, config, locale, keypairdb, *args, **kwargs):
         self._config = config
@@ -92,6 +138,7 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
         self._keypairdb = keypairdb
 
         # Initialise
+        kwargs['style'] = kwargs.get('style', wx.LC_REPORT) | wx.LC_VIRTUAL
         wx.ListCtrl.__init__(self, *args, **kwargs)
 
         # Setup columns
@@ -104,10 +151,27 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
         self.InsertColumn(4, self._text['keypairlist_column_encryption'],
                           width=80)
 
-        # Enable sorting of keypairs by column
-        self.itemDataMap = {}  # see ColumnSorterMixin documentation
-        ColumnSorterMixin.__init__(self, 5)
-        self.SortListItems(0, 1)  # sort by keypair name by default
+        # Keypair properties by key, as lists of the values of each column
+        # followed by the keypair's availability, filename and whether it is
+        # being checked. Keys are allocated in increasing order and never
+        # reused
+        self.itemDataMap = {}
+        self._next_data_map_key = 0
+
+        # The sort keys (see self._sort_key()) of the rows in ascending order
+        # and the self.itemDataMap keys of the rows in the same order, so that
+        # rows can be found, inserted and moved by bisection. The rows are
+        # shown in reverse when sorting in descending order. Keypairs are
+        # sorted by name by default
+        self._row_sort_keys = []
+        self._row_keys = []
+        self._sort_column = 0
+        self._sort_ascending = True
+        self.Bind(wx.EVT_LIST_COL_CLICK, self._on_column_click)
+
+        # Attributes of rows of unavailable keypairs
+        self._unavailable_attr = wx.ListItemAttr()
+        self._unavailable_attr.SetTextColour('grey')
 
         # A map to map keypair filenames to their self.itemDataMap keys so that
         # list items can be manipulated directly by knowing the filenames of
@@ -120,113 +184,422 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
         self._keypair_files_state = {}
         self._first_sync = True  # changed to False on the first sync() call
 
+        # Background loading (see _check_keypair_file() and
+        # _collect_keypair_files_state()). Keypair files being checked are
+        # only checked by one thread at a time; files loaded again while
+        # being checked are checked again afterwards
+        self._load_pool = ThreadPool(LOAD_THREADS)
+        self._loads_in_flight = set()
+        self._reloads = set()
+        self._loaded_lock = threading.Lock()
+        self._loaded = []  # results not yet applied on the main thread
+        self._collecting_files_state = False
+        self._recollect_files_state = False
+        self._reload_all = False
+
+        # Filename -> time of rows shown as being checked, and the timer that
+        # shows them as unavailable once they time out
+        self._checking = {}
+        self._expiry_timer = None
+
+        # Reload keypairs when the keypair database refreshes their properties
+        # in the background
+        self._keypairdb.add_refresh_listener(self._on_keypairs_refreshed)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
+
         # Load all keypairs
         self.load_all_keypairs()
 
+    def _on_destroy(self, event):
+        """Stop listening for keypair property refreshes and loading
+        keypairs."""
+        if event.GetEventObject() is self:
+            self._keypairdb.remove_refresh_listener(self._on_keypairs_refreshed)
+            if self._expiry_timer is not None:
+                self._expiry_timer.Stop()
+            # Checks of unresponsive storage may never return; don't wait for
+            # them
+            self._load_pool.close()
+        event.Skip()
+
+    def _on_keypairs_refreshed(self, filenames):
+        """Called from the keypair database's refresher thread when keypairs'
+        properties have been refreshed."""
+        wx.CallAfter(self._reload_keypairs, filenames)
+
+    def _reload_keypairs(self, filenames):
+        """Reload keypairs that are already in the list control."""
+        for filename in filenames:
+            if filename in self._filename_to_data_map_key_map:
+                self.load_keypair(filename)
+
+    def _on_column_click(self, event):
+        """Sort the keypairs by the clicked column, reversing the order if
+        they are already sorted by it."""
+        column = event.GetColumn()
+        if column == self._sort_column:
+            # The rows stay in ascending order; only the order they are shown
+            # in changes
+            selected_filename = self.get_selected_filename()
+            self._sort_ascending = not self._sort_ascending
+            if selected_filename is not None:
+                self.select_filename(selected_filename)
+            self.Refresh()
+        else:
+            self._sort_column = column
+            self._sort_ascending = True
+            self._sort()
+
+    def _sort_key(self, data_map_key):
+        """Return the sort key of a keypair's row."""
+        item_data = self.itemDataMap[data_map_key]
+        return (item_data[self._sort_column], item_data[6])
+
+    def _sort(self):
+        """Sort all the rows and redraw the list control, keeping the selected
+        keypair selected."""
+        selected_filename = self.get_selected_filename()
+        rows = sorted((self._sort_key(data_map_key), data_map_key)
+                      for data_map_key in self.itemDataMap)
+        self._row_sort_keys = [sort_key for sort_key, data_map_key in rows]
+        self._row_keys = [data_map_key for sort_key, data_map_key in rows]
+        self.SetItemCount(len(self._row_keys))
+        if selected_filename is not None:
+            self.select_filename(selected_filename)
+        self.Refresh()
+
+    def _find_row(self, data_map_key):
+        """Return the position of a keypair's row in self._row_keys."""
+        return bisect.bisect_left(self._row_sort_keys,
+                                  self._sort_key(data_map_key))
+
+    def _row_to_item(self, row):
+        """Convert between positions in self._row_keys and item indices of
+        the list control (the conversion is its own inverse)."""
+        if self._sort_ascending:
+            return row
+        return len(self._row_keys) - 1 - row
+
+    def _refresh_rows(self, first_row, last_row):
+        """Redraw the items of a range of rows, given as positions in
+        self._row_keys."""
+        last_row = min(last_row, len(self._row_keys) - 1)
+        if first_row > last_row:
+            return
+        first_item, last_item = sorted((self._row_to_item(first_row),
+                                        self._row_to_item(last_row)))
+        if first_item == last_item:
+            self.RefreshItem(first_item)
+        else:
+            self.RefreshItems(first_item, last_item)
+
+    def _refresh_shifted_rows(self, row):
+        """Redraw the items shifted by inserting or removing a row at a
+        position in self._row_keys."""
+        if self._sort_ascending:
+            self._refresh_rows(row, len(self._row_keys) - 1)
+        else:
+            self._refresh_rows(0, row)
+
+    def _place_row(self, data_map_key, old_row=None):
+        """Insert a keypair's row at its sorted position, or move it there
+        from its old position if old_row is given, redrawing only the items
+        that changed and keeping the selected keypair selected."""
+        sort_key = self._sort_key(data_map_key)
+        if old_row is not None and self._row_sort_keys[old_row] == sort_key:
+            # The row stays where it is
+            self._refresh_rows(old_row, old_row)
+            return
+
+        selected_filename = self.get_selected_filename()
+
+        if old_row is not None:
+            del self._row_sort_keys[old_row]
+            del self._row_keys[old_row]
+        row = bisect.bisect_left(self._row_sort_keys, sort_key)
+        self._row_sort_keys.insert(row, sort_key)
+        self._row_keys.insert(row, data_map_key)
+
+        if old_row is None:
+            self.SetItemCount(len(self._row_keys))
+            self._refresh_shifted_rows(row)
+        else:
+            self._refresh_rows(min(row, old_row), max(row, old_row))
+
+        if selected_filename is not None:
+            self.select_filename(selected_filename)
+
     def _get_item_by_data_map_key(self, data_map_key):
         """Return the index of a keypair item from its self.itemDataMap key."""
-        return self.FindItemData(-1, data_map_key)
-
-    def GetListCtrl(self):
-        return self
+        if data_map_key not in self.itemDataMap:
+            return wx.NOT_FOUND
+        return self._row_to_item(self._find_row(data_map_key))
+
+    def OnGetItemText(self, item, column):
+        """Return the text of a cell of the virtual list control."""
+        item_data = self.itemDataMap[self._row_keys[self._row_to_item(item)]]
+        value = item_data[column]
+
+        if column == 4 and item_data[7]:
+            return self._text['keypairlistctrl_encryption_checking']
+        elif column == 0:
+            return value
+        elif column in (1, 2):
+            if value == -1:
+                return self._text['keypairlistctrl_last_used_never']
+            return time.strftime(self._locale['datetime'],
+                                 time.localtime(value))
+        elif column == 3:
+            # The location format and the filename
+            return value[0].format(value[1])
+        elif column == 4:
+            if value == -1:
+                return self._text['keypairlistctrl_encryption_unknown']
+            elif value:
+                return self._text['keypairlistctrl_encryption_passed']
+            else:
+                return self._text['keypairlistctrl_encryption_none']
+
+    def OnGetItemAttr(self, item):
+        """Return the attributes of a row of the virtual list control."""
+        data_map_key = self._row_keys[self._row_to_item(item)]
+        if not self.itemDataMap[data_map_key][5]:
+            return self._unavailable_attr
+        return None
+
+    def get_selected_filename(self):
+        """Return the filename of the selected keypair, or None if no keypair
+        is selected."""
+        index = self.GetFirstSelected()
+        if index == -1 or index >= len(self._row_keys):
+            return None
+        return self.itemDataMap[self._row_keys[self._row_to_item(index)]][6]
+
+    def select_filename(self, filename):
+        """Select a keypair in the list control by its filename."""
+        item_data_map_key = self._filename_to_data_map_key_map[filename]
+        index = self._get_item_by_data_map_key(item_data_map_key)
+        self.Select(index)
+        self.Focus(index)
 
     def load_all_keypairs(self):
-        """Load all keypairs from the keypair database."""
-        for filename in self._keypairdb:
-            self.load_keypair(filename)
+        """Load all keypairs from the keypair database.
+
+        The keypairs are shown straight away from the keypair database, and
+        updated once the state of their files has been collected in the
+        background.
+
+        """
+        for record in self._keypairdb.snapshot():
+            self._load_record(record, self._keypair_files_state.get(
+                record.filename), sort=False)
+        self._sort()
+        self._collect_files_state(reload_all=True)
+
+        # Refresh any keypairs whose properties may be out of date
+        self._keypairdb.refresh_stale()
 
     def load_keypair(self, filename):
-        """Load a keypair to the list control from the keypair database."""
-        # Get keypair properties configuration object
-        properties = self._keypairdb[filename]
+        """Load a keypair to the list control from the keypair database.
 
-        # Update keypair files state dictionary to prevent re-loading of this
-        # keypair on the next self.sync() call, if this method wasn't called
-        # from self.sync()
-        keypair_file_state = self._keypairdb.get_keypair_file_state(filename)
-        self._keypair_files_state[filename] = keypair_file_state
+        The keypair's properties are looked up and its file checked in the
+        background; a keypair that isn't in the list control yet is shown as
+        being checked until then.
 
-        #
-        # Add keypair properties to self.itemDataMap for sorting
-        #
+        """
+        if filename not in self._filename_to_data_map_key_map:
+            self._load_record(self._keypairdb.snapshot()[filename], None)
+        self._check(filename)
+
+    def _check(self, filename):
+        """Queue a keypair's file to be checked in the background."""
+        if filename in self._loads_in_flight:
+            self._reloads.add(filename)
+            return
+        self._loads_in_flight.add(filename)
+        self._load_pool.apply_async(_check_keypair_file,
+                                    ((self._keypairdb, filename),),
+                                    callback=self._on_checked)
+
+    def _on_checked(self, result):
+        """Called from the load pool when a keypair file has been checked;
+        results are applied in batches on the main thread."""
+        with self._loaded_lock:
+            self._loaded.append(result)
+            if len(self._loaded) > 1:
+                # Already due to be applied
+                return
+        wx.CallAfter(self._apply_checked)
 
-        # Create a new key for the keypair in self.itemDataMap if one doesn't
-        # already exist
-        try:
-            item_data_map_key = self._filename_to_data_map_key_map[filename]
-        except KeyError:
-            try:
-                item_data_map_key = max(self.itemDataMap) + 1
-            except ValueError:
-                item_data_map_key = 0
-            self._filename_to_data_map_key_map[filename] = item_data_map_key
+    def _apply_checked(self):
+        """Load the keypairs whose files have been checked."""
+        if not self:
+            # Destroyed in the meantime
+            return
+        with self._loaded_lock:
+            loaded = self._loaded
+            self._loaded = []
+
+        snapshot = self._keypairdb.snapshot()
+        for filename, keypair_file_state in loaded:
+            if filename not in self._loads_in_flight:
+                # Removed from the list control in the meantime
+                continue
+            self._loads_in_flight.remove(filename)
+
+            # A file whose state couldn't be determined is left as it is
+            # shown (if it is shown as being checked, it times out)
+            if (keypair_file_state is not None and filename in snapshot
+                and filename in self._filename_to_data_map_key_map):
+                self._load_record(snapshot[filename], keypair_file_state)
+
+            if filename in self._reloads:
+                self._reloads.remove(filename)
+                self._check(filename)
+
+    def _collect_files_state(self, reload_all=False):
+        """Collect the state of all the keypair files in the background, then
+        reload all the keypairs if reload_all is True, or the keypairs whose
+        files changed otherwise.
+
+        The keypair database is synchronised with the keypair roots in the
+        background too, so that slow roots don't block the user interface;
+        only the collected states are compared and applied on the main
+        thread.
 
-        item_data = self.itemDataMap[item_data_map_key] = []
+        """
+        self._reload_all = self._reload_all or reload_all
+        if self._collecting_files_state:
+            self._recollect_files_state = True
+            return
+        self._collecting_files_state = True
+        reload_all = self._reload_all
+        self._reload_all = False
+
+        def callback(keypair_files_state):
+            wx.CallAfter(self._on_files_state_collected, keypair_files_state,
+                         reload_all)
+        self._load_pool.apply_async(_collect_keypair_files_state,
+                                    (self._keypairdb,), callback=callback)
+
+    def _on_files_state_collected(self, keypair_files_state, reload_all):
+        """Called on the main thread with the collected state of all the
+        keypair files."""
+        if not self:
+            # Destroyed in the meantime
+            return
+        self._collecting_files_state = False
+
+        if keypair_files_state is not None:
+            if reload_all:
+                # Including keypairs imported by the collection
+                snapshot = self._keypairdb.snapshot()
+                for filename, state in keypair_files_state.iteritems():
+                    if filename in snapshot:
+                        self._load_record(snapshot[filename], state,
+                                          sort=False)
+                self._sort()
+            else:
+                self._sync_files_state(keypair_files_state)
 
-        item_data.append(properties['name'])
-        item_data.append(properties['added'])
-        item_data.append(properties['last_used'])
+        if self._recollect_files_state:
+            self._recollect_files_state = False
+            self._collect_files_state()
 
-        if properties['on_interchangeable_storage'] == -1:
-            item_data.append(self._text['keypairlistctrl_location_unknown']
-                             .format(filename))
-        elif properties['on_interchangeable_storage']:
-            item_data.append(self._text['keypairlistctrl_location_external']
-                             .format(filename))
-        elif not properties['on_interchangeable_storage']:
-            item_data.append(self._text['keypairlistctrl_location_internal']
-                             .format(filename))
+    def _expire_checks(self):
+        """Show the keypairs that have been checked for longer than
+        LOAD_TIMEOUT as unavailable."""
+        if not self:
+            # Destroyed in the meantime
+            return
+        self._expiry_timer = None
+
+        now = time.time()
+        snapshot = self._keypairdb.snapshot()
+        for filename, check_time in self._checking.items():
+            if now - check_time < LOAD_TIMEOUT:
+                continue
+            if filename in snapshot:
+                record = snapshot[filename]._replace(available=False)
+                self._load_record(record, False)
+            else:
+                del self._checking[filename]
 
-        item_data.append(properties['passphrased'])
+        self._schedule_expiry()
 
-        #
-        # Add keypair to the graphical list
-        #
+    def _schedule_expiry(self):
+        """Schedule _expire_checks() for when the row that has been checked
+        for longest times out, if it isn't already scheduled."""
+        if not self._checking or self._expiry_timer is not None:
+            return
+        delay = min(self._checking.itervalues()) + LOAD_TIMEOUT - time.time()
+        self._expiry_timer = wx.CallLater(max(1, int(delay * 1000)),
+                                          self._expire_checks)
 
-        # Get an existing index for the keypair as it may already exist in the
-        # list control
-        index = self._get_item_by_data_map_key(item_data_map_key)
+    def _load_record(self, record, keypair_file_state, sort=True):
+        """Load a keypair to the list control from its
+        keypairdb.KeypairRecord, moving its row to its sorted position if
+        sort is True (otherwise self._sort() must be called afterwards).
 
-        if index == wx.NOT_FOUND:
-            # New item
-            index = self.GetItemCount()
-            self.InsertStringItem(index, item_data[0])
-            self.SetItemData(index, item_data_map_key)
-        else:
-            # Existing item
-            self.SetStringItem(index, 0, item_data[0])
+        The keypair is shown as being checked if keypair_file_state is None
+        (not yet known).
 
-        self.SetStringItem(index, 1,
-                           time.strftime(self._locale['datetime'],
-                                         time.localtime(item_data[1])))
+        """
+        filename = record.filename
+        checking = keypair_file_state is None
 
-        if item_data[2] == -1:
-            self.SetStringItem(index, 2,
-                               self._text['keypairlistctrl_last_used_never'])
+        if checking:
+            self._checking.setdefault(filename, time.time())
+            self._schedule_expiry()
         else:
-            self.SetStringItem(index, 2,
-                               time.strftime(self._locale['datetime'],
-                                             time.localtime(item_data[2])))
-
-        self.SetStringItem(index, 3, item_data[3])
-
-        if item_data[4] == -1:
-            self.SetStringItem(index, 4,
-                               self._text['keypairlistctrl_encryption_unknown']
-                               )
-        elif item_data[4]:
-            self.SetStringItem(index, 4,
-                               self._text['keypairlistctrl_encryption_passed'])
-        elif not item_data[4]:
-            self.SetStringItem(index, 4,
-                               self._text['keypairlistctrl_encryption_none'])
-
-        if properties['available']:
-            self.SetItemTextColour(index, 'black')
+            self._checking.pop(filename, None)
+
+            # Update keypair files state dictionary to prevent re-loading of
+            # this keypair on the next self.sync() call, if this method wasn't
+            # called from self.sync()
+            self._keypair_files_state[filename] = keypair_file_state
+
+        #
+        # Add keypair properties to self.itemDataMap
+        #
+
+        # Create a new key for the keypair in self.itemDataMap if one doesn't
+        # already exist
+        try:
+            item_data_map_key = self._filename_to_data_map_key_map[filename]
+        except KeyError:
+            item_data_map_key = self._next_data_map_key
+            self._next_data_map_key += 1
+            self._filename_to_data_map_key_map[filename] = item_data_map_key
+            old_row = None
         else:
-            self.SetItemTextColour(index, 'grey')
+            old_row = self._find_row(item_data_map_key) if sort else None
+
+        item_data = self.itemDataMap[item_data_map_key] = []
 
-        self.SortListItems()
+        item_data.append(record.name)
+        item_data.append(record.added)
+        item_data.append(record.last_used)
+
+        # The location is formatted when it's drawn; keep its format (shared
+        # by all keypairs) and the filename
+        if checking:
+            location_format = self._text['keypairlistctrl_location_checking']
+        elif record.on_interchangeable_storage == -1:
+            location_format = self._text['keypairlistctrl_location_unknown']
+        elif record.on_interchangeable_storage:
+            location_format = self._text['keypairlistctrl_location_external']
+        elif not record.on_interchangeable_storage:
+            location_format = self._text['keypairlistctrl_location_internal']
+        item_data.append((location_format, filename))
+
+        item_data.append(record.passphrased)
+        item_data.append(record.available)
+        item_data.append(filename)
+        item_data.append(checking)
+
+        if sort:
+            self._place_row(item_data_map_key, old_row)
 
     def purge_dead(self):
         """Remove all keypairs that are no longer in the keypair database from
@@ -238,7 +611,8 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
     def remove(self, filename):
         """Remove a keypair from the list control."""
         item_data_map_key = self._filename_to_data_map_key_map[filename]
-        item = self._get_item_by_data_map_key(item_data_map_key)
+        row = self._find_row(item_data_map_key)
+        selected_filename = self.get_selected_filename()
 
         del self._filename_to_data_map_key_map[filename]
         del self.itemDataMap[item_data_map_key]
@@ -247,19 +621,33 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
             del self._keypair_files_state[filename]
         except KeyError:
             pass
+        self._checking.pop(filename, None)
+        self._loads_in_flight.discard(filename)
+        self._reloads.discard(filename)
 
-        self.DeleteItem(item)
+        del self._row_sort_keys[row]
+        del self._row_keys[row]
+        self.SetItemCount(len(self._row_keys))
+        self._refresh_shifted_rows(row)
+        if selected_filename is not None and selected_filename != filename:
+            self.select_filename(selected_filename)
 
     def sync(self):
         """Synchronise all keypairs with their PEM files.
 
-        The first call to this method doesn't actually synchronise the keypairs
+        The state of the keypair files is collected in the background, and
+        the keypairs whose files changed are then reloaded.
+
+        The first synchronisation doesn't actually synchronise the keypairs
         but does an initial poll of the state of the keypair files for
-        comparison by the next call to this method.
+        comparison by the next synchronisation.
 
         """
-        new_keypair_files_state = self._keypairdb.get_keypair_files_state()
+        self._collect_files_state()
 
+    def _sync_files_state(self, new_keypair_files_state):
+        """Synchronise all keypairs with the collected state of their PEM
+        files (see sync())."""
         if (new_keypair_files_state != self._keypair_files_state
             and not self._first_sync):
 
@@ -293,11 +681,12 @@ class KeypairListCtrl(wx.ListCtrl, ColumnSorterMixin):
 class MainWindow(wx.Frame):
     """Parent keypair management window."""
 
-    def __init__(self, config, locale, keypairdb):
+    def __init__(self, config, locale, keypairdb, syncer_lock=None):
         self._config = config
         self._locale = locale
         self._text = locale['text']
         self._keypairdb = keypairdb
+        self._syncer_lock = syncer_lock
 
         # Initialise window
         wx.Frame.__init__(self, None, title=self._text['keypairmanager_title'],
@@ -449,8 +838,11 @@ class MainWindow(wx.Frame):
         self.statusbar = self.CreateStatusBar()
 
         # Designate this application instance as the keypair files synchroniser
-        # if one doesn't already exist
-        self.config_sync_interval_callback(designate_only=True)
+        # if one doesn't already exist, otherwise take over as soon as the
+        # current synchroniser exits
+        if self._syncer_lock is not None:
+            if self._syncer_lock.elect(callback=self._on_elected_syncer):
+                self._keypairdb.sync_my_keypairs_dir = True
 
         # Setup keypair list control
         self.keypairlistctrl = KeypairListCtrl(self._config, self._locale,
@@ -508,37 +900,44 @@ class MainWindow(wx.Frame):
 
     def _on_quit(self, event):
         """Quit application."""
+        self._keypairdb.unwatch()
+        if self._syncer_lock is not None:
+            # Hand off synchronisation to another running instance
+            self._syncer_lock.release()
         self.Destroy()
 
+    def _on_keypair_dirs_changed(self, changes):
+        """Called from the keypair database's directory watcher thread with a
+        batch of keypair directory changes."""
+        wx.CallAfter(self.keypairlistctrl.sync)
+
     def config_sync_callback(self):
         """Called when the configuration is synchronised."""
         # Reload all the keypairs in the keypair list control
         self.keypairlistctrl.load_all_keypairs()
         self.keypairlistctrl.purge_dead()
 
-    def config_sync_interval_callback(self, designate_only=False):
+    def _on_elected_syncer(self):
+        """Called from the syncer lock's waiting thread when this application
+        instance takes over as the keypair files synchroniser."""
+        self._keypairdb.sync_my_keypairs_dir = True
+        wx.CallAfter(self.config_sync_interval_callback)
+
+    def config_sync_interval_callback(self):
         """Called at the end of every configuration synchronisation
         interval."""
         #
         # Synchronise the keypairs in the keypair list control with their PEM
-        # files and the My Keypairs directory if this application instance's
-        # pid is designated the synchroniser (this is to prevent other running
-        # instances of the application from repeating the same synchronisation
-        # tasks)
+        # files and the My Keypairs directory if this application instance
+        # holds the syncer lock (this is to prevent other running instances of
+        # the application from repeating the same synchronisation tasks)
         #
 
-        if ('keypair_files_syncer' not in self._config['gui']
-            or not pid_exists(self._config['gui']['keypair_files_syncer'])):
-            # Designate this application instance as the synchroniser as one
-            # doesn't already exist
-            self._config['gui']['keypair_files_syncer'] = os.getpid()
-            self._config.save()
-            self._keypairdb.sync_my_keypairs_dir = True
-
-        if designate_only:
+        if self._syncer_lock is None or not self._syncer_lock.held:
             return
 
-        if self._config['gui']['keypair_files_syncer'] == os.getpid():
+        if not self._keypairdb.watching:
+            # Take the initial state of the keypair files, then only
+            # synchronise when the keypair directories change
             self.keypairlistctrl.sync()
-        else:
-            self._keypairdb.sync_my_keypairs_dir = False
+            self._keypairdb.watch(callback=self._on_keypair_dirs_changed)
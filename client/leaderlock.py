@@ -0,0 +1,157 @@
+"""Cross-platform abstraction for electing a leader among application
+instances with an exclusive advisory lock on a lease file.
+
+The instance holding the lock is the leader. The operating system releases the
+lock when its holder exits (or dies), so leadership is handed off without any
+process ID bookkeeping, and a waiting instance takes over straight away.
+
+"""
+
+import errno
+import os
+import threading
+
+imported_msvcrt = False
+imported_fcntl = False
+
+try:
+    # Win32-based operating systems
+    import msvcrt
+    imported_msvcrt = True
+except ImportError:
+    try:
+        # POSIX-based operating systems
+        import fcntl
+        imported_fcntl = True
+    except ImportError:
+        raise ImportError("no implementation could be imported")
+
+
+def _lock_win32(fd, blocking):
+    mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            # LK_LOCK only retries for 10 seconds, so keep retrying
+            msvcrt.locking(fd, mode, 1)
+            return True
+        except IOError, e:
+            if e.errno not in (errno.EACCES, errno.EDEADLK):
+                raise
+            if not blocking:
+                return False
+
+
+def _unlock_win32(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _lock_posix(fd, blocking):
+    operation = fcntl.LOCK_EX
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+    while True:
+        try:
+            fcntl.flock(fd, operation)
+            return True
+        except IOError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+
+
+def _unlock_posix(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _lock(*args, **kwargs):
+    if imported_msvcrt:
+        return _lock_win32(*args, **kwargs)
+    elif imported_fcntl:
+        return _lock_posix(*args, **kwargs)
+
+
+def _unlock(*args, **kwargs):
+    if imported_msvcrt:
+        return _unlock_win32(*args, **kwargs)
+    elif imported_fcntl:
+        return _unlock_posix(*args, **kwargs)
+
+
+class LeaderLock():
+    """Leadership among the application instances sharing a lease file.
+
+    Arguments:
+        filename: Path to the lease file. It is created if it doesn't exist,
+                  and is never written to.
+
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._fd = None
+        self._waiter = None
+
+    @property
+    def held(self):
+        """True if this instance is the leader."""
+        return self._fd is not None
+
+    def _open(self):
+        return os.open(self._filename, os.O_RDWR | os.O_CREAT, 0600)
+
+    def acquire(self, blocking=False):
+        """Try to become the leader, returning True on success. If blocking is
+        True, wait until the current leader releases the lock."""
+        with self._lock:
+            if self._fd is not None:
+                return True
+        fd = self._open()
+        try:
+            locked = _lock(fd, blocking)
+        except:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        with self._lock:
+            if self._fd is None:
+                self._fd = fd
+                return True
+        # Acquired concurrently through another file descriptor
+        _unlock(fd)
+        os.close(fd)
+        return True
+
+    def elect(self, callback=None):
+        """Become the leader now if possible, otherwise wait in the background
+        to take over when the current leader releases the lock, then call
+        callback (from the waiting thread). Return True if this instance is
+        the leader on return."""
+        if self.acquire():
+            return True
+
+        def wait():
+            self.acquire(blocking=True)
+            if callback is not None:
+                callback()
+
+        if self._waiter is None:
+            self._waiter = threading.Thread(target=wait)
+            self._waiter.daemon = True
+            self._waiter.start()
+        return False
+
+    def release(self):
+        """Give up leadership, handing it off to a waiting instance."""
+        with self._lock:
+            fd = self._fd
+            self._fd = None
+        if fd is not None:
+            _unlock(fd)
+            os.close(fd)
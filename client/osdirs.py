@@ -1,27 +1,113 @@
 """Abstractions for getting OS-specific directories.
 
-Note: at present this module is only designed for usage by wxPython
-applications and therefore relies on wxPython. In the future this module will
-be updated to use the core operating system APIs instead, to allow support for
-non-wxPython applications.
+On Linux and other freedesktop.org-based systems directories are resolved
+natively following the XDG Base Directory and xdg-user-dirs specifications,
+so that this module can be used without wxPython. Elsewhere wxPython's
+wx.StandardPaths is used; it is only imported when needed.
 
 """
 
-import wx
+import os
+import sys
+
+# Directory name -> resolved directory, as resolving involves reading files
+_resolved_dirs = {}
+
+
+def _is_xdg():
+    return os.name == 'posix' and sys.platform != 'darwin'
+
+
+def _wx_standard_paths():
+    import wx
+    return wx.StandardPaths.Get()
+
+
+def _get_xdg_base_dir(variable, default):
+    """Return an XDG base directory from its environment variable, or default
+    (relative to the home directory) if it is unset or not absolute."""
+    directory = os.environ.get(variable, '')
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.expanduser('~'), default)
+    return directory
+
+
+def _read_xdg_user_dirs():
+    """Return a dictionary mapping the XDG user directory names (e.g.
+    'DOCUMENTS') to their paths, as configured in the user-dirs.dirs file."""
+    home = os.path.expanduser('~')
+    config_home = _get_xdg_base_dir('XDG_CONFIG_HOME', '.config')
+    user_dirs = {}
+    try:
+        f = open(os.path.join(config_home, 'user-dirs.dirs'))
+    except IOError:
+        return user_dirs
+
+    with f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') or '=' not in line:
+                continue
+            variable, value = line.split('=', 1)
+            if not (variable.startswith('XDG_') and variable.endswith('_DIR')):
+                continue
+            value = value.strip()
+            if len(value) < 2 or value[0] != '"' or value[-1] != '"':
+                continue
+            # Values are either absolute or relative to $HOME, as a shell
+            # string without any other expansions
+            value = value[1:-1].replace('\\', '')
+            if value.startswith('$HOME'):
+                value = home + value[5:]
+            elif not value.startswith('/'):
+                continue
+            user_dirs[variable[4:-4]] = os.path.normpath(value)
+    return user_dirs
 
 
 def get_documents_dir():
     """Return the directory containing the current user's documents."""
-    return wx.StandardPaths.Get().GetDocumentsDir()
+    try:
+        return _resolved_dirs['documents']
+    except KeyError:
+        pass
+
+    if _is_xdg():
+        # The home directory is the specified fallback when the documents
+        # directory isn't configured
+        documents_dir = _read_xdg_user_dirs().get('DOCUMENTS',
+                                                  os.path.expanduser('~'))
+    else:
+        documents_dir = _wx_standard_paths().GetDocumentsDir()
+
+    _resolved_dirs['documents'] = documents_dir
+    return documents_dir
 
 
 def get_user_data_dir(appname):
     """Return the directory for the user-dependent application data files.
 
-    Note: at present the appname argument is ignored as wxPython deals with it.
-    It is required for future compatibility (see the comment at the top of this
-    file). Therefore input appname should be the same as the wx.app AppName to
-    ensure future compatibility.
+    Note: on systems where wxPython is used the appname argument is ignored as
+    wxPython deals with it. Therefore input appname should be the same as the
+    wx.app AppName.
 
     """
-    return wx.StandardPaths.Get().GetUserDataDir()
+    try:
+        return _resolved_dirs['user_data', appname]
+    except KeyError:
+        pass
+
+    if _is_xdg():
+        # Keep using the directory used by earlier versions (through
+        # wx.StandardPaths) if it exists
+        user_data_dir = os.path.join(os.path.expanduser('~'), '.' + appname)
+        if not os.path.isdir(user_data_dir):
+            user_data_dir = os.path.join(
+                _get_xdg_base_dir('XDG_DATA_HOME', os.path.join('.local',
+                                                                'share')),
+                appname)
+    else:
+        user_data_dir = _wx_standard_paths().GetUserDataDir()
+
+    _resolved_dirs['user_data', appname] = user_data_dir
+    return user_data_dir
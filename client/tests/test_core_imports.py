@@ -0,0 +1,63 @@
+"""Tests that the core of the client can be used without wxPython."""
+
+import os
+import subprocess
+import sys
+import unittest
+
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = ("keypairauthclient", "keypairauthclient.authengine",
+                "keypairauthclient.config", "keypairauthclient.keypairdb",
+                "keypairauthclient.keypairengine", "keypairauthclient.signing",
+                "keypairauthclient.usage", "dicttools", "dirwatch",
+                "drives", "osdirs")
+
+# Run in a fresh process, so that nothing else has imported wx already. Any
+# import of wx fails, as if wxPython weren't installed, and is reported
+LOAD_CORE = """
+import sys
+
+class WxBlocker(object):
+    attempts = []
+
+    def find_module(self, name, path=None):
+        if name == 'wx' or name.startswith('wx.'):
+            self.attempts.append(name)
+            return self
+
+    def load_module(self, name):
+        raise ImportError("wx is blocked: " + name)
+
+sys.meta_path.insert(0, WxBlocker())
+for name in {modules!r}:
+    __import__(name)
+
+import osdirs
+osdirs.get_documents_dir()
+osdirs.get_user_data_dir("KeypairAuth")
+
+assert not WxBlocker.attempts, "wx was imported: %r" % WxBlocker.attempts
+assert 'wx' not in sys.modules
+""".format(modules=CORE_MODULES)
+
+
+class CoreImportsTest(unittest.TestCase):
+
+    def test_core_modules_dont_load_wx(self):
+        try:
+            import Crypto
+        except ImportError:
+            self.skipTest("PyCrypto is unavailable")
+        if os.name != 'posix' or sys.platform == 'darwin':
+            self.skipTest("directories are resolved with wxPython here")
+
+        process = subprocess.Popen([sys.executable, "-c", LOAD_CORE],
+                                   cwd=CLIENT_DIR, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
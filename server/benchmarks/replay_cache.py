@@ -0,0 +1,74 @@
+"""Benchmark the replay caches.
+
+Millions of distinct assertions arriving over simulated time are added to the
+in-memory replay cache (and fewer to the disk-backed one), interleaved with
+replays, and the operations per second and memory usage are reported.
+
+Usage: python -m benchmarks.replay_cache [assertions] [disk_assertions]
+
+"""
+
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from keypairauthserver.replay import DiskReplayCache, ReplayCache
+
+
+def get_rss():
+    """Return the resident set size of this process in kilobytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_cache(cache, count, rate=5000):
+    """Add count assertions at rate assertions per simulated second, each
+    followed by a replay of an earlier one, returning statistics."""
+    start_rss = get_rss()
+    start_time = time.time()
+    fresh = 0
+    replays_rejected = 0
+    for i in xrange(count):
+        now = 1000000 + float(i) / rate
+        if cache.add("assertion" + str(i), now=now):
+            fresh += 1
+        if not cache.add("assertion" + str(i // 2), now=now):
+            replays_rejected += 1
+    elapsed = time.time() - start_time
+    return {'operations_per_second': 2 * count / elapsed,
+            'fresh': fresh,
+            'replays_rejected': replays_rejected,
+            'entries': len(cache),
+            'rss_growth_kb': get_rss() - start_rss}
+
+
+def run(count=2000000, disk_count=100000):
+    report = {}
+    report['memory'] = run_cache(ReplayCache(window=300, bucket_seconds=10,
+                                             max_entries=1000000), count)
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = DiskReplayCache(os.path.join(dirname, "replay.db"),
+                                window=300, bucket_seconds=10,
+                                max_entries=1000000)
+        report['disk'] = run_cache(cache, disk_count)
+        cache.close()
+    finally:
+        shutil.rmtree(dirname)
+    return report
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    disk_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    print json.dumps(run(count, disk_count), indent=2, sort_keys=True)
@@ -0,0 +1,75 @@
+"""Benchmark the throughput of identity assertion verification.
+
+Assertions signed with a number of keypairs are verified one by one and in a
+batch, with the parsed key cache enabled and disabled (so that every
+verification parses its key).
+
+Usage: python -m benchmarks.verification_throughput [assertions] [keypairs]
+
+"""
+
+import base64
+import json
+import sys
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from keypairauthserver.keystore import PublicKeyStore
+from keypairauthserver.verification import (assertion_message, verify,
+                                            verify_many)
+
+
+def make_assertions(count, keypairs):
+    """Return a dictionary mapping fingerprints to registered public keys, and
+    a list of count assertions signed with keypairs keypairs."""
+    keystore = PublicKeyStore()
+    signers = []
+    for i in xrange(keypairs):
+        keypair = RSA.generate(2048)
+        fingerprint = keystore.register(
+            keypair.publickey().exportKey(format='OpenSSH'))
+        signers.append((fingerprint, PKCS1_v1_5.new(keypair)))
+
+    # Signing is slow, so sign one assertion per keypair and repeat them
+    signed = []
+    for fingerprint, signer in signers:
+        message_args = ("https://example.com/login", fingerprint, 'auth')
+        signature = base64.b64encode(
+            signer.sign(SHA256.new(assertion_message(*message_args))))
+        signed.append((fingerprint,) + message_args + (signature,))
+    assertions = [signed[i % keypairs] for i in xrange(count)]
+    return keystore._backend, assertions
+
+
+def run(count=10000, keypairs=100):
+    public_keys, assertions = make_assertions(count, keypairs)
+    report = {}
+    for cache_size in (1024, 0):
+        keystore = PublicKeyStore(backend=public_keys, cache_size=cache_size)
+        name = 'cached' if cache_size else 'uncached'
+
+        start_time = time.time()
+        for assertion in assertions:
+            if not verify(keystore, *assertion):
+                raise RuntimeError("verification failed")
+        single_elapsed = time.time() - start_time
+
+        start_time = time.time()
+        if not all(verify_many(keystore, assertions)):
+            raise RuntimeError("verification failed")
+        batch_elapsed = time.time() - start_time
+
+        report[name] = {'single_verifications_per_second':
+                            count / single_elapsed,
+                        'batch_verifications_per_second':
+                            count / batch_elapsed}
+    return report
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    keypairs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print json.dumps(run(count, keypairs), indent=2, sort_keys=True)
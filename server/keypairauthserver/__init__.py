@@ -0,0 +1,3 @@
+"""Server-side modules for the KeypairAuth web-based keypair authentication
+system, for storing the public keys registered by clients and verifying the
+identity assertions they sign."""
@@ -0,0 +1,90 @@
+"""Storage of registered public keys."""
+
+import base64
+from collections import OrderedDict
+import hashlib
+import threading
+
+from Crypto.PublicKey import RSA
+
+
+def fingerprint(public_key):
+    """Return the SSH-format fingerprint of an OpenSSH-format public key (the
+    same fingerprint as the client's keypairengine.fingerprint())."""
+    raw_key = base64.b64decode(public_key.split(" ")[1])
+    md5_fingerprint = hashlib.md5(raw_key).hexdigest()
+    return ":".join(a + b for a, b in zip(md5_fingerprint[::2],
+                                          md5_fingerprint[1::2]))
+
+
+class PublicKeyStore():
+    """Registered public keys stored by their fingerprint, with a bounded LRU
+    cache of parsed key objects so that they aren't parsed on every
+    verification.
+
+    Arguments:
+        backend: A dictionary-like object mapping fingerprints to
+                 OpenSSH-format public keys (e.g. a shelve.Shelf to persist
+                 them), or None for an in-memory dictionary.
+        cache_size: Maximum number of parsed keys to keep cached.
+
+    """
+
+    def __init__(self, backend=None, cache_size=1024):
+        self._backend = backend if backend is not None else {}
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        # Fingerprint -> parsed key, least recently used first
+        self._cache = OrderedDict()
+
+    def register(self, public_key):
+        """Store an OpenSSH-format public key, returning its fingerprint."""
+        key = RSA.importKey(public_key)
+        if key.has_private():
+            raise ValueError("a public key must be registered, not a private "
+                             "key")
+        key_fingerprint = fingerprint(public_key)
+        with self._lock:
+            self._backend[key_fingerprint] = public_key
+            self._cache_key(key_fingerprint, key)
+        return key_fingerprint
+
+    def unregister(self, key_fingerprint):
+        """Remove the public key with a fingerprint."""
+        with self._lock:
+            self._cache.pop(key_fingerprint, None)
+            del self._backend[key_fingerprint]
+
+    def __contains__(self, key_fingerprint):
+        return key_fingerprint in self._backend
+
+    def _cache_key(self, key_fingerprint, key):
+        """Add a parsed key to the cache, evicting the least recently used
+        key if it is full. Must be called with the lock held."""
+        if self._cache_size <= 0:
+            return
+        self._cache.pop(key_fingerprint, None)
+        self._cache[key_fingerprint] = key
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, key_fingerprint):
+        """Return the parsed public key with a fingerprint, or None if there
+        isn't one."""
+        with self._lock:
+            try:
+                key = self._cache.pop(key_fingerprint)
+            except KeyError:
+                pass
+            else:
+                # Move it to the most recently used end
+                self._cache[key_fingerprint] = key
+                return key
+
+        public_key = self._backend.get(key_fingerprint)
+        if public_key is None:
+            return None
+        key = RSA.importKey(public_key)
+        with self._lock:
+            self._cache_key(key_fingerprint, key)
+        return key
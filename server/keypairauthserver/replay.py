@@ -0,0 +1,234 @@
+"""Detection of replayed identity assertions."""
+
+from collections import deque
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+
+def _digest(assertion):
+    """Return a fixed-size digest of an assertion to remember it by."""
+    if isinstance(assertion, unicode):
+        assertion = assertion.encode('utf-8')
+    return hashlib.sha1(assertion).digest()[:16]
+
+
+class _ReplayCacheBase(object):
+    """Shared logic of the replay caches, which remember assertions in time
+    buckets and forget whole buckets once they leave the replay window.
+
+    Arguments:
+        window: Seconds for which assertions are remembered.
+        bucket_seconds: Seconds of time covered by each bucket.
+        max_entries: Maximum number of assertions remembered. When the cache
+                     is full the oldest bucket is forgotten early, and
+                     assertions issued before the remaining buckets (see
+                     add()) are rejected, as they can no longer be checked.
+
+    """
+
+    def __init__(self, window=300, bucket_seconds=10, max_entries=1000000):
+        self._window = window
+        self._bucket_seconds = bucket_seconds
+        self._bucket_count = int(math.ceil(float(window) / bucket_seconds)) + 1
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # Bucket number before which assertions have been forgotten early
+        self._horizon_bucket = None
+
+    def _bucket(self, now):
+        return int(now // self._bucket_seconds)
+
+    def _oldest_live_bucket(self, bucket):
+        """Return the oldest bucket number still in the window at bucket."""
+        oldest = bucket - self._bucket_count + 1
+        if self._horizon_bucket is not None:
+            oldest = max(oldest, self._horizon_bucket)
+        return oldest
+
+    def add(self, assertion, issued_at=None, now=None):
+        """Remember an assertion, returning True if it is fresh, or False if
+        it is a replay (or can't be told apart from one).
+
+        Arguments:
+            assertion: The assertion string (e.g. the signature of a signed
+                       identity assertion).
+            issued_at: Time the assertion was issued, if known. Assertions
+                       issued before the replay window (or before the buckets
+                       forgotten early) are rejected.
+            now: The current time, for testing.
+
+        """
+        if now is None:
+            now = time.time()
+        bucket = self._bucket(now)
+        digest = _digest(assertion)
+        with self._lock:
+            self._expire(bucket)
+            if issued_at is not None:
+                if (issued_at < now - self._window
+                    or self._bucket(issued_at)
+                       < self._oldest_live_bucket(bucket)):
+                    return False
+            if self._contains(digest, self._oldest_live_bucket(bucket)):
+                return False
+            while self._entry_count() >= self._max_entries:
+                if not self._forget_oldest_bucket(bucket):
+                    # Every remembered assertion is from the current bucket;
+                    # fail closed rather than forget it
+                    return False
+            self._insert(digest, bucket)
+            return True
+
+    def __contains__(self, assertion):
+        bucket = self._bucket(time.time())
+        with self._lock:
+            return self._contains(_digest(assertion),
+                                  self._oldest_live_bucket(bucket))
+
+    def __len__(self):
+        with self._lock:
+            return self._entry_count()
+
+
+class ReplayCache(_ReplayCacheBase):
+    """In-memory replay cache (see _ReplayCacheBase for the arguments).
+
+    Insertion and lookup cost a dictionary operation each; forgetting a bucket
+    costs its size, once.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        _ReplayCacheBase.__init__(self, *args, **kwargs)
+        # Digest -> bucket number
+        self._seen = {}
+        # (bucket number, list of digests) tuples, oldest first
+        self._buckets = deque()
+
+    def _expire(self, bucket):
+        oldest = self._oldest_live_bucket(bucket)
+        while self._buckets and self._buckets[0][0] < oldest:
+            self._drop_bucket()
+
+    def _drop_bucket(self):
+        bucket_number, digests = self._buckets.popleft()
+        seen = self._seen
+        for digest in digests:
+            if seen.get(digest) == bucket_number:
+                del seen[digest]
+
+    def _forget_oldest_bucket(self, bucket):
+        if not self._buckets or self._buckets[0][0] >= bucket:
+            return False
+        self._horizon_bucket = self._buckets[0][0] + 1
+        self._drop_bucket()
+        return True
+
+    def _contains(self, digest, oldest):
+        return self._seen.get(digest, oldest - 1) >= oldest
+
+    def _insert(self, digest, bucket):
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, []))
+        self._buckets[-1][1].append(digest)
+        self._seen[digest] = bucket
+
+    def _entry_count(self):
+        return len(self._seen)
+
+
+class DiskReplayCache(_ReplayCacheBase):
+    """Replay cache stored in an SQLite database file, so that it can be
+    shared by the processes of a multi-process server (see _ReplayCacheBase
+    for the other arguments).
+
+    Arguments:
+        filename: Path to the database file.
+        timeout: Seconds to wait for other processes' locks on the database.
+
+    """
+
+    def __init__(self, filename, window=300, bucket_seconds=10,
+                 max_entries=1000000, timeout=5):
+        _ReplayCacheBase.__init__(self, window=window,
+                                  bucket_seconds=bucket_seconds,
+                                  max_entries=max_entries)
+        self._transaction_lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, timeout=timeout,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS seen "
+                                 "(digest BLOB PRIMARY KEY, "
+                                 "bucket INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS seen_bucket "
+                                 "ON seen (bucket)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS buckets "
+                                 "(bucket INTEGER PRIMARY KEY, "
+                                 "count INTEGER NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS horizon "
+                                 "(id INTEGER PRIMARY KEY, "
+                                 "bucket INTEGER NOT NULL)")
+
+    def add(self, *args, **kwargs):
+        # Make the check and insertion atomic across threads and processes
+        with self._transaction_lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute("SELECT bucket FROM horizon "
+                                               "WHERE id = 0").fetchone()
+                self._horizon_bucket = row[0] if row is not None else None
+                fresh = _ReplayCacheBase.add(self, *args, **kwargs)
+            except:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        return fresh
+
+    def _expire(self, bucket):
+        oldest = self._oldest_live_bucket(bucket)
+        self._connection.execute("DELETE FROM seen WHERE bucket < ?",
+                                 (oldest,))
+        self._connection.execute("DELETE FROM buckets WHERE bucket < ?",
+                                 (oldest,))
+
+    def _forget_oldest_bucket(self, bucket):
+        row = self._connection.execute("SELECT MIN(bucket) FROM "
+                                       "buckets").fetchone()
+        if row[0] is None or row[0] >= bucket:
+            return False
+        self._horizon_bucket = row[0] + 1
+        self._connection.execute("INSERT OR REPLACE INTO horizon "
+                                 "(id, bucket) VALUES (0, ?)",
+                                 (self._horizon_bucket,))
+        self._expire(bucket)
+        return True
+
+    def _contains(self, digest, oldest):
+        row = self._connection.execute("SELECT bucket FROM seen WHERE "
+                                       "digest = ?",
+                                       (buffer(digest),)).fetchone()
+        return row is not None and row[0] >= oldest
+
+    def _insert(self, digest, bucket):
+        self._connection.execute("INSERT OR REPLACE INTO seen (digest, "
+                                 "bucket) VALUES (?, ?)",
+                                 (buffer(digest), bucket))
+        if self._connection.execute("UPDATE buckets SET count = count + 1 "
+                                    "WHERE bucket = ?",
+                                    (bucket,)).rowcount == 0:
+            self._connection.execute("INSERT INTO buckets (bucket, count) "
+                                     "VALUES (?, 1)", (bucket,))
+
+    def _entry_count(self):
+        row = self._connection.execute("SELECT SUM(count) FROM "
+                                       "buckets").fetchone()
+        return row[0] or 0
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
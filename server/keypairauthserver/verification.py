@@ -0,0 +1,75 @@
+"""Verification of signed identity assertions."""
+
+import base64
+import binascii
+
+from Crypto.Hash import SHA256
+from Crypto.Signature import PKCS1_v1_5
+
+
+def assertion_message(auth_url, identity_assertion, mode):
+    """Return the message that the client signs to assert an identity: the
+    authentication mode, URL and identity assertion, each on a line, encoded
+    as UTF-8. Byte string arguments are taken to be UTF-8 already.
+
+    This must stay the same as the client's signing.assertion_message().
+
+    """
+    parts = []
+    for part in (mode, auth_url, identity_assertion):
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        parts.append(part)
+    return "\n".join(parts)
+
+
+def _verify_signature(key, message, signature):
+    try:
+        raw_signature = base64.b64decode(signature)
+    except (TypeError, binascii.Error):
+        return False
+    return bool(PKCS1_v1_5.new(key).verify(SHA256.new(message),
+                                           raw_signature))
+
+
+def verify(keystore, fingerprint, auth_url, identity_assertion, mode,
+           signature):
+    """Return True if an identity assertion was signed with the registered
+    key with a fingerprint.
+
+    Arguments:
+        keystore: The keystore.PublicKeyStore of the registered keys.
+        fingerprint: SSH-format fingerprint of the signing key.
+        auth_url: The authentication URL the assertion was signed for.
+        identity_assertion: The identity assertion string.
+        mode: The authentication mode the assertion was signed for.
+        signature: Base64-encoded signature.
+
+    """
+    key = keystore.get(fingerprint)
+    if key is None:
+        return False
+    return _verify_signature(key,
+                             assertion_message(auth_url, identity_assertion,
+                                               mode),
+                             signature)
+
+
+def verify_many(keystore, assertions):
+    """Verify a list of (fingerprint, auth_url, identity_assertion, mode,
+    signature) assertions (see verify()), returning a list of the results in
+    the same order. Each key is looked up once per batch."""
+    keys = {}
+    results = []
+    for (fingerprint, auth_url, identity_assertion, mode,
+         signature) in assertions:
+        try:
+            key = keys[fingerprint]
+        except KeyError:
+            key = keys[fingerprint] = keystore.get(fingerprint)
+        if key is None:
+            results.append(False)
+            continue
+        message = assertion_message(auth_url, identity_assertion, mode)
+        results.append(_verify_signature(key, message, signature))
+    return results
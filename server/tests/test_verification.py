@@ -0,0 +1,87 @@
+"""Tests that identity assertions signed by the client verify."""
+
+import json
+import os
+import sys
+import unittest
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), "client")
+
+try:
+    from keypairauthserver.keystore import PublicKeyStore
+    from keypairauthserver import verification
+    sys.path.insert(0, CLIENT_DIR)
+    try:
+        from keypairauthclient import authengine
+        from keypairauthclient import keypairengine
+        from keypairauthclient import signing
+    finally:
+        sys.path.remove(CLIENT_DIR)
+    imported_dependencies = True
+except ImportError:
+    imported_dependencies = False
+
+AUTH_URL = u"https://\u00e9xample.com/l\u00f6gin?n\u00e4me=\u2603"
+IDENTITY_ASSERTION = u"j\u00fcrgen@\u00e9xample.com \u6771\u4eac"
+
+
+@unittest.skipUnless(imported_dependencies, "PyCrypto is unavailable")
+class ClientSignatureTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.keypair = keypairengine.generate()
+        cls.keystore = PublicKeyStore()
+        cls.fingerprint = cls.keystore.register(
+            keypairengine.export_public_key(cls.keypair))
+
+    def sign(self, auth_url, identity_assertion, mode):
+        return keypairengine.sign(
+            self.keypair,
+            signing.assertion_message(auth_url, identity_assertion, mode))
+
+    def test_non_ascii_assertion_round_trips(self):
+        # The client may sign UTF-8 byte strings or unicode, while the server
+        # gets unicode from the submitted JSON
+        for encode in (lambda text: text,
+                       lambda text: text.encode('utf-8')):
+            signature = self.sign(encode(AUTH_URL),
+                                  encode(IDENTITY_ASSERTION),
+                                  authengine.MODE_AUTH)
+            submission = json.loads(json.dumps(
+                {'auth_url': AUTH_URL,
+                 'identity_assertion': IDENTITY_ASSERTION,
+                 'mode': authengine.MODE_AUTH,
+                 'signature': signature}))
+            self.assertTrue(verification.verify(
+                self.keystore, self.fingerprint, submission['auth_url'],
+                submission['identity_assertion'], submission['mode'],
+                submission['signature']))
+            self.assertEqual(
+                verification.verify_many(
+                    self.keystore,
+                    [(self.fingerprint, AUTH_URL.encode('utf-8'),
+                      IDENTITY_ASSERTION, authengine.MODE_AUTH, signature)]),
+                [True])
+
+    def test_changed_assertion_doesnt_verify(self):
+        signature = self.sign(AUTH_URL, IDENTITY_ASSERTION,
+                              authengine.MODE_AUTH)
+        self.assertFalse(verification.verify(
+            self.keystore, self.fingerprint, AUTH_URL,
+            IDENTITY_ASSERTION + u"\u00e9", authengine.MODE_AUTH, signature))
+        self.assertFalse(verification.verify(
+            self.keystore, self.fingerprint, AUTH_URL, IDENTITY_ASSERTION,
+            authengine.MODE_REGISTER, signature))
+
+    def test_messages_match_the_client(self):
+        for args in ((AUTH_URL, IDENTITY_ASSERTION, u"auth"),
+                     (AUTH_URL.encode('utf-8'), IDENTITY_ASSERTION, "auth"),
+                     ("https://example.com/", "plain", "register")):
+            self.assertEqual(verification.assertion_message(*args),
+                             signing.assertion_message(*args))
+
+
+if __name__ == '__main__':
+    unittest.main()